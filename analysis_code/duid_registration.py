@@ -1,40 +1,80 @@
+from datetime import datetime, timedelta, timezone
 from math import nan
 from pathlib import Path
+from typing import List, Tuple
 
 import numpy as np
 import pandas as pd
 from mms_monthly_cli.mms_monthly import get_and_unzip_table_csv
 
 from .rebidding_analysis import get_gen_tech_mapping
+from .reference_data import REFERENCE_CACHE_DIR, get_cached_reference_table
 
+# Market time
+NEM_TZ = timezone(timedelta(hours=10))
 
-def _get_dispatchable_unit(raw_data_loc: Path) -> pd.DataFrame:
-    get_and_unzip_table_csv(2022, 1, "DATA", "DISPATCHABLEUNIT", raw_data_loc)
+# For these technology types, DUIDs are only considered operating in a month if
+# data was last seen after the end of that month
+RETIREMENT_FILTERED_TECHS = ["Steam (Coal, Gas)", "Hydro"]
+
+
+def _fetch_dispatchable_unit(
+    raw_data_loc: Path, year: int, month: int
+) -> pd.DataFrame:
+    get_and_unzip_table_csv(
+        year, month, "DATA", "DISPATCHABLEUNIT", raw_data_loc
+    )
     dispatchable = pd.read_csv(
         Path(
             raw_data_loc,
-            "PUBLIC_DVD_DISPATCHABLEUNIT_202201010000.CSV",
+            f"PUBLIC_DVD_DISPATCHABLEUNIT_{year}{month:02d}010000.CSV",
         ),
         header=1,
     )
     dispatchable = dispatchable.iloc[:-1, :]
-    dispatchable.LASTCHANGED = dispatchable.LASTCHANGED.str.cat(
-        np.repeat("+1000", len(dispatchable))
-    )
     dispatchable.LASTCHANGED = pd.to_datetime(
-        dispatchable.LASTCHANGED, format="%Y/%m/%d %H:%M:%S%z"
-    )
+        dispatchable.LASTCHANGED, format="%Y/%m/%d %H:%M:%S"
+    ).dt.tz_localize(NEM_TZ)
     return dispatchable.set_index("DUID")
 
 
+def get_dispatchable_unit(
+    raw_data_loc: Path,
+    year: int = 2022,
+    month: int = 1,
+    offline: bool = False,
+) -> pd.DataFrame:
+    """
+    Returns the parsed DISPATCHABLEUNIT table from the given MMS archive month.
+    The table is cached in the reference data cache in `raw_data_loc` (see
+    `get_cached_reference_table`), so it is only downloaded and parsed once.
+    """
+    dispatchable = get_cached_reference_table(
+        "DISPATCHABLEUNIT",
+        f"{year}{month:02d}",
+        lambda: _fetch_dispatchable_unit(raw_data_loc, year, month),
+        Path(raw_data_loc, REFERENCE_CACHE_DIR),
+        offline=offline,
+    )
+    # parquet round trips UTC offsets as pytz offsets
+    dispatchable.LASTCHANGED = dispatchable.LASTCHANGED.dt.tz_convert(NEM_TZ)
+    return dispatchable
+
+
 def get_duid_cap_tech_status_mapping(
-    mapping_loc: Path, duid_loc: Path, raw_data_loc: Path
+    mapping_loc: Path,
+    duid_loc: Path,
+    raw_data_loc: Path,
+    offline: bool = False,
 ) -> pd.DataFrame:
     """
     Use OpenNEM facilities data to get table with capacity, technology and date data
     for each DUID.
     1. Only retain MASP or scheduled gen/loads (i.e. >30MW)
     2. Where date_first_seen is not available, use LASTCHANGED
+
+    If `offline` is True, DISPATCHABLEUNIT is loaded from the reference data
+    cache without checking whether it is up to date.
     """
     tech_registration = get_gen_tech_mapping(mapping_loc, duid_loc)
     tech_registration.data_first_seen = pd.to_datetime(
@@ -47,7 +87,7 @@ def get_duid_cap_tech_status_mapping(
     # get LASTCHANGED into the table to use as a date filter where data_first_seen
     # is not available
     tech_registration = tech_registration.set_index("DUID")
-    dispatchable = _get_dispatchable_unit(raw_data_loc)
+    dispatchable = get_dispatchable_unit(raw_data_loc, offline=offline)
     tech_registration = tech_registration.combine_first(dispatchable)
     # only keep entries with a tech type
     tech_registration = tech_registration[~tech_registration.Tech.isna()]
@@ -99,7 +139,66 @@ def filter_by_date_and_tech(
         # ensure data first seen before end of month
         & (gen_tech_reg.data_first_seen < end_filter)
     ]
-    if tech == "Steam (Coal, Gas)" or tech == "Hydro":
+    if tech in RETIREMENT_FILTERED_TECHS:
         # ensure data last seen before end of month
         filtered = filtered[filtered.data_last_seen > end_filter]
     return filtered
+
+
+def _to_local_naive(dates: pd.Series) -> pd.Series:
+    """
+    Converts dates (strings or timestamps, possibly with a UTC offset) to naive
+    timestamps in local (market) time
+    """
+    dates = pd.to_datetime(dates)
+    if dates.dt.tz is not None:
+        dates = dates.dt.tz_localize(None)
+    return dates
+
+
+def operating_duid_counts(
+    gen_tech_reg: pd.DataFrame, months: List[Tuple[int, int]]
+) -> pd.DataFrame:
+    """
+    Vectorised equivalent of `filter_by_date_and_tech` for all technology types
+    and (year, month) pairs at once.
+
+    The operating interval of each DUID (data first seen, data last seen) is
+    compared against the start of the following month for every month in a
+    single (DUID x month) comparison. As per `filter_by_date_and_tech`, data
+    last seen is only considered for coal and hydro DUIDs.
+
+    Returns a DataFrame of DUID counts indexed by (year, month) with technology
+    types as columns. Counts are adjusted for batteries (separate gen and load
+    DUIDs) and smelters (Point Henry has been closed since 2014).
+    """
+    first_seen = _to_local_naive(gen_tech_reg.data_first_seen)
+    last_seen = _to_local_naive(gen_tech_reg.data_last_seen)
+    last_seen = last_seen.where(
+        gen_tech_reg.Tech.isin(RETIREMENT_FILTERED_TECHS), pd.Timestamp.max
+    )
+    month_ends = np.array(
+        [
+            datetime(year + month // 12, month % 12 + 1, 1)
+            for year, month in months
+        ],
+        dtype="datetime64[ns]",
+    )
+    # NaT comparisons are False, so DUIDs without dates are not operating
+    left = first_seen.to_numpy(dtype="datetime64[ns]")[:, np.newaxis]
+    right = last_seen.to_numpy(dtype="datetime64[ns]")[:, np.newaxis]
+    operating = (left < month_ends) & (right > month_ends)
+    counts = (
+        pd.DataFrame(
+            operating,
+            columns=pd.MultiIndex.from_tuples(months, names=["year", "month"]),
+        )
+        .groupby(gen_tech_reg.Tech.to_numpy())
+        .sum()
+        .T
+    )
+    if "Battery" in counts:
+        counts["Battery"] = counts["Battery"] / 2
+    if "Smelter" in counts:
+        counts["Smelter"] = 1
+    return counts
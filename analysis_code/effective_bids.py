@@ -0,0 +1,229 @@
+import argparse
+import calendar
+import logging
+from datetime import datetime
+from pathlib import Path
+from typing import List
+
+import polars as pl
+from tqdm import tqdm
+
+from .processed_data import (
+    DEFAULT_PROCESSED_FORMAT,
+    PROCESSED_FORMATS,
+    write_processed,
+)
+from .rebid_diffs import BID_KEY_COLS, QUANTITY_COLS
+from .rebidding_analysis import get_day_parameters, get_day_partition_files
+
+# Dispatch interval length. Effective bids are materialised for each dispatch
+# interval, including for days with 30-minute bid periods
+DISPATCH_INTERVAL_MINS = 5
+EFFECTIVE_BID_COLS = QUANTITY_COLS
+# partition column of the effective bids dataset
+DATE_COL = "DATE"
+
+
+def arg_parser():
+    description = (
+        "Materialise the bid in force for each DUID, bid type and dispatch "
+        + "interval for a month across years"
+    )
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument(
+        "-years",
+        type=int,
+        nargs="+",
+        default=list(range(2013, 2022)),
+        help=("Years to process. Default 2013-2021"),
+    )
+    parser.add_argument(
+        "-month",
+        type=int,
+        default=6,
+        help=("Month to process. Default 6 (June)"),
+    )
+    parser.add_argument(
+        "-output_format",
+        type=str,
+        default=DEFAULT_PROCESSED_FORMAT,
+        choices=list(PROCESSED_FORMATS.keys()),
+        help=(f"Dataset file format. Default {DEFAULT_PROCESSED_FORMAT}"),
+    )
+    args = parser.parse_args()
+    return args
+
+
+def dispatch_intervals(trading_date: datetime) -> pl.LazyFrame:
+    """
+    Dispatch intervals (interval-ending) in the NEM day, which starts at 4AM,
+    with the bid period each falls in and the time it starts at
+    """
+    _, period_end, mins_per_period = get_day_parameters(trading_date)
+    day_start = trading_date.replace(hour=4)
+    n_intervals = (period_end - 1) * mins_per_period // DISPATCH_INTERVAL_MINS
+    return pl.LazyFrame(
+        {"INTERVAL": pl.arange(1, n_intervals + 1, eager=True)}
+    ).select(
+        (
+            pl.lit(day_start)
+            + pl.duration(minutes=pl.col("INTERVAL") * DISPATCH_INTERVAL_MINS)
+        ).alias("INTERVAL_DATETIME"),
+        (
+            (pl.col("INTERVAL") * DISPATCH_INTERVAL_MINS + mins_per_period - 1)
+            // mins_per_period
+        ).alias("PERIODID"),
+        (
+            pl.lit(day_start)
+            + pl.duration(
+                minutes=(pl.col("INTERVAL") - 1) * DISPATCH_INTERVAL_MINS
+            )
+        ).alias("INTERVAL_START"),
+    )
+
+
+def scan_bid_versions(files: List[Path]) -> pl.LazyFrame:
+    """
+    Lazily selects bids sorted by offer time and then version. Of bids with
+    the same offer time, a backward as-of join matches the last (i.e. the
+    latest version)
+    """
+    schema = pl.read_parquet_schema(files[0])
+    offer_col = [col for col in schema if "OFFERDATE" in col].pop()
+    key_cols = [col for col in BID_KEY_COLS if col in schema]
+    version_cols = [offer_col] + (
+        ["VERSIONNO"] if "VERSIONNO" in schema else []
+    )
+    return (
+        pl.scan_parquet(files)
+        .select(
+            *key_cols,
+            pl.col("PERIODID").cast(pl.Int64),
+            *version_cols,
+            *EFFECTIVE_BID_COLS,
+        )
+        .sort(version_cols)
+        .rename({offer_col: "OFFERDATE"})
+    )
+
+
+def effective_bids_for_day(
+    partitioned_data_path: Path, trading_date: datetime
+) -> pl.LazyFrame:
+    """
+    Effective bids for each bid stream and dispatch interval in a trading day
+    (see `effective_bids_from_files`)
+    """
+    day_col, _, _ = get_day_parameters(trading_date)
+    files = get_day_partition_files(
+        partitioned_data_path, day_col, trading_date
+    )
+    return effective_bids_from_files(files, trading_date)
+
+
+def effective_bids_from_files(
+    files: List[Path], trading_date: datetime
+) -> pl.LazyFrame:
+    """
+    Effective (in force) MAXAVAIL and BANDAVAIL1-10 for each bid stream and
+    dispatch interval in a trading day, from the day's partition files.
+
+    The effective bid is the latest bid (by offer time, then version) for the
+    dispatch interval's bid period submitted no later than the start of the
+    dispatch interval. This is found using a backward as-of join of dispatch
+    intervals (by start time) onto bids (by offer time) for each bid stream
+    and bid period. Bid streams with no bid submitted before a dispatch
+    interval have no row for that interval.
+    """
+    bids = scan_bid_versions(files)
+    schema = bids.collect_schema()
+    key_cols = [col for col in BID_KEY_COLS if col in schema]
+    intervals = (
+        bids.select(key_cols)
+        .unique()
+        .join(dispatch_intervals(trading_date), how="cross")
+        .with_columns(pl.col("INTERVAL_START").cast(schema["OFFERDATE"]))
+        .sort("INTERVAL_START")
+    )
+    return (
+        intervals.join_asof(
+            bids,
+            left_on="INTERVAL_START",
+            right_on="OFFERDATE",
+            by=key_cols + ["PERIODID"],
+            strategy="backward",
+            allow_parallel=True,
+        )
+        .filter(pl.col("OFFERDATE").is_not_null())
+        .drop("INTERVAL_START")
+        .sort(key_cols + ["INTERVAL_DATETIME"])
+    )
+
+
+def effective_bids_partition_path(
+    output_path: Path, trading_date: datetime
+) -> Path:
+    """
+    Path (without a suffix) of a trading day's partition in the effective
+    bids dataset
+    """
+    return Path(
+        output_path,
+        "effective_bids",
+        f"{DATE_COL}={trading_date:%Y-%m-%d}",
+        "part-0",
+    )
+
+
+def effective_bids_across_month(
+    years: List[int],
+    month: int,
+    partitioned_data_path: Path,
+    output_path: Path,
+    output_format: str = DEFAULT_PROCESSED_FORMAT,
+) -> None:
+    """
+    Writes effective bids (see `effective_bids_for_day`) for each trading day
+    in a month across years to a partition of the effective bids dataset in
+    `output_path` (see `effective_bids_partition_path`). Days are processed
+    one at a time, so memory use is bounded by a day of bid data.
+    """
+    for year in years:
+        n_days = calendar.monthrange(year, month)[1]
+        for day in tqdm(range(1, n_days + 1), desc=f"Processing {year}"):
+            trading_date = datetime(year, month, day)
+            try:
+                df = effective_bids_for_day(
+                    partitioned_data_path, trading_date
+                ).collect()
+            except FileNotFoundError:
+                logging.warning(
+                    f"No data for {day}/{month}/{year}. Continuing"
+                )
+                continue
+            partition = effective_bids_partition_path(
+                output_path, trading_date
+            )
+            if not partition.parent.exists():
+                partition.parent.mkdir(parents=True)
+            write_processed(
+                df.to_pandas(), partition, output_format, index=False
+            )
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    args = arg_parser()
+    partitioned_path = Path("data", "partitioned")
+    output_path = Path("data", "processed")
+    effective_bids_across_month(
+        args.years,
+        args.month,
+        partitioned_path,
+        output_path,
+        output_format=args.output_format,
+    )
+
+
+if __name__ == "__main__":
+    main()
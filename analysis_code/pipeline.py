@@ -0,0 +1,571 @@
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import threading
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Future,
+    ThreadPoolExecutor,
+    wait,
+)
+from dataclasses import dataclass, replace
+from fnmatch import fnmatch
+from glob import has_magic
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+from .processed_data import PROCESSED_FORMATS
+from .result_cache import hash_file
+
+PROJECT_DIR = Path(__file__).resolve().parent.parent
+STATE_FILE = Path("data", ".pipeline_state.json")
+PYTHON = sys.executable
+
+
+@dataclass(frozen=True)
+class Stage:
+    """
+    A pipeline stage. `inputs` and `outputs` are paths relative to the
+    project directory, and can be files, directories (all files within are
+    used) or glob patterns. Stages that read another stage's outputs run after
+    it.
+    """
+
+    name: str
+    command: Tuple[str, ...]
+    inputs: Tuple[str, ...]
+    outputs: Tuple[str, ...]
+
+
+STAGES = [
+    Stage(
+        "get_duid_info",
+        (
+            PYTHON,
+            "data_scripts/get_duid_to_tech.py",
+            "-raw_path",
+            "data/raw/",
+            "-proc_path",
+            "data/duids/",
+        ),
+        (
+            "data_scripts/get_duid_to_tech.py",
+            "analysis_code/reference_data.py",
+        ),
+        (
+            "data/duids/cleaned_gen_loads.csv",
+            "data/duids/non_genloads_duid_providers.csv",
+        ),
+    ),
+    Stage(
+        "get_opennem_facilities",
+        (PYTHON, "data_scripts/opennem_facilities.py"),
+        ("data_scripts/opennem_facilities.py",),
+        ("data/duids/opennem_duids.csv",),
+    ),
+    Stage(
+        "partition_raw_data",
+        (
+            PYTHON,
+            "data_scripts/stream_bid_data.py",
+            "-years",
+            *[str(year) for year in range(2013, 2022)],
+            "-months",
+            "6",
+            "-raw_dir",
+            "data/raw",
+            "-output_dir",
+            "data/partitioned",
+        ),
+        (
+            "data_scripts/stream_bid_data.py",
+            "data_scripts/get_partitioned_data.py",
+            "data_scripts/create_parquet_partitions_by_column.py",
+        ),
+        ("data/partitioned/SETTLEMENTDATE", "data/partitioned/TRADINGDATE"),
+    ),
+    Stage(
+        "partition_price_bands",
+        (
+            PYTHON,
+            "data_scripts/stream_bid_data.py",
+            "-years",
+            *[str(year) for year in range(2013, 2022)],
+            "-months",
+            "6",
+            "-table",
+            "BIDDAYOFFER",
+            "-raw_dir",
+            "data/raw",
+            "-output_dir",
+            "data/partitioned",
+        ),
+        (
+            "data_scripts/stream_bid_data.py",
+            "data_scripts/get_partitioned_data.py",
+            "data_scripts/create_parquet_partitions_by_column.py",
+        ),
+        ("data/partitioned/BIDDAYOFFER",),
+    ),
+    Stage(
+        "rebid_count_analysis",
+        (PYTHON, "-m", "analysis_code.rebidding_analysis"),
+        (
+            "analysis_code/rebidding_analysis.py",
+            "analysis_code/processed_data.py",
+            "analysis_code/rebid_diffs.py",
+            "analysis_code/result_cache.py",
+            "data/partitioned/SETTLEMENTDATE",
+            "data/partitioned/TRADINGDATE",
+            "data/mappings",
+            "data/duids/*.csv",
+        ),
+        ("data/processed/rebid_counts_6_*.*",),
+    ),
+    Stage(
+        "effective_bid_analysis",
+        (PYTHON, "-m", "analysis_code.effective_bids"),
+        (
+            "analysis_code/effective_bids.py",
+            "analysis_code/processed_data.py",
+            "analysis_code/rebid_diffs.py",
+            "analysis_code/rebidding_analysis.py",
+            "data/partitioned/SETTLEMENTDATE",
+            "data/partitioned/TRADINGDATE",
+        ),
+        ("data/processed/effective_bids",),
+    ),
+    Stage(
+        "rebid_category_analysis",
+        (PYTHON, "-m", "analysis_code.rebid_explanations"),
+        (
+            "analysis_code/rebid_explanations.py",
+            "analysis_code/price_bands.py",
+            "analysis_code/processed_data.py",
+            "analysis_code/rebidding_analysis.py",
+            "data/partitioned/SETTLEMENTDATE",
+            "data/partitioned/TRADINGDATE",
+            "data/partitioned/BIDDAYOFFER",
+            "data/mappings",
+            "data/duids/*.csv",
+        ),
+        ("data/processed/rebid_categories_6_*.*",),
+    ),
+    Stage(
+        "rebid_sketch_analysis",
+        (PYTHON, "-m", "analysis_code.rebid_sketches", "-build"),
+        (
+            "analysis_code/rebid_sketches.py",
+            "analysis_code/rebidding_analysis.py",
+            "data/partitioned/SETTLEMENTDATE",
+            "data/partitioned/TRADINGDATE",
+            "data/mappings",
+            "data/duids/*.csv",
+        ),
+        ("data/processed/rebid_sketches_p12",),
+    ),
+    Stage(
+        "bid_zip_file_analysis",
+        (PYTHON, "plot_scripts/bid_zip_size.py"),
+        ("plot_scripts/bid_zip_size.py", "plot_scripts/matplotlibrc.mplstyle"),
+        (
+            "data/processed/bidperoffer_monthly_zip_size_2012_2022.*",
+            "plots/monthly_bidding_data_size_2012_2023.pdf",
+        ),
+    ),
+    Stage(
+        "plot_rebids",
+        (PYTHON, "plot_scripts/plot_rebids_across_same_month_across_years.py"),
+        (
+            "plot_scripts/plot_rebids_across_same_month_across_years.py",
+            "plot_scripts/matplotlibrc.mplstyle",
+            "analysis_code/duid_registration.py",
+            "data/processed/rebid_counts_6_*.*",
+            "data/mappings",
+            "data/duids/*.csv",
+        ),
+        ("plots/rebids_june_share_by_tech_2013_2021.pdf",),
+    ),
+    Stage(
+        "get_bess_bidding_data",
+        (PYTHON, "data_scripts/get_bess_bidding_data.py"),
+        ("data_scripts/get_bess_bidding_data.py",),
+        ("data/processed/agg_bess",),
+    ),
+    Stage(
+        "plot_bess_bidding",
+        (PYTHON, "plot_scripts/plot_bess_bidding.py"),
+        (
+            "plot_scripts/plot_bess_bidding.py",
+            "data/processed/agg_bess",
+            "data/processed/agg_bess_*_data_*0604.csv",
+        ),
+        ("plots/aggregate_bess_bidding_0406_2021_2023.pdf",),
+    ),
+]
+
+
+# stages that accept an -output_format for their processed outputs
+OUTPUT_FORMAT_STAGES = {
+    "rebid_count_analysis",
+    "effective_bid_analysis",
+    "rebid_category_analysis",
+    "bid_zip_file_analysis",
+    "get_bess_bidding_data",
+}
+
+
+def with_output_format(
+    stages: List[Stage], output_format: Optional[str]
+) -> List[Stage]:
+    """
+    Adds `-output_format` to the commands of stages that write processed
+    outputs. Changing the format changes the commands, so these stages rerun.
+    """
+    if output_format is None:
+        return stages
+    return [
+        replace(
+            stage, command=(*stage.command, "-output_format", output_format)
+        )
+        if stage.name in OUTPUT_FORMAT_STAGES
+        else stage
+        for stage in stages
+    ]
+
+
+def arg_parser():
+    description = (
+        "Run pipeline stages whose inputs, outputs or command have changed "
+        + "since they were last run, running independent stages in parallel"
+    )
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument(
+        "-targets",
+        type=str,
+        nargs="+",
+        choices=[stage.name for stage in STAGES],
+        help=("Stages to bring up to date (with upstream). Default all"),
+    )
+    parser.add_argument(
+        "-only",
+        action="store_true",
+        help=("Only consider targets, treating upstream outputs as given"),
+    )
+    parser.add_argument(
+        "-force",
+        action="store_true",
+        help=("Rerun stages even if they are up to date"),
+    )
+    parser.add_argument(
+        "-dry_run",
+        action="store_true",
+        help=("List stages that are out of date without running them"),
+    )
+    parser.add_argument(
+        "-max_workers",
+        type=int,
+        default=2,
+        help=("Maximum number of stages to run at once. Default 2"),
+    )
+    parser.add_argument(
+        "-output_format",
+        type=str,
+        choices=list(PROCESSED_FORMATS.keys()),
+        help=("Format of processed outputs. Default each stage's default"),
+    )
+    args = parser.parse_args()
+    return args
+
+
+def _static_prefix(spec: str) -> Path:
+    """
+    Leading part of a path spec that contains no glob characters
+    """
+    parts: List[str] = []
+    for part in Path(spec).parts:
+        if has_magic(part):
+            break
+        parts.append(part)
+    return Path(*parts)
+
+
+def _specs_overlap(spec: str, other: str) -> bool:
+    """
+    Whether two path specs could refer to the same files
+    """
+    if has_magic(spec) or has_magic(other):
+        if fnmatch(spec, other) or fnmatch(other, spec):
+            return True
+    for a, b in ((spec, other), (other, spec)):
+        # a is a concrete path that is (or contains) the files matched by b
+        if not has_magic(a) and (
+            Path(a) == _static_prefix(b) or Path(a) in Path(b).parents
+        ):
+            return True
+    return False
+
+
+def resolve_spec(spec: str, project_dir: Path = PROJECT_DIR) -> List[Path]:
+    """
+    Files matched by a path spec, relative to `project_dir` (unless the spec
+    is an absolute path outside of it)
+    """
+    if has_magic(spec):
+        base = Path(Path(spec).anchor) if Path(spec).is_absolute() else None
+        if base is not None:
+            matches = base.glob(str(Path(spec).relative_to(base)))
+        else:
+            matches = project_dir.glob(spec)
+    elif (path := project_dir / Path(spec)).is_dir():
+        matches = path.rglob("*")
+    elif path.exists():
+        matches = iter([path])
+    else:
+        matches = iter([])
+    return sorted(
+        match.relative_to(project_dir)
+        if match.is_relative_to(project_dir)
+        else match
+        for match in matches
+        if match.is_file()
+    )
+
+
+def get_stage_dependencies(stages: List[Stage]) -> Dict[str, Set[str]]:
+    """
+    Maps each stage to the stages whose outputs it reads
+    """
+    dependencies: Dict[str, Set[str]] = {stage.name: set() for stage in stages}
+    for stage in stages:
+        for upstream in stages:
+            if upstream is stage:
+                continue
+            if any(
+                _specs_overlap(spec, output)
+                for spec in stage.inputs
+                for output in upstream.outputs
+            ):
+                dependencies[stage.name].add(upstream.name)
+    return dependencies
+
+
+def select_stages(
+    stages: List[Stage], targets: Optional[List[str]], only: bool = False
+) -> List[Stage]:
+    """
+    Targets and (unless `only` is True) all stages upstream of them
+    """
+    if not targets:
+        return stages
+    dependencies = get_stage_dependencies(stages)
+    selected = set(targets)
+    to_visit = [] if only else list(targets)
+    while to_visit:
+        for upstream in dependencies[to_visit.pop()]:
+            if upstream not in selected:
+                selected.add(upstream)
+                to_visit.append(upstream)
+    return [stage for stage in stages if stage.name in selected]
+
+
+class PipelineState:
+    """
+    Content hashes of stage inputs and outputs recorded after each successful
+    run, stored as JSON.
+
+    File hashes are memoised against each file's size and modification time,
+    so unchanged files are not rehashed on every run.
+    """
+
+    def __init__(self, state_file: Path, project_dir: Path = PROJECT_DIR):
+        self.state_file = state_file
+        self.project_dir = project_dir
+        self._lock = threading.Lock()
+        if state_file.exists():
+            with open(state_file, "r") as f:
+                state = json.load(f)
+        else:
+            state = {}
+        self.stages: Dict[str, Dict] = state.get("stages", {})
+        self.hashes: Dict[str, Dict[str, str]] = state.get("hashes", {})
+
+    def hash_file(self, file: Path) -> str:
+        stat = (self.project_dir / file).stat()
+        stamp = f"{stat.st_size}:{stat.st_mtime_ns}"
+        with self._lock:
+            memo = self.hashes.get(str(file))
+        if memo is not None and memo["stamp"] == stamp:
+            return memo["sha256"]
+        sha = hash_file(self.project_dir / file)
+        with self._lock:
+            self.hashes[str(file)] = {"stamp": stamp, "sha256": sha}
+        return sha
+
+    def hash_specs(self, specs: Tuple[str, ...]) -> Dict[str, Dict[str, str]]:
+        return {
+            spec: {
+                str(file): self.hash_file(file)
+                for file in resolve_spec(spec, self.project_dir)
+            }
+            for spec in specs
+        }
+
+    def out_of_date_reason(self, stage: Stage) -> Optional[str]:
+        """
+        Why a stage needs to be run, or None if it is up to date
+        """
+        record = self.stages.get(stage.name)
+        if record is None:
+            return "not run before"
+        if record["command"] != list(stage.command[1:]):
+            return "command changed"
+        if record["inputs"] != self.hash_specs(stage.inputs):
+            return "inputs changed"
+        outputs = self.hash_specs(stage.outputs)
+        if any(not files for files in outputs.values()):
+            return "outputs missing"
+        if record["outputs"] != outputs:
+            return "outputs changed"
+        return None
+
+    def record(self, stage: Stage) -> None:
+        record = {
+            # the interpreter path is excluded so that state is portable
+            "command": list(stage.command[1:]),
+            "inputs": self.hash_specs(stage.inputs),
+            "outputs": self.hash_specs(stage.outputs),
+        }
+        with self._lock:
+            self.stages[stage.name] = record
+            self.save()
+
+    def save(self) -> None:
+        if not self.state_file.parent.exists():
+            self.state_file.parent.mkdir(parents=True)
+        temp_file = self.state_file.with_suffix(f".{os.getpid()}.tmp")
+        with open(temp_file, "w") as f:
+            json.dump(
+                {"stages": self.stages, "hashes": self.hashes},
+                f,
+                indent=2,
+                sort_keys=True,
+            )
+        os.replace(temp_file, self.state_file)
+
+
+def run_stage(stage: Stage, project_dir: Path = PROJECT_DIR) -> None:
+    logging.info(f"Running {stage.name}: {' '.join(stage.command[1:])}")
+    subprocess.run(stage.command, cwd=project_dir, check=True)
+
+
+def run_pipeline(
+    stages: List[Stage],
+    state: PipelineState,
+    max_workers: int = 2,
+    force: bool = False,
+    dry_run: bool = False,
+) -> Dict[str, str]:
+    """
+    Runs out-of-date stages once the stages they depend on have finished,
+    running up to `max_workers` independent stages at once.
+
+    A stage is out of date if it has not been run before, if its command
+    has changed, if the content of its inputs has changed since it was last
+    run, or if its outputs are missing or have been modified. Downstream stages
+    are therefore only rerun if an upstream stage changes their inputs.
+
+    Returns the status of each stage ("ran", "up to date", "failed" or
+    "skipped" if an upstream stage failed). With `dry_run`, stages are checked
+    against the current state of their inputs only, so stages downstream of
+    out-of-date stages may also end up running.
+    """
+    names = {stage.name for stage in stages}
+    dependencies = {
+        name: upstream & names
+        for name, upstream in get_stage_dependencies(stages).items()
+        if name in names
+    }
+    status: Dict[str, str] = {}
+    pending = {stage.name: stage for stage in stages}
+    running: Dict[Future, Stage] = {}
+
+    def check_and_run(stage: Stage) -> str:
+        reason = "forced" if force else state.out_of_date_reason(stage)
+        if reason is None:
+            return "up to date"
+        if dry_run:
+            logging.info(f"{stage.name} would run ({reason})")
+            return "out of date"
+        logging.info(f"{stage.name} is out of date ({reason})")
+        run_stage(stage, state.project_dir)
+        state.record(stage)
+        return "ran"
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            # repeat as skipping a stage can make its dependents skippable
+            scheduled = True
+            while scheduled:
+                scheduled = False
+                for name, stage in list(pending.items()):
+                    upstream = dependencies[name]
+                    if any(
+                        status.get(up) in ("failed", "skipped")
+                        for up in upstream
+                    ):
+                        logging.warning(
+                            f"Skipping {name} as an upstream stage failed"
+                        )
+                        status[name] = "skipped"
+                    elif all(up in status for up in upstream):
+                        future = executor.submit(check_and_run, stage)
+                        running[future] = stage
+                    else:
+                        continue
+                    del pending[name]
+                    scheduled = True
+            if not running:
+                if pending:
+                    raise ValueError(f"Cyclic dependencies in {list(pending)}")
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage = running.pop(future)
+                try:
+                    status[stage.name] = future.result()
+                except Exception as e:
+                    logging.error(f"{stage.name} failed: {e}")
+                    status[stage.name] = "failed"
+    return status
+
+
+def main():
+    logging.basicConfig(
+        format="\n%(levelname)s:%(message)s", level=logging.INFO
+    )
+    args = arg_parser()
+    stages = select_stages(
+        with_output_format(STAGES, args.output_format),
+        args.targets,
+        only=args.only,
+    )
+    state = PipelineState(PROJECT_DIR / STATE_FILE)
+    status = run_pipeline(
+        stages,
+        state,
+        max_workers=args.max_workers,
+        force=args.force,
+        dry_run=args.dry_run,
+    )
+    for name, stage_status in status.items():
+        logging.info(f"{name}: {stage_status}")
+    if any(s in ("failed", "skipped") for s in status.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+import re
+from datetime import datetime
+from pathlib import Path
+from typing import List, Optional
+
+import pandas as pd
+import polars as pl
+
+from .effective_bids import effective_bids_for_day
+from .rebid_diffs import BAND_COLS, BID_KEY_COLS
+from .rebidding_analysis import get_day_partition_files
+
+PRICE_BAND_COLS = [f"PRICEBAND{band}" for band in range(1, 11)]
+# day offers are partitioned into <partitioned data path>/BIDDAYOFFER
+DAY_OFFER_TABLE = "BIDDAYOFFER"
+DAY_OFFER_PARTITION_COLS = ["TRADINGDATE", "SETTLEMENTDATE"]
+# bid bucket names used by NEM bidding dashboard, e.g. "[0, 50)"
+BID_BUCKET_PATTERN = re.compile(r"\[(-?[\d.]+), (-?[\d.]+)\)")
+
+
+def get_day_offer_files(
+    partitioned_data_path: Path, trading_date: datetime
+) -> List[Path]:
+    """
+    BIDDAYOFFER partition files for a trading day. Day offers are partitioned
+    by trading date if the column is present and otherwise by settlement date
+    (i.e. the trading date in older data). Partition columns are tried in
+    order until one has partitions for the day.
+    """
+    table_path = partitioned_data_path / Path(DAY_OFFER_TABLE)
+    for day_col in DAY_OFFER_PARTITION_COLS:
+        try:
+            return get_day_partition_files(table_path, day_col, trading_date)
+        except FileNotFoundError:
+            continue
+    raise FileNotFoundError(
+        f"No {DAY_OFFER_TABLE} partitions for {trading_date:%Y-%m-%d}"
+    )
+
+
+def scan_day_offers(files: List[Path]) -> pl.LazyFrame:
+    """
+    Lazily selects the price bands of day offers, sorted by offer time and
+    then version. The offer time column is renamed to `DAYOFFERDATE`.
+    """
+    schema = pl.read_parquet_schema(files[0])
+    offer_col = [col for col in schema if "OFFERDATE" in col].pop()
+    key_cols = [col for col in BID_KEY_COLS if col in schema]
+    version_cols = [offer_col] + (
+        ["VERSIONNO"] if "VERSIONNO" in schema else []
+    )
+    return (
+        pl.scan_parquet(files)
+        .select(*key_cols, *version_cols, *PRICE_BAND_COLS)
+        .sort(version_cols)
+        .drop(version_cols[1:])
+        .rename({offer_col: "DAYOFFERDATE"})
+    )
+
+
+def attach_price_bands(
+    bids: pl.LazyFrame, day_offers: pl.LazyFrame
+) -> pl.LazyFrame:
+    """
+    Attaches PRICEBAND1-10 to per-period offers (or effective bids) from the
+    same trading day. Each offer is matched to the day offer for the same bid
+    stream with the latest offer time (and then version) no later than its
+    own, which is the day offer submitted with it. This is done with a
+    backward as-of join on offer time rather than an equality join so that
+    offer times that differ in precision between tables still match.
+
+    Offers with no matching day offer have null price bands.
+    """
+    schema = bids.collect_schema()
+    offer_col = [col for col in schema if "OFFERDATE" in col].pop()
+    day_offer_schema = day_offers.collect_schema()
+    key_cols = [
+        col
+        for col in BID_KEY_COLS
+        if col in schema and col in day_offer_schema
+    ]
+    day_offers = day_offers.with_columns(
+        pl.col("DAYOFFERDATE").cast(schema[offer_col])
+    )
+    return (
+        bids.sort(offer_col)
+        .join_asof(
+            day_offers,
+            left_on=offer_col,
+            right_on="DAYOFFERDATE",
+            by=key_cols,
+            strategy="backward",
+            allow_parallel=True,
+        )
+        .drop("DAYOFFERDATE")
+    )
+
+
+def priced_effective_bids_for_day(
+    partitioned_data_path: Path, trading_date: datetime
+) -> pl.LazyFrame:
+    """
+    Effective bids for each dispatch interval in a trading day (see
+    `effective_bids_for_day`) with the price bands of the bid in force
+    """
+    return attach_price_bands(
+        effective_bids_for_day(partitioned_data_path, trading_date),
+        scan_day_offers(
+            get_day_offer_files(partitioned_data_path, trading_date)
+        ),
+    )
+
+
+def bid_bucket_edges(bid_order: List[str]) -> List[float]:
+    """
+    Price edges of contiguous bid buckets (e.g. `["[0, 50)", "[50, 100)"]`
+    has edges `[0, 50, 100]`)
+    """
+    edges: List[float] = []
+    for bucket in bid_order:
+        if (match := BID_BUCKET_PATTERN.fullmatch(bucket)) is None:
+            raise ValueError(f"Could not parse bid bucket {bucket}")
+        lower, upper = float(match.group(1)), float(match.group(2))
+        if edges and edges[-1] != lower:
+            raise ValueError(f"Bid bucket {bucket} is not contiguous")
+        edges = edges[:-1] + [lower, upper]
+    return edges
+
+
+def volume_at_price(
+    priced_bids: pl.LazyFrame,
+    bid_order: List[str],
+    duids: Optional[List[str]] = None,
+    bidtype: str = "ENERGY",
+) -> pd.DataFrame:
+    """
+    Aggregates offered volume (BANDAVAIL) in each dispatch interval into
+    price buckets, for priced effective bids (see
+    `priced_effective_bids_for_day`) of `bidtype` for `duids` (all if None).
+    DUIDs for a technology can be obtained from `get_gen_tech_mapping`.
+
+    `bid_order` is a list of contiguous price buckets as per NEM bidding
+    dashboard (e.g. `["[0, 50)", "[50, 100)"]`). Volume priced outside of
+    these buckets or without a price band is dropped.
+
+    Returns a DataFrame with INTERVAL_DATETIME, BIN_NAME and BIDVOLUME columns,
+    as per the aggregated bids used by plot_scripts/plot_bess_bidding.py.
+    """
+    edges = bid_bucket_edges(bid_order)
+    bids = priced_bids.filter(pl.col("BIDTYPE") == bidtype)
+    if duids is not None:
+        bids = bids.filter(pl.col("DUID").is_in(duids))
+    bands = pl.concat(
+        [
+            bids.select(
+                "INTERVAL_DATETIME",
+                pl.col(price_col).alias("BIDPRICE"),
+                pl.col(volume_col).cast(pl.Float64).alias("BIDVOLUME"),
+            )
+            for price_col, volume_col in zip(PRICE_BAND_COLS, BAND_COLS)
+        ]
+    )
+    return (
+        bands.filter(pl.col("BIDPRICE").is_not_null())
+        .with_columns(
+            pl.col("BIDPRICE")
+            .cut(edges, labels=["<"] + bid_order + [">"], left_closed=True)
+            .cast(pl.String)
+            .alias("BIN_NAME")
+        )
+        .filter(pl.col("BIN_NAME").is_in(bid_order))
+        .group_by("INTERVAL_DATETIME", "BIN_NAME")
+        .agg(pl.col("BIDVOLUME").sum())
+        # buckets in price order within each interval
+        .sort("INTERVAL_DATETIME", pl.col("BIN_NAME").cast(pl.Enum(bid_order)))
+        .collect()
+        .to_pandas()
+    )
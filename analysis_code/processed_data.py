@@ -0,0 +1,113 @@
+import os
+from pathlib import Path
+from typing import Literal, Optional, Union
+
+import pandas as pd
+import polars as pl
+import pyarrow as pa
+import pyarrow.feather as feather
+
+"""Formats that processed outputs (e.g. rebid counts) can be written in, mapped
+to file suffixes. Feather files are Arrow IPC files that are written
+uncompressed so that they can be memory-mapped.
+"""
+PROCESSED_FORMATS = {
+    "parquet": ".parquet",
+    "feather": ".feather",
+    "csv": ".csv",
+}
+DEFAULT_PROCESSED_FORMAT = "parquet"
+
+
+def processed_file(path: Path, output_format: str) -> Path:
+    """
+    `path` with the suffix for `output_format`
+    """
+    return path.with_suffix(PROCESSED_FORMATS[output_format])
+
+
+def write_processed(
+    df: pd.DataFrame,
+    path: Path,
+    output_format: str = DEFAULT_PROCESSED_FORMAT,
+    index: bool = True,
+) -> Path:
+    """
+    Writes a processed output to `path` (with its suffix replaced by that of
+    `output_format`) and returns the path written to. The index is only
+    written if `index` is True.
+
+    The output is written to a temporary file and then moved into place, so
+    readers never see a partially-written file. The same output previously
+    written in another format is then removed, as `find_processed` would
+    otherwise keep finding it (e.g. a stale feather file over a new CSV).
+    """
+    if output_format not in PROCESSED_FORMATS:
+        raise ValueError(f"Unknown processed output format {output_format}")
+    out_file = processed_file(path, output_format)
+    temp_file = out_file.with_name(f".{os.getpid()}.{out_file.name}")
+    try:
+        if output_format == "parquet":
+            df.to_parquet(temp_file, index=index)
+        elif output_format == "feather":
+            table = pa.Table.from_pandas(df, preserve_index=index)
+            feather.write_feather(table, temp_file, compression="uncompressed")
+        else:
+            df.to_csv(temp_file, index=index)
+        os.replace(temp_file, out_file)
+    finally:
+        temp_file.unlink(missing_ok=True)
+    for other_format in PROCESSED_FORMATS:
+        if other_format != output_format:
+            processed_file(path, other_format).unlink(missing_ok=True)
+    return out_file
+
+
+def find_processed(path: Path) -> Optional[Path]:
+    """
+    Finds a processed output regardless of its format, preferring feather,
+    then parquet and then CSV. `path` can have any (or no) suffix.
+    """
+    for output_format in ("feather", "parquet", "csv"):
+        if (candidate := processed_file(path, output_format)).exists():
+            return candidate
+    return None
+
+
+def read_processed(
+    path: Path,
+    backend: Literal["pandas", "polars"] = "pandas",
+    index: bool = True,
+) -> Union[pd.DataFrame, pl.DataFrame]:
+    """
+    Reads a processed output into a pandas or polars DataFrame.
+
+    `index` should match that passed to `write_processed`. Parquet and feather
+    files record their index, but the first column of a CSV is only read as a
+    (datetime) index if `index` is True, so that CSVs are read back the same
+    as other formats. Polars DataFrames have no index, so an index is read as
+    a column.
+
+    Feather (Arrow IPC) files are memory-mapped rather than read, so data is
+    only paged in from disk when it is accessed. Columns are not copied by
+    polars, and pandas only copies columns that cannot be represented
+    zero-copy (e.g. strings).
+    """
+    if path.suffix == ".feather":
+        if backend == "polars":
+            return pl.read_ipc(path, memory_map=True)
+        with pa.memory_map(str(path), "r") as source:
+            table = pa.ipc.open_file(source).read_all()
+        return table.to_pandas(split_blocks=True)
+    elif path.suffix == ".parquet":
+        if backend == "polars":
+            return pl.read_parquet(path)
+        return pd.read_parquet(path)
+    elif path.suffix == ".csv":
+        if backend == "polars":
+            return pl.read_csv(path)
+        if index:
+            return pd.read_csv(path, index_col=0, parse_dates=[0])
+        return pd.read_csv(path)
+    else:
+        raise ValueError(f"Unknown processed output format for {path}")
@@ -0,0 +1,501 @@
+import argparse
+import io
+import json
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from datetime import datetime, timedelta
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+import polars as pl
+
+from .effective_bids import effective_bids_from_files
+from .processed_data import find_processed, read_processed
+from .rebidding_analysis import (
+    build_partition_manifest,
+    get_day_parameters,
+    get_gen_tech_mapping,
+    scan_rebid_keys,
+)
+
+# queries spanning more days than this are rejected
+MAX_QUERY_DAYS = 92
+# aggregated BESS datasets, as written by data_scripts/get_bess_bidding_data.py
+BESS_DATASETS = ["bids", "dispatch"]
+RESPONSE_FORMATS = {
+    "json": "application/json",
+    "arrow": "application/vnd.apache.arrow.file",
+}
+
+
+def arg_parser():
+    description = (
+        "Serve rebid count, effective bid and aggregated BESS queries over "
+        + "local HTTP from a single process with a warm result cache"
+    )
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument(
+        "-host",
+        type=str,
+        default="127.0.0.1",
+        help=("Address to listen on. Default 127.0.0.1 (local only)"),
+    )
+    parser.add_argument(
+        "-port",
+        type=int,
+        default=8050,
+        help=("Port to listen on. Default 8050"),
+    )
+    parser.add_argument(
+        "-cache_max_size_mb",
+        type=float,
+        default=1024.0,
+        help=("Maximum size (MB) of the in-memory result cache. Default 1024"),
+    )
+    args = parser.parse_args()
+    return args
+
+
+class LRUResultCache:
+    """
+    Thread-safe in-memory cache of DataFrames.
+
+    Entries are evicted in least-recently-used order once the total estimated
+    size of cached DataFrames exceeds `max_size_mb`. Concurrent requests for
+    the same missing entry wait for a single computation rather than each
+    computing it. Callers get (cheap) clones of cached DataFrames, as a
+    DataFrame cannot be used by several threads at once.
+
+    Clearing the cache starts a new generation. Computations started before
+    it was cleared are returned to their callers, but are not cached.
+    """
+
+    def __init__(self, max_size_mb: float = 1024.0):
+        self.max_size = max_size_mb * 1e6
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.generation = 0
+        self._entries: "OrderedDict[Hashable, pl.DataFrame]" = OrderedDict()
+        self._pending: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._entries
+
+    def get_or_compute(
+        self, key: Hashable, compute: Callable[[], pl.DataFrame]
+    ) -> pl.DataFrame:
+        return self.get_or_compute_many([key], lambda _: [compute()])[0]
+
+    def get_or_compute_many(
+        self,
+        keys: List[Hashable],
+        compute: Callable[[List[Hashable]], List[pl.DataFrame]],
+    ) -> List[pl.DataFrame]:
+        """
+        Entries for each of keys. Missing entries that are not already being
+        computed are computed together by a single call to `compute`, which is
+        passed the missing keys and returns a DataFrame for each. Entries
+        being computed by other callers are waited for.
+        """
+        results: Dict[Hashable, pl.DataFrame] = {}
+        waiting: Dict[Hashable, Future] = {}
+        owned: Dict[Hashable, Future] = {}
+        with self._lock:
+            generation = self.generation
+            for key in keys:
+                if key in self._entries:
+                    self.hits += 1
+                    self._entries.move_to_end(key)
+                    results[key] = self._entries[key].clone()
+                    continue
+                self.misses += 1
+                if (future := self._pending.get(key)) is not None:
+                    waiting[key] = future
+                else:
+                    owned[key] = self._pending[key] = Future()
+        if owned:
+            try:
+                computed = dict(zip(owned, compute(list(owned))))
+            except BaseException as e:
+                with self._lock:
+                    for key, future in owned.items():
+                        if self._pending.get(key) is future:
+                            del self._pending[key]
+                for future in owned.values():
+                    future.set_exception(e)
+                raise
+            with self._lock:
+                for key, future in owned.items():
+                    if self._pending.get(key) is future:
+                        del self._pending[key]
+                    if self.generation == generation:
+                        self._put(key, computed[key])
+            for key, future in owned.items():
+                future.set_result(computed[key])
+                results[key] = computed[key].clone()
+        for key, future in waiting.items():
+            results[key] = future.result().clone()
+        return [results[key] for key in keys]
+
+    def _put(self, key: Hashable, df: pl.DataFrame) -> None:
+        if key in self._entries:
+            self.size -= self._entries.pop(key).estimated_size()
+        self._entries[key] = df
+        self.size += df.estimated_size()
+        while self.size > self.max_size and self._entries:
+            _, evicted = self._entries.popitem(last=False)
+            self.size -= evicted.estimated_size()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            # computations in progress are no longer shared with new callers
+            self._pending.clear()
+            self.size = 0
+            self.generation += 1
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "size_mb": self.size / 1e6,
+                "max_size_mb": self.max_size / 1e6,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+def parse_date_range(start: str, end: Optional[str] = None) -> List[datetime]:
+    """
+    Days from start to end (inclusive, YYYY-MM-DD). If end is not provided,
+    only the start day is returned
+    """
+    start_date = datetime.strptime(start, "%Y-%m-%d")
+    end_date = datetime.strptime(end, "%Y-%m-%d") if end else start_date
+    if end_date < start_date:
+        raise ValueError(f"Date range {start} to {end} ends before it starts")
+    n_days = (end_date - start_date).days + 1
+    if n_days > MAX_QUERY_DAYS:
+        raise ValueError(f"Date ranges are limited to {MAX_QUERY_DAYS} days")
+    return [start_date + timedelta(days=day) for day in range(n_days)]
+
+
+class QueryService:
+    """
+    Answers queries from the partitioned bid data and processed outputs.
+
+    The DUID to technology type mapping and an index of partition files (see
+    `build_partition_manifest`) are held in memory, and results for each day
+    are cached in an `LRUResultCache` so that queries with overlapping date
+    ranges share work. Results are filtered (e.g. by technology type) after
+    they are read from the cache. `refresh` reloads the mapping and manifest
+    and clears the cache, e.g. after new data is partitioned.
+    """
+
+    def __init__(
+        self,
+        partitioned_data_path: Path,
+        processed_path: Path,
+        mappings_path: Path,
+        duids_path: Path,
+        cache_max_size_mb: float = 1024.0,
+    ):
+        self.partitioned_data_path = partitioned_data_path
+        self.processed_path = processed_path
+        self.mappings_path = mappings_path
+        self.duids_path = duids_path
+        self.cache = LRUResultCache(cache_max_size_mb)
+        self._lock = threading.Lock()
+        self.refresh()
+
+    def refresh(self) -> None:
+        mapping = pl.from_pandas(
+            get_gen_tech_mapping(self.mappings_path, self.duids_path)[
+                ["DUID", "Tech"]
+            ]
+        )
+        manifest = build_partition_manifest(self.partitioned_data_path)
+        with self._lock:
+            self.tech_mapping = mapping
+            self.manifest = manifest
+        self.cache.clear()
+        logging.info(
+            "Loaded manifest of "
+            + ", ".join(
+                f"{len(days)} {day_col} days"
+                for day_col, days in manifest.items()
+            )
+        )
+
+    def day_files(self, trading_date: datetime) -> Optional[List[Path]]:
+        day_col, _, _ = get_day_parameters(trading_date)
+        with self._lock:
+            return self.manifest[day_col].get(f"{trading_date:%Y%m%d}")
+
+    def _day_results(
+        self,
+        query: str,
+        trading_dates: List[datetime],
+        compute: Callable[[List[Path], datetime], pl.LazyFrame],
+    ) -> pl.DataFrame:
+        """
+        Results of `compute` for each day that has partition files, from the
+        cache where possible. Uncached days are computed in parallel by
+        polars, and days being computed for other requests are waited for.
+        """
+        day_files = {
+            (query, trading_date): files
+            for trading_date in trading_dates
+            if (files := self.day_files(trading_date)) is not None
+        }
+        if not day_files:
+            raise FileNotFoundError("No data for the requested days")
+        results = self.cache.get_or_compute_many(
+            list(day_files),
+            lambda keys: pl.collect_all(
+                [compute(day_files[key], key[1]) for key in keys]
+            ),
+        )
+        return pl.concat(results)
+
+    def _scan_day_rebid_counts(
+        self, files: List[Path], trading_date: datetime
+    ) -> pl.LazyFrame:
+        day_col, period_end, mins_per_period = get_day_parameters(trading_date)
+        return (
+            scan_rebid_keys(files, day_col, 1, period_end - 1, mins_per_period)
+            .join(self.tech_mapping.lazy(), on="DUID", how="left")
+            .with_columns(pl.col("Tech").fill_null("Unknown"))
+            .group_by(
+                pl.col(day_col + "TIME").alias("INTERVAL_DATETIME"), "Tech"
+            )
+            .agg(pl.len().cast(pl.Int64).alias("REBIDS"))
+            .sort("INTERVAL_DATETIME", "Tech")
+        )
+
+    def rebid_counts(
+        self, trading_dates: List[datetime], techs: Optional[List[str]] = None
+    ) -> pl.DataFrame:
+        """
+        Distinct rebids (as per `scan_rebid_keys`) by dispatch interval and
+        technology type, optionally for a subset of technology types
+        """
+        counts = self._day_results(
+            "rebid_counts", trading_dates, self._scan_day_rebid_counts
+        )
+        if techs:
+            counts = counts.filter(pl.col("Tech").is_in(techs))
+        return counts
+
+    def effective_bids(
+        self,
+        trading_dates: List[datetime],
+        techs: Optional[List[str]] = None,
+        duids: Optional[List[str]] = None,
+        bidtype: Optional[str] = None,
+    ) -> pl.DataFrame:
+        """
+        Effective bids (see `effective_bids_from_files`), optionally for a
+        subset of technology types, DUIDs and a bid type
+        """
+        bids = self._day_results(
+            "effective_bids", trading_dates, effective_bids_from_files
+        )
+        if techs:
+            tech_duids = self.tech_mapping.filter(pl.col("Tech").is_in(techs))
+            bids = bids.filter(pl.col("DUID").is_in(tech_duids["DUID"]))
+        if duids:
+            bids = bids.filter(pl.col("DUID").is_in(duids))
+        if bidtype:
+            bids = bids.filter(pl.col("BIDTYPE") == bidtype)
+        return bids
+
+    def bess_data(
+        self, trading_dates: List[datetime], dataset: str = "bids"
+    ) -> pl.DataFrame:
+        """
+        Aggregated BESS bids or dispatch data from the partitions written by
+        data_scripts/get_bess_bidding_data.py. Days that have not been
+        aggregated are skipped.
+        """
+        if dataset not in BESS_DATASETS:
+            raise ValueError(f"BESS dataset must be one of {BESS_DATASETS}")
+        days = []
+        for trading_date in trading_dates:
+            # as per bess_partition_path in get_bess_bidding_data.py
+            partition = find_processed(
+                Path(
+                    self.processed_path,
+                    "agg_bess",
+                    dataset,
+                    f"DATE={trading_date:%Y-%m-%d}",
+                    "part-0",
+                )
+            )
+            if partition is not None:
+                days.append(
+                    self.cache.get_or_compute(
+                        (f"bess_{dataset}", trading_date),
+                        lambda partition=partition: read_processed(
+                            partition, backend="polars"
+                        ),
+                    )
+                )
+        if not days:
+            raise FileNotFoundError("No BESS data for the requested days")
+        return pl.concat(days, how="diagonal_relaxed")
+
+    def status(self) -> Dict:
+        with self._lock:
+            manifest = {
+                day_col: {
+                    "days": len(days),
+                    "first": min(days) if days else None,
+                    "last": max(days) if days else None,
+                }
+                for day_col, days in self.manifest.items()
+            }
+        return {"manifest": manifest, "cache": self.cache.stats()}
+
+
+def serialise(df: pl.DataFrame, response_format: str) -> bytes:
+    if response_format == "arrow":
+        buffer = io.BytesIO()
+        df.write_ipc(buffer)
+        return buffer.getvalue()
+    return df.write_json().encode()
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    """
+    Handles GET requests for:
+    - `/rebid_counts?start=&end=&tech=`
+    - `/effective_bids?start=&end=&tech=&duid=&bidtype=`
+    - `/bess?start=&end=&dataset=bids|dispatch`
+    - `/status`
+
+    Dates are YYYY-MM-DD (end is inclusive and defaults to start), and `tech`
+    and `duid` can be repeated. Results are JSON records unless
+    `format=arrow` is passed, in which case they are an Arrow IPC file.
+    `POST /refresh` reloads the mapping and partition manifest.
+    """
+
+    server: "QueryServer"
+
+    def _send(
+        self, status: HTTPStatus, body: bytes, content_type: str
+    ) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status: HTTPStatus, content: Dict) -> None:
+        self._send(
+            status,
+            json.dumps(content, default=str).encode(),
+            RESPONSE_FORMATS["json"],
+        )
+
+    def _query(self, path: str, params: Dict[str, List[str]]) -> pl.DataFrame:
+        service = self.server.service
+        if "start" not in params:
+            raise ValueError("A start date is required")
+        trading_dates = parse_date_range(
+            params["start"][0], params.get("end", [None])[0]
+        )
+        if path == "/rebid_counts":
+            return service.rebid_counts(trading_dates, params.get("tech"))
+        elif path == "/effective_bids":
+            return service.effective_bids(
+                trading_dates,
+                params.get("tech"),
+                params.get("duid"),
+                params.get("bidtype", [None])[0],
+            )
+        elif path == "/bess":
+            return service.bess_data(
+                trading_dates, params.get("dataset", ["bids"])[0]
+            )
+        raise LookupError(f"Unknown query {path}")
+
+    def do_GET(self) -> None:
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        if url.path == "/status":
+            self._send_json(HTTPStatus.OK, self.server.service.status())
+            return
+        response_format = params.get("format", ["json"])[0]
+        try:
+            if response_format not in RESPONSE_FORMATS:
+                raise ValueError(
+                    f"Format must be one of {list(RESPONSE_FORMATS)}"
+                )
+            body = serialise(self._query(url.path, params), response_format)
+        except LookupError as e:
+            self._send_json(HTTPStatus.NOT_FOUND, {"error": str(e)})
+        except FileNotFoundError as e:
+            self._send_json(HTTPStatus.NOT_FOUND, {"error": str(e)})
+        except ValueError as e:
+            self._send_json(HTTPStatus.BAD_REQUEST, {"error": str(e)})
+        except Exception as e:
+            logging.exception(f"Failed to answer {self.path}")
+            self._send_json(
+                HTTPStatus.INTERNAL_SERVER_ERROR, {"error": str(e)}
+            )
+        else:
+            self._send(HTTPStatus.OK, body, RESPONSE_FORMATS[response_format])
+
+    def do_POST(self) -> None:
+        if urlparse(self.path).path != "/refresh":
+            self._send_json(HTTPStatus.NOT_FOUND, {"error": "Not found"})
+            return
+        self.server.service.refresh()
+        self._send_json(HTTPStatus.OK, self.server.service.status())
+
+    def log_message(self, format: str, *args) -> None:
+        logging.debug(format % args)
+
+
+class QueryServer(ThreadingHTTPServer):
+    """
+    HTTP server that handles each request in its own thread. Queries run
+    concurrently, as polars releases the GIL while it reads and computes.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], service: QueryService):
+        super().__init__(address, QueryHandler)
+        self.service = service
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    args = arg_parser()
+    service = QueryService(
+        Path("data", "partitioned"),
+        Path("data", "processed"),
+        Path("data", "mappings"),
+        Path("data", "duids"),
+        cache_max_size_mb=args.cache_max_size_mb,
+    )
+    with QueryServer((args.host, args.port), service) as server:
+        logging.info(f"Serving queries on http://{args.host}:{args.port}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            logging.info("Shutting down")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+from typing import List
+
+import polars as pl
+
+BAND_COLS = [f"BANDAVAIL{band}" for band in range(1, 11)]
+QUANTITY_COLS = ["MAXAVAIL"] + BAND_COLS
+# identifies a bid stream. DIRECTION is only present in newer data
+BID_KEY_COLS = ["DUID", "BIDTYPE", "DIRECTION"]
+# suffix of columns with the change in each quantity from the previous offer
+CHANGE_SUFFIX = "_CHANGE"
+
+
+def offer_sequence_cols(columns: List[str]) -> List[str]:
+    """
+    Columns that identify an offer sequence, i.e. the offers for a bid stream
+    and bid period
+    """
+    return [col for col in BID_KEY_COLS if col in columns] + ["PERIODID"]
+
+
+def diff_offers(bids: pl.LazyFrame) -> pl.LazyFrame:
+    """
+    Sorts each offer sequence (see `offer_sequence_cols`) by offer time and
+    then version, and adds the MW change in MAXAVAIL and each BANDAVAIL column
+    from the previous offer in the sequence (e.g. `BANDAVAIL1_CHANGE`).
+
+    Also adds:
+    - `FIRST_OFFER`, which is True for the first offer in each sequence.
+      Changes are null for these offers.
+    - `MAXAVAIL_CHANGED`, which is True if MAXAVAIL changed
+    - `CHANGED_BANDS`, the number of BANDAVAIL columns that changed
+    - `CHANGED_MW`, the total absolute MW change across BANDAVAIL columns
+    """
+    columns = bids.collect_schema().names()
+    offer_col = [col for col in columns if "OFFERDATE" in col].pop()
+    sequence_cols = offer_sequence_cols(columns)
+    version_cols = [offer_col] + (
+        ["VERSIONNO"] if "VERSIONNO" in columns else []
+    )
+    changes = [
+        (pl.col(col) - pl.col(col).shift(1))
+        .over(sequence_cols)
+        .alias(col + CHANGE_SUFFIX)
+        for col in QUANTITY_COLS
+    ]
+    # null quantities are treated as changed if the previous offer had them
+    changed = [
+        pl.col(col).ne_missing(pl.col(col).shift(1)).over(sequence_cols)
+        for col in QUANTITY_COLS
+    ]
+    first_offer = pl.int_range(pl.len()).over(sequence_cols) == 0
+    return (
+        bids.sort(sequence_cols + version_cols)
+        .with_columns(
+            *changes,
+            first_offer.alias("FIRST_OFFER"),
+            (~first_offer & changed[0]).alias("MAXAVAIL_CHANGED"),
+            pl.when(first_offer)
+            .then(0)
+            .otherwise(pl.sum_horizontal(changed[1:]))
+            .cast(pl.UInt8)
+            .alias("CHANGED_BANDS"),
+        )
+        .with_columns(
+            pl.sum_horizontal(
+                [pl.col(col + CHANGE_SUFFIX).abs() for col in BAND_COLS]
+            ).alias("CHANGED_MW"),
+        )
+    )
+
+
+def substantive_offers(bids: pl.LazyFrame) -> pl.LazyFrame:
+    """
+    Offers (see `diff_offers`) that are either the first in their offer
+    sequence or change MAXAVAIL or the quantity in at least one band. Offers
+    that only resubmit the previous quantities (e.g. to change prices or
+    ramp rates) are dropped.
+
+    Returns a compact table with the columns of `bids` other than the
+    quantities, and with the columns added by `diff_offers`.
+    """
+    return (
+        diff_offers(bids)
+        .filter(
+            pl.col("FIRST_OFFER")
+            | pl.col("MAXAVAIL_CHANGED")
+            | (pl.col("CHANGED_BANDS") > 0)
+        )
+        .drop(QUANTITY_COLS)
+    )
@@ -0,0 +1,356 @@
+import argparse
+import calendar
+import logging
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+import polars as pl
+
+from .price_bands import get_day_offer_files
+from .processed_data import (
+    DEFAULT_PROCESSED_FORMAT,
+    PROCESSED_FORMATS,
+    write_processed,
+)
+from .rebidding_analysis import (
+    get_day_parameters,
+    get_day_partition_files,
+    get_gen_tech_mapping,
+    scan_rebid_keys,
+)
+
+EXPLANATION_COL = "REBIDEXPLANATION"
+# category for offers whose explanation matches no rule, or has none
+OTHER_CATEGORY = "Other"
+UNKNOWN_CATEGORY = "Unknown"
+
+
+@dataclass(frozen=True)
+class RebidRule:
+    """
+    A rebid explanation category. Explanations containing any of `keywords`
+    (case-insensitive) or matching `pattern` (a regex, if provided) are
+    assigned to the category.
+    """
+
+    category: str
+    keywords: Tuple[str, ...]
+    pattern: Optional[str] = None
+
+
+"""Rules in order of priority. An explanation that matches several rules is
+assigned to the first. Patterns use Rust regex syntax (via polars)
+"""
+REBID_RULES = [
+    RebidRule(
+        "Error",
+        ("error", "incorrect", "mistake", "correction", "typo"),
+        r"(?i)\b(err|corr(ect(ed|ing)?)?)\b",
+    ),
+    RebidRule(
+        "Plant",
+        (
+            "plant",
+            "outage",
+            "fault",
+            "boiler",
+            "turbine",
+            "tube leak",
+            "maintenance",
+            "unit limit",
+        ),
+        r"(?i)\b(trip(s|ped)?|derat(e|ed|ing)|fail(ed|ure)?|avail)\b",
+    ),
+    RebidRule(
+        "Ambient",
+        ("ambient", "temperature", "weather", "irradiance", "cloud"),
+        r"(?i)\b(temp|wind speed|hot|rain)\b",
+    ),
+    RebidRule(
+        "Network",
+        ("constraint", "network", "interconnector", "binding"),
+    ),
+    RebidRule(
+        "FCAS",
+        ("fcas", "regulation", "contingency", "enablement"),
+    ),
+    RebidRule(
+        "Energy limit",
+        ("fuel", "storage", "state of charge", "energy limit", "dam level"),
+        r"(?i)\bsoc\b",
+    ),
+    RebidRule(
+        "Price forecast",
+        ("price", "predispatch", "pre-dispatch", "pre dispatch"),
+        r"(?i)\b(5m?pd|p5(min)?|pd)\b",
+    ),
+    RebidRule(
+        "Demand forecast",
+        ("demand", "load forecast"),
+    ),
+    RebidRule(
+        "Commercial",
+        ("commercial", "portfolio", "contract", "hedg"),
+    ),
+]
+
+
+def arg_parser():
+    description = (
+        "Categorise rebid explanations and count rebids by technology type "
+        + "and category for a month across years"
+    )
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument(
+        "-years",
+        type=int,
+        nargs="+",
+        default=list(range(2013, 2022)),
+        help=("Years to process. Default 2013-2021"),
+    )
+    parser.add_argument(
+        "-month",
+        type=int,
+        default=6,
+        help=("Month to process. Default 6 (June)"),
+    )
+    parser.add_argument(
+        "-output_format",
+        type=str,
+        default=DEFAULT_PROCESSED_FORMAT,
+        choices=list(PROCESSED_FORMATS.keys()),
+        help=(f"Output file format. Default {DEFAULT_PROCESSED_FORMAT}"),
+    )
+    args = parser.parse_args()
+    return args
+
+
+def rule_categories(rules: List[RebidRule] = REBID_RULES) -> List[str]:
+    """
+    Categories by rule index, as returned by `match_rules`
+    """
+    return [rule.category for rule in rules] + [
+        OTHER_CATEGORY,
+        UNKNOWN_CATEGORY,
+    ]
+
+
+def match_rules(
+    explanation: pl.Expr, rules: List[RebidRule] = REBID_RULES
+) -> pl.Expr:
+    """
+    Expression for the index of the first rule that explanations match.
+    Explanations that match no rule have index `len(rules)` and null or empty
+    explanations have index `len(rules) + 1` (see `rule_categories`).
+
+    Keywords of all rules are matched in a single pass using an Aho-Corasick
+    automaton, and the first rule matched by a keyword is found by looking up
+    each matched keyword's rule. Rule patterns are each matched with a
+    compiled regex.
+    """
+    keyword_rules: Dict[str, int] = {}
+    for i, rule in enumerate(rules):
+        for keyword in rule.keywords:
+            keyword_rules.setdefault(keyword.lower(), i)
+    keyword_rule = (
+        explanation.str.extract_many(
+            list(keyword_rules.keys()),
+            ascii_case_insensitive=True,
+            overlapping=True,
+        )
+        .list.eval(
+            pl.element()
+            .str.to_lowercase()
+            .replace_strict(keyword_rules, return_dtype=pl.Int64)
+        )
+        .list.min()
+    )
+    pattern_rules = [
+        pl.when(explanation.str.contains(rule.pattern)).then(pl.lit(i))
+        for i, rule in enumerate(rules)
+        if rule.pattern is not None
+    ]
+    return (
+        pl.when(explanation.str.strip_chars().str.len_chars() > 0)
+        .then(
+            pl.min_horizontal(keyword_rule, *pattern_rules).fill_null(
+                len(rules)
+            )
+        )
+        .otherwise(len(rules) + 1)
+        .cast(pl.Int64)
+    )
+
+
+def categorise_explanations(
+    explanation: pl.Expr, rules: List[RebidRule] = REBID_RULES
+) -> pl.Expr:
+    """
+    Expression that assigns explanations to the category of the first rule
+    they match (see `match_rules`)
+    """
+    return match_rules(explanation, rules).replace_strict(
+        dict(enumerate(rule_categories(rules))), return_dtype=pl.String
+    )
+
+
+def scan_day_offer_categories(
+    files: List[Path], rules: List[RebidRule] = REBID_RULES
+) -> pl.LazyFrame:
+    """
+    Lazily categorises the rebid explanations of day offers (see
+    `categorise_explanations`). As explanations repeat across bid types and
+    offers, each distinct explanation is only categorised once.
+
+    Returns the category of each DUID's offers by offer time (renamed to
+    `DAYOFFERDATE`), sorted by offer time. Where a DUID's offers for
+    different bid types at the same time have different categories, the
+    category of the first rule is used.
+    """
+    schema = pl.read_parquet_schema(files[0])
+    offer_col = [col for col in schema if "OFFERDATE" in col].pop()
+    offers = pl.scan_parquet(files).select(
+        "DUID", pl.col(offer_col).alias("DAYOFFERDATE"), EXPLANATION_COL
+    )
+    rule_indices = (
+        offers.select(EXPLANATION_COL)
+        .unique()
+        .with_columns(
+            match_rules(pl.col(EXPLANATION_COL), rules).alias("RULE")
+        )
+    )
+    return (
+        offers.join(
+            rule_indices, on=EXPLANATION_COL, how="left", join_nulls=True
+        )
+        .group_by("DUID", "DAYOFFERDATE")
+        .agg(pl.col("RULE").min())
+        .select(
+            "DUID",
+            "DAYOFFERDATE",
+            pl.col("RULE")
+            .replace_strict(
+                dict(enumerate(rule_categories(rules))),
+                return_dtype=pl.String,
+            )
+            .alias("CATEGORY"),
+        )
+        .sort("DAYOFFERDATE")
+    )
+
+
+def scan_rebid_categories_for_day(
+    partitioned_data_path: Path,
+    trading_date: datetime,
+    mapping: pd.DataFrame,
+    rules: List[RebidRule] = REBID_RULES,
+) -> pl.LazyFrame:
+    """
+    Lazily counts distinct rebids (as per `scan_rebid_keys`) by dispatch
+    interval, technology type and rebid explanation category for a trading
+    day. Each rebid is assigned the category of the DUID's latest day offer
+    submitted no later than it (i.e. the day offer submitted with it).
+    """
+    day_col, period_end, mins_per_period = get_day_parameters(trading_date)
+    time_col = day_col + "TIME"
+    files = get_day_partition_files(
+        partitioned_data_path, day_col, trading_date
+    )
+    keys = scan_rebid_keys(files, day_col, 1, period_end - 1, mins_per_period)
+    schema = keys.collect_schema()
+    offer_col = [col for col in schema if "OFFERDATE" in col].pop()
+    categories = scan_day_offer_categories(
+        get_day_offer_files(partitioned_data_path, trading_date), rules
+    ).with_columns(pl.col("DAYOFFERDATE").cast(schema[offer_col]))
+    tech_mapping = pl.from_pandas(mapping[["DUID", "Tech"]])
+    return (
+        keys.sort(offer_col)
+        .join_asof(
+            categories,
+            left_on=offer_col,
+            right_on="DAYOFFERDATE",
+            by="DUID",
+            strategy="backward",
+        )
+        .join(tech_mapping.lazy(), on="DUID", how="left")
+        .with_columns(
+            pl.col("Tech").fill_null("Unknown"),
+            pl.col("CATEGORY").fill_null(UNKNOWN_CATEGORY),
+        )
+        .group_by(
+            pl.col(time_col).alias("INTERVAL_DATETIME"), "Tech", "CATEGORY"
+        )
+        .agg(pl.len().cast(pl.Int64).alias("REBIDS"))
+    )
+
+
+def rebid_categories_across_month(
+    years: List[int],
+    month: int,
+    partitioned_data_path: Path,
+    mappings_path: Path,
+    duids_path: Path,
+    output_path: Path,
+    output_format: str = DEFAULT_PROCESSED_FORMAT,
+    rules: List[RebidRule] = REBID_RULES,
+) -> None:
+    """
+    Writes rebid counts by dispatch interval, technology type and rebid
+    explanation category (see `scan_rebid_categories_for_day`) for a month
+    across years to `rebid_categories_{month}_{year}` in output_path.
+
+    The days in a month are categorised and counted in parallel by polars,
+    with each day reading its own BIDPEROFFER and BIDDAYOFFER partitions.
+    """
+    mapping = get_gen_tech_mapping(mappings_path, duids_path)
+    for year in years:
+        logging.info(f"Processing {year}")
+        days = []
+        for day in range(1, calendar.monthrange(year, month)[1] + 1):
+            try:
+                days.append(
+                    scan_rebid_categories_for_day(
+                        partitioned_data_path,
+                        datetime(year, month, day),
+                        mapping,
+                        rules,
+                    )
+                )
+            except FileNotFoundError:
+                logging.warning(
+                    f"No data for {day}/{month}/{year}. Continuing"
+                )
+        if not days:
+            continue
+        month_df = (
+            pl.concat(pl.collect_all(days))
+            .sort("INTERVAL_DATETIME", "Tech", "CATEGORY")
+            .to_pandas()
+        )
+        write_processed(
+            month_df,
+            output_path / Path(f"rebid_categories_{month}_{year}"),
+            output_format=output_format,
+            index=False,
+        )
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    args = arg_parser()
+    rebid_categories_across_month(
+        args.years,
+        args.month,
+        Path("data", "partitioned"),
+        Path("data", "mappings"),
+        Path("data", "duids"),
+        Path("data", "processed"),
+        output_format=args.output_format,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,389 @@
+import argparse
+import calendar
+import logging
+import math
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import pandas as pd
+import polars as pl
+
+from .rebidding_analysis import (
+    get_day_parameters,
+    get_day_partition_files,
+    get_gen_tech_mapping,
+    scan_rebid_keys,
+)
+
+"""HyperLogLog precision (p). Sketches have 2^p registers and a relative
+standard error of 1.04 / sqrt(2^p), i.e. 1.6% for p = 12 (and roughly 3.3% at
+95% confidence). Small counts (below 2.5 * 2^p) use linear counting, which is
+more accurate. Merging sketches does not add error, so this applies to counts
+over any number of intervals, days or years.
+"""
+HLL_PRECISION = 12
+# fixed seeds so that sketches built in separate runs can be merged
+HASH_SEEDS = (0x5EED, 0xB1D5, 0x4E4D, 0x0C0D)
+# multipliers of murmur3's 64-bit finaliser (fmix64)
+FMIX64_MULTIPLIERS = (0xFF51AFD7ED558CCD, 0xC4CEB9FE1A85EC53)
+# columns that sketches can be grouped by when estimating counts
+SKETCH_GROUP_COLS = ["INTERVAL_DATETIME", "Tech", "DATE", "YEAR", "MONTH"]
+"""Sketches are kept for each dispatch interval and technology type, and
+merged into a sketch for each day and technology type. Estimates that are not
+by dispatch interval read the (much smaller) day sketches.
+"""
+SKETCH_GRANULARITIES = {
+    "interval": ["INTERVAL_DATETIME", "Tech"],
+    "day": ["Tech"],
+}
+
+
+def arg_parser():
+    description = (
+        "Estimate distinct rebid counts by technology type across months and "
+        + "years using mergeable HyperLogLog sketches"
+    )
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument(
+        "-years",
+        type=int,
+        nargs="+",
+        default=list(range(2013, 2022)),
+        help=("Years to sketch or count. Default 2013-2021"),
+    )
+    parser.add_argument(
+        "-months",
+        type=int,
+        nargs="+",
+        default=[6],
+        help=("Months to sketch or count. Default 6 (June)"),
+    )
+    parser.add_argument(
+        "-build",
+        action="store_true",
+        help=("Build (or rebuild) sketches for each day before estimating"),
+    )
+    parser.add_argument(
+        "-by",
+        type=str,
+        nargs="+",
+        default=["YEAR", "Tech"],
+        choices=SKETCH_GROUP_COLS,
+        help=("Columns to group counts by. Default YEAR Tech"),
+    )
+    parser.add_argument(
+        "-exact",
+        action="store_true",
+        help=("Count exactly from bid data instead of using sketches"),
+    )
+    parser.add_argument(
+        "-precision",
+        type=int,
+        default=HLL_PRECISION,
+        help=(f"HyperLogLog precision. Default {HLL_PRECISION}"),
+    )
+    args = parser.parse_args()
+    return args
+
+
+def hll_relative_error(precision: int = HLL_PRECISION) -> float:
+    """
+    Relative standard error of HyperLogLog estimates
+    """
+    return 1.04 / math.sqrt(2**precision)
+
+
+def fmix64(h: pl.Expr) -> pl.Expr:
+    """
+    murmur3's 64-bit finaliser, which mixes every input bit into every output
+    bit. Struct hashes of similar keys can differ in only a few bits, which
+    biases HyperLogLog registers and ranks unless hashes are mixed first.
+    Multiplication wraps on UInt64 and shifts are done by integer division.
+    """
+    h = h.cast(pl.UInt64)
+    for multiplier in FMIX64_MULTIPLIERS:
+        h = h.xor(h // 2**33)
+        h = h * pl.lit(multiplier, dtype=pl.UInt64)
+    return h.xor(h // 2**33)
+
+
+def sketch_path(output_path: Path, precision: int = HLL_PRECISION) -> Path:
+    """
+    Sketches with different precisions cannot be merged, so are kept in
+    separate datasets
+    """
+    return output_path / Path(f"rebid_sketches_p{precision}")
+
+
+def sketch_partition_path(
+    output_path: Path,
+    trading_date: datetime,
+    granularity: str,
+    precision: int = HLL_PRECISION,
+) -> Path:
+    """
+    Path of a trading day's sketches at a granularity (see
+    `SKETCH_GRANULARITIES`)
+    """
+    return Path(
+        sketch_path(output_path, precision),
+        granularity,
+        f"DATE={trading_date:%Y-%m-%d}",
+        "part-0.parquet",
+    )
+
+
+def scan_day_sketches(
+    partitioned_data_path: Path,
+    trading_date: datetime,
+    mapping: pd.DataFrame,
+    precision: int = HLL_PRECISION,
+) -> pl.LazyFrame:
+    """
+    Lazily builds sparse HyperLogLog sketches of the rebid keys of a trading
+    day (as per `scan_rebid_keys`) for each dispatch interval and technology
+    type. Keys are not deduplicated first, as sketches are unaffected by
+    duplicates.
+
+    Each key (dispatch interval, offer time and DUID) is hashed to 64 bits and
+    mixed (see `fmix64`).
+    The first `precision` bits select a register, and the register's rank is
+    the position of the first set bit in the remaining bits. Only the maximum
+    rank of each non-empty register is kept (REGISTER and RANK columns), so a
+    sketch has at most 2^precision rows.
+
+    Hashes are only consistent within a polars version, so sketches should be
+    rebuilt if polars is upgraded.
+    """
+    day_col, period_end, mins_per_period = get_day_parameters(trading_date)
+    time_col = day_col + "TIME"
+    files = get_day_partition_files(
+        partitioned_data_path, day_col, trading_date
+    )
+    keys = scan_rebid_keys(
+        files, day_col, 1, period_end - 1, mins_per_period, unique=False
+    )
+    offer_col = [col for col in keys.collect_schema() if "OFFERDATE" in col]
+    rank_bits = 64 - precision
+    key_hash = fmix64(
+        pl.struct(time_col, *offer_col, "DUID").hash(*HASH_SEEDS)
+    )
+    remainder = (key_hash % 2**rank_bits).cast(pl.Float64)
+    # float log2 is exact enough, as it only errs within 2^-53 of a power of 2
+    rank = (
+        pl.when(remainder > 0)
+        .then(rank_bits - remainder.log(2).floor())
+        .otherwise(rank_bits + 1)
+    )
+    tech_mapping = pl.from_pandas(mapping[["DUID", "Tech"]])
+    return (
+        keys.join(tech_mapping.lazy(), on="DUID", how="left")
+        .select(
+            pl.col(time_col).alias("INTERVAL_DATETIME"),
+            pl.col("Tech").fill_null("Unknown"),
+            (key_hash // 2**rank_bits).cast(pl.UInt16).alias("REGISTER"),
+            rank.cast(pl.UInt8).alias("RANK"),
+        )
+        .group_by("INTERVAL_DATETIME", "Tech", "REGISTER")
+        .agg(pl.col("RANK").max())
+    )
+
+
+def build_sketches(
+    partitioned_data_path: Path,
+    output_path: Path,
+    trading_dates: List[datetime],
+    mapping: pd.DataFrame,
+    precision: int = HLL_PRECISION,
+) -> None:
+    """
+    Builds sketches for each trading day (see `scan_day_sketches`) and writes
+    each day to its own partition of the sketch dataset at each granularity
+    (see `SKETCH_GRANULARITIES`), so that days can be added without
+    rebuilding others. Days within a month are built in parallel, and months
+    are built one at a time so that peak memory does not grow with the
+    number of days.
+    """
+    months: Dict[Tuple[int, int], List[datetime]] = {}
+    for trading_date in trading_dates:
+        key = (trading_date.year, trading_date.month)
+        months.setdefault(key, []).append(trading_date)
+    n_built = 0
+    for month_dates in months.values():
+        days, sketches = [], []
+        for trading_date in month_dates:
+            try:
+                sketches.append(
+                    scan_day_sketches(
+                        partitioned_data_path, trading_date, mapping, precision
+                    )
+                )
+            except FileNotFoundError:
+                logging.warning(
+                    f"No data for {trading_date:%d/%m/%Y}. Continuing"
+                )
+                continue
+            days.append(trading_date)
+        for trading_date, sketch in zip(days, pl.collect_all(sketches)):
+            for granularity, group_cols in SKETCH_GRANULARITIES.items():
+                partition = sketch_partition_path(
+                    output_path, trading_date, granularity, precision
+                )
+                if not partition.parent.exists():
+                    partition.parent.mkdir(parents=True)
+                sketch.group_by(*group_cols, "REGISTER").agg(
+                    pl.col("RANK").max()
+                ).write_parquet(partition)
+        n_built += len(days)
+    logging.info(f"Built sketches for {n_built} days")
+
+
+def estimate_cardinality(
+    sketches: pl.LazyFrame, by: List[str], precision: int = HLL_PRECISION
+) -> pl.LazyFrame:
+    """
+    Merges sketches within each group (by taking the maximum rank of each
+    register) and estimates the number of distinct keys in each group, as per
+    Flajolet et al. (2007) with linear counting for small cardinalities. The
+    estimate is in the REBIDS column.
+    """
+    m = 2**precision
+    alpha = 0.7213 / (1 + 1.079 / m)
+    merged = (
+        sketches.group_by(*by, "REGISTER")
+        .agg(pl.col("RANK").max())
+        .group_by(*by)
+        .agg(
+            (m - pl.len()).alias("ZEROS"),
+            (2.0 ** -pl.col("RANK").cast(pl.Float64)).sum().alias("HARMONIC"),
+        )
+    )
+    raw = alpha * m**2 / (pl.col("ZEROS") + pl.col("HARMONIC"))
+    linear = m * (m / pl.col("ZEROS").cast(pl.Float64)).log()
+    return merged.select(
+        *by,
+        pl.when((raw <= 2.5 * m) & (pl.col("ZEROS") > 0))
+        .then(linear)
+        .otherwise(raw)
+        .alias("REBIDS"),
+    ).sort(by)
+
+
+def scan_sketches(
+    output_path: Path,
+    trading_dates: List[datetime],
+    by: List[str],
+    precision: int = HLL_PRECISION,
+) -> pl.LazyFrame:
+    """
+    Lazily reads the sketches needed to estimate counts grouped `by` for the
+    trading days that have them, with DATE, YEAR and MONTH columns
+    """
+    granularity = "interval" if "INTERVAL_DATETIME" in by else "day"
+    files = [
+        partition
+        for trading_date in trading_dates
+        if (
+            partition := sketch_partition_path(
+                output_path, trading_date, granularity, precision
+            )
+        ).exists()
+    ]
+    if not files:
+        raise FileNotFoundError("No sketches for the requested days")
+    return (
+        pl.scan_parquet(files, hive_partitioning=True)
+        .with_columns(pl.col("DATE").cast(pl.Date))
+        .with_columns(
+            pl.col("DATE").dt.year().alias("YEAR"),
+            pl.col("DATE").dt.month().alias("MONTH"),
+        )
+    )
+
+
+def exact_rebid_counts(
+    partitioned_data_path: Path,
+    trading_dates: List[datetime],
+    mapping: pd.DataFrame,
+    by: List[str],
+) -> pl.LazyFrame:
+    """
+    Exact fallback for `estimate_cardinality`. Counts distinct rebid keys
+    (see `scan_rebid_keys`) in each group directly from bid data.
+    """
+    tech_mapping = pl.from_pandas(mapping[["DUID", "Tech"]])
+    days = []
+    for trading_date in trading_dates:
+        day_col, period_end, mins_per_period = get_day_parameters(trading_date)
+        try:
+            files = get_day_partition_files(
+                partitioned_data_path, day_col, trading_date
+            )
+        except FileNotFoundError:
+            continue
+        days.append(
+            scan_rebid_keys(files, day_col, 1, period_end - 1, mins_per_period)
+            .select(
+                pl.col(day_col + "TIME").alias("INTERVAL_DATETIME"), "DUID"
+            )
+            .with_columns(
+                pl.lit(trading_date.date()).alias("DATE"),
+                pl.lit(trading_date.year).alias("YEAR"),
+                pl.lit(trading_date.month).alias("MONTH"),
+            )
+        )
+    if not days:
+        raise FileNotFoundError("No bid data for the requested days")
+    return (
+        pl.concat(days)
+        .join(tech_mapping.lazy(), on="DUID", how="left")
+        .with_columns(pl.col("Tech").fill_null("Unknown"))
+        .group_by(*by)
+        .agg(pl.len().cast(pl.Float64).alias("REBIDS"))
+        .sort(by)
+    )
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    args = arg_parser()
+    partitioned_path = Path("data", "partitioned")
+    output_path = Path("data", "processed")
+    trading_dates = [
+        datetime(year, month, day)
+        for year in args.years
+        for month in args.months
+        for day in range(1, calendar.monthrange(year, month)[1] + 1)
+    ]
+    mapping = get_gen_tech_mapping(
+        Path("data", "mappings"), Path("data", "duids")
+    )
+    if args.exact:
+        counts = exact_rebid_counts(
+            partitioned_path, trading_dates, mapping, args.by
+        ).collect(streaming=True)
+    else:
+        if args.build:
+            build_sketches(
+                partitioned_path,
+                output_path,
+                trading_dates,
+                mapping,
+                args.precision,
+            )
+        counts = estimate_cardinality(
+            scan_sketches(output_path, trading_dates, args.by, args.precision),
+            args.by,
+            args.precision,
+        ).collect()
+        logging.info(
+            "Estimates have a relative standard error of "
+            + f"{hll_relative_error(args.precision):.1%}"
+        )
+    with pl.Config(tbl_rows=-1):
+        logging.info(f"Rebid counts:\n{counts}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+import argparse
+import calendar
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from .processed_data import (
+    DEFAULT_PROCESSED_FORMAT,
+    PROCESSED_FORMATS,
+    write_processed,
+)
+from .rebidding_analysis import rebid_counts_across_day
+from .work_queue import DEFAULT_LEASE_SECS, Lease, WorkQueue, run_worker
+
+# kind of the tasks added by this module
+TASK_KIND = "rebid_counts"
+
+
+def arg_parser():
+    description = (
+        "Count rebids by technology type across months and years using a "
+        + "work queue on a shared filesystem, so that any number of worker "
+        + "processes or hosts can count days in parallel"
+    )
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument(
+        "-queue_dir",
+        type=str,
+        required=True,
+        help=(
+            "Work queue directory. Must be on a filesystem shared by workers"
+        ),
+    )
+    parser.add_argument(
+        "-years",
+        type=int,
+        nargs="+",
+        default=list(range(2013, 2022)),
+        help=("Years to enqueue. Default 2013-2021"),
+    )
+    parser.add_argument(
+        "-months",
+        type=int,
+        nargs="+",
+        default=[6],
+        help=("Months to enqueue for each year. Default 6 (June)"),
+    )
+    parser.add_argument(
+        "-enqueue",
+        action="store_true",
+        help=("Add a task for each day in -years and -months"),
+    )
+    parser.add_argument(
+        "-reset_failed",
+        action="store_true",
+        help=("Requeue failed tasks"),
+    )
+    parser.add_argument(
+        "-work",
+        action="store_true",
+        help=("Run tasks until the queue is finished"),
+    )
+    parser.add_argument(
+        "-workers",
+        type=int,
+        default=1,
+        help=("Number of worker processes to run with -work. Default 1"),
+    )
+    parser.add_argument(
+        "-merge",
+        action="store_true",
+        help=("Merge day counts into a file for each finished month"),
+    )
+    parser.add_argument(
+        "-allow_partial",
+        action="store_true",
+        help=(
+            "Merge months with failed days, leaving out the failed days. By "
+            + "default, such months are skipped until the failed days are "
+            + "requeued (-reset_failed) and succeed"
+        ),
+    )
+    parser.add_argument(
+        "-lease_secs",
+        type=float,
+        default=DEFAULT_LEASE_SECS,
+        help=(
+            "Time after which the task of a worker that stops renewing its "
+            + f"lease can be claimed by another. Default {DEFAULT_LEASE_SECS}"
+        ),
+    )
+    parser.add_argument(
+        "-substantive_only",
+        action="store_true",
+        help=("Only count rebids that change MAXAVAIL or band quantities"),
+    )
+    parser.add_argument(
+        "-output_format",
+        type=str,
+        default=DEFAULT_PROCESSED_FORMAT,
+        choices=list(PROCESSED_FORMATS.keys()),
+        help=(
+            f"Rebid count output format. Default {DEFAULT_PROCESSED_FORMAT}"
+        ),
+    )
+    args = parser.parse_args()
+    return args
+
+
+def output_prefix(substantive_only: bool = False) -> str:
+    """
+    Prefix of task IDs and merged outputs, as per `rebid_counts_across_month`
+    """
+    return "substantive_rebid_counts" if substantive_only else "rebid_counts"
+
+
+def rebid_count_tasks(
+    years: List[int], months: List[int], substantive_only: bool = False
+) -> List[Dict]:
+    """
+    A task for each day in each month across years
+    """
+    prefix = output_prefix(substantive_only)
+    return [
+        {
+            "id": f"{prefix}-{year}-{month:02d}-{day:02d}",
+            "kind": TASK_KIND,
+            "year": year,
+            "month": month,
+            "day": day,
+            "substantive_only": substantive_only,
+        }
+        for year in years
+        for month in months
+        for day in range(1, calendar.monthrange(year, month)[1] + 1)
+    ]
+
+
+def count_day(
+    lease: Lease,
+    partitioned_data_path: Path,
+    mappings_path: Path,
+    duids_path: Path,
+) -> pd.DataFrame:
+    """
+    Runs a rebid count task (see `rebid_counts_across_day`)
+    """
+    task = lease.task
+    return rebid_counts_across_day(
+        partitioned_data_path,
+        mappings_path,
+        duids_path,
+        task["year"],
+        task["month"],
+        task["day"],
+        substantive_only=task["substantive_only"],
+    )
+
+
+def work(
+    queue_path: Path,
+    partitioned_data_path: Path,
+    mappings_path: Path,
+    duids_path: Path,
+    lease_secs: float = DEFAULT_LEASE_SECS,
+) -> int:
+    """
+    Runs rebid count tasks until the queue is finished (see `run_worker`).
+    Returns the number of tasks run by this worker.
+    """
+    logging.basicConfig(level=logging.INFO)
+    return run_worker(
+        WorkQueue(queue_path, lease_secs),
+        lambda lease: count_day(
+            lease, partitioned_data_path, mappings_path, duids_path
+        ),
+    )
+
+
+def merge_rebid_counts(
+    queue: WorkQueue,
+    output_path: Path,
+    output_format: str = DEFAULT_PROCESSED_FORMAT,
+    allow_partial: bool = False,
+) -> List[Tuple[str, int, int]]:
+    """
+    Merges day counts into a file for each month (e.g.
+    `rebid_counts_{month}_{year}`) in output_path, as written by
+    `rebid_counts_across_month`. Months with unfinished tasks are skipped, as
+    are months with failed tasks unless `allow_partial` is True (in which case
+    failed days are left out). Failed days are logged, and days without data
+    are skipped.
+
+    Returns the (prefix, year, month) of each merged month.
+    """
+    months: Dict[Tuple[str, int, int], List[str]] = {}
+    for task_id in queue.task_ids():
+        task = queue.task(task_id)
+        if task.get("kind") != TASK_KIND:
+            continue
+        key = (
+            output_prefix(task["substantive_only"]),
+            task["year"],
+            task["month"],
+        )
+        months.setdefault(key, []).append(task_id)
+    merged = []
+    for (prefix, year, month), task_ids in sorted(months.items()):
+        done: Dict[str, Optional[Dict]] = {
+            task_id: queue.done(task_id) for task_id in task_ids
+        }
+        if unfinished := [t for t, d in done.items() if d is None]:
+            logging.warning(
+                f"{len(unfinished)} days of {prefix} {month}/{year} are "
+                + "unfinished. Skipping"
+            )
+            continue
+        failed = [t for t, d in done.items() if d["status"] == "failed"]
+        for task_id in failed:
+            logging.error(f"{task_id} failed: {done[task_id]['error']}")
+        if failed and not allow_partial:
+            logging.warning(
+                f"{len(failed)} days of {prefix} {month}/{year} failed. "
+                + "Skipping until they are requeued and succeed"
+            )
+            continue
+        day_counts = [
+            pd.read_parquet(queue.result_file(task_id))
+            for task_id, task_done in done.items()
+            if task_done["status"] == "ok"
+        ]
+        if not day_counts:
+            continue
+        month_df = pd.concat(day_counts, axis=0).sort_index()
+        write_processed(
+            month_df,
+            output_path / Path(f"{prefix}_{month}_{year}"),
+            output_format=output_format,
+        )
+        merged.append((prefix, year, month))
+    logging.info(f"Merged {len(merged)} months")
+    return merged
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    args = arg_parser()
+    queue_path = Path(args.queue_dir)
+    partitioned_path = Path("data", "partitioned")
+    mappings_path = Path("data", "mappings")
+    duids_path = Path("data", "duids")
+    output_path = Path("data", "processed")
+    if not output_path.exists():
+        output_path.mkdir()
+    queue = WorkQueue(queue_path, args.lease_secs)
+    if args.enqueue:
+        added = queue.add_tasks(
+            rebid_count_tasks(args.years, args.months, args.substantive_only)
+        )
+        logging.info(f"Added {added} tasks")
+    if args.reset_failed:
+        logging.info(f"Requeued {queue.reset_failed()} failed tasks")
+    if args.work:
+        with ProcessPoolExecutor(max_workers=args.workers) as executor:
+            futures = [
+                executor.submit(
+                    work,
+                    queue_path,
+                    partitioned_path,
+                    mappings_path,
+                    duids_path,
+                    args.lease_secs,
+                )
+                for _ in range(args.workers)
+            ]
+            n_run = sum(future.result() for future in futures)
+        logging.info(f"Ran {n_run} tasks")
+    if args.merge:
+        merge_rebid_counts(
+            queue, output_path, args.output_format, args.allow_partial
+        )
+    logging.info(f"Queue status: {queue.status()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,45 @@
+import argparse
 import logging
+import resource
+import sys
+import tempfile
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
-from typing import List
+from typing import Deque, Dict, Iterator, List, Optional, Tuple
 
 import matplotlib.pyplot as plt
 import pandas as pd
 import polars as pl
 from tqdm import tqdm
 
+from .processed_data import (
+    DEFAULT_PROCESSED_FORMAT,
+    PROCESSED_FORMATS,
+    write_processed,
+)
+from .rebid_diffs import substantive_offers
+from .result_cache import ResultCache, make_cache_key
+
+# Conservative estimate of how much larger a parquet partition is when decoded
+# into memory. Used to size batches for out-of-core rebid counting
+PARQUET_EXPANSION_FACTOR = 8
+# Bids must be submitted at least this far ahead of the dispatch interval to be
+# counted as rebids. See `get_all_rebids_before_dispatch_interval`
+MIN_REBID_AHEAD_TIME = pd.Timedelta(minutes=0)
+# Files read by `get_gen_tech_mapping`
+DUID_FILES = [
+    "cleaned_gen_loads.csv",
+    "non_genloads_duid_providers_with_techs.csv",
+    "opennem_duids.csv",
+    "manual_duid_techs.csv",
+]
+MAPPING_FILES = [
+    "techtype_simple_mapping.json",
+    "opennem_techtype_mapping.json",
+]
+
 
 def get_gen_tech_mapping(
     path_to_mappings: Path, duids_path: Path
@@ -56,6 +88,58 @@ def get_gen_tech_mapping(
     return combined
 
 
+def get_gen_tech_mapping_files(
+    path_to_mappings: Path, duids_path: Path
+) -> List[Path]:
+    return [duids_path / Path(f) for f in DUID_FILES] + [
+        path_to_mappings / Path(f) for f in MAPPING_FILES
+    ]
+
+
+def get_day_parameters(trading_date: datetime) -> Tuple[str, int, int]:
+    """
+    Returns the partition column, the (exclusive) end period ID and the minutes
+    per period for the bid data format in use on the trading date
+    """
+    if trading_date < datetime(2021, 3, 1):
+        return "SETTLEMENTDATE", 49, 30
+    else:
+        return "TRADINGDATE", 289, 5
+
+
+def get_day_partition_files(
+    partitioned_data_path: Path, day_col: str, day: datetime
+) -> List[Path]:
+    files = sorted(
+        (partitioned_data_path / Path(day_col)).glob(
+            day.strftime("%Y%m%d") + "*.parquet"
+        )
+    )
+    if not files:
+        raise FileNotFoundError(
+            f"No {day_col} partitions for {day.strftime('%Y-%m-%d')}"
+        )
+    return files
+
+
+def build_partition_manifest(
+    partitioned_data_path: Path,
+) -> Dict[str, Dict[str, List[Path]]]:
+    """
+    Index of BIDPEROFFER partition files by partition column and then day
+    (YYYYMMDD), as per `get_day_partition_files` for all days at once
+    """
+    manifest: Dict[str, Dict[str, List[Path]]] = {}
+    for day_col in ("SETTLEMENTDATE", "TRADINGDATE"):
+        days: Dict[str, List[Path]] = {}
+        for file in sorted(
+            (partitioned_data_path / Path(day_col)).glob("*.parquet")
+        ):
+            days.setdefault(file.name[:8], []).append(file)
+        manifest[day_col] = days
+    return manifest
+
+
 def get_bid_data_for_periods(
     partitioned_data_path: Path,
     day_col: str,
@@ -63,22 +147,25 @@ def get_bid_data_for_periods(
     period_start: int,
     period_end: int,
     mins_per_period: int,
+    substantive_only: bool = False,
 ) -> pd.DataFrame:
     """
     Day should be a datetime with day, year and month
     NEM day starts at 4AM, hence add 4 hours in addition to PERIODID
+
+    If `substantive_only` is True, only offers that change quantities are
+    returned (see `substantive_offers`)
     """
-    q = pl.scan_parquet(
-        partitioned_data_path
-        / Path(day_col)
-        / Path(day.strftime("%Y%m%d") + "*.parquet")
-    ).filter(
+    files = get_day_partition_files(partitioned_data_path, day_col, day)
+    q = pl.scan_parquet(files).filter(
         (
             pl.col("PERIODID").is_between(
                 period_start, period_end, closed="both"
             )
         )
     )
+    if substantive_only:
+        q = substantive_offers(q)
     df = q.collect()
     df = df.to_pandas()
     df[day_col + "TIME"] = (
@@ -97,12 +184,12 @@ def get_all_rebids_before_dispatch_interval(df: pd.DataFrame) -> pd.DataFrame:
     of interest. This is probably because participants submit a rebid
     with the full 48/288 periods.
 
-    Hence the lower bound of `> pd.Timedelta(minutes=0)`.
+    Hence the lower bound of `> MIN_REBID_AHEAD_TIME` (0 minutes).
 
     This method will still capture bids that might have been submitted after
     (informal) gate closure.
     """
-    filtered = df[df["REBIDAHEADTIME"] > pd.Timedelta(minutes=0)]
+    filtered = df[df["REBIDAHEADTIME"] > MIN_REBID_AHEAD_TIME]
     return filtered
 
 
@@ -143,24 +230,94 @@ def rebid_counts_across_day(
     trading_year: int,
     trading_month: int,
     trading_day: int,
+    cache: Optional[ResultCache] = None,
+    substantive_only: bool = False,
 ) -> pd.DataFrame:
+    """
+    If a `cache` is provided, results are looked up in and stored to the cache
+    using a key computed by `get_day_cache_key`.
+
+    If `substantive_only` is True, only rebids that change quantities are
+    counted (see `substantive_offers`).
+    """
     trading_date = datetime(trading_year, trading_month, trading_day)
-    if trading_date < datetime(2021, 3, 1):
-        day_col = "SETTLEMENTDATE"
-        period_end = 49
-        mins_per_period = 30
-    else:
-        day_col = "TRADINGDATE"
-        period_end = 289
-        mins_per_period = 5
-    df = get_bid_data_for_periods(
+    if cache is not None:
+        key = get_day_cache_key(
+            partitioned_data_path,
+            path_to_mappings,
+            duids_path,
+            trading_date,
+            substantive_only=substantive_only,
+        )
+        if (counts := cache.get(key)) is not None:
+            return counts
+    df = get_day_bid_data(
+        partitioned_data_path, trading_date, substantive_only=substantive_only
+    )
+    counts = rebid_counts_from_day_data(
+        df, trading_date, path_to_mappings, duids_path
+    )
+    if cache is not None:
+        cache.put(key, counts)
+    return counts
+
+
+def get_day_cache_key(
+    partitioned_data_path: Path,
+    path_to_mappings: Path,
+    duids_path: Path,
+    trading_date: datetime,
+    substantive_only: bool = False,
+) -> str:
+    """
+    Cache key for day-level rebid counts based on the day's partition files,
+    the DUID and mapping files and the counting parameters
+    """
+    day_col, period_end, mins_per_period = get_day_parameters(trading_date)
+    files = get_day_partition_files(
+        partitioned_data_path, day_col, trading_date
+    )
+    params = {
+        "result": "rebid_counts_across_day",
+        "trading_date": trading_date.isoformat(),
+        "day_col": day_col,
+        "period_start": 1,
+        "period_end": period_end - 1,
+        "mins_per_period": mins_per_period,
+        "min_rebid_ahead_time": str(MIN_REBID_AHEAD_TIME),
+        "substantive_only": substantive_only,
+    }
+    return make_cache_key(
+        files,
+        get_gen_tech_mapping_files(path_to_mappings, duids_path),
+        params,
+    )
+
+
+def get_day_bid_data(
+    partitioned_data_path: Path,
+    trading_date: datetime,
+    substantive_only: bool = False,
+) -> pd.DataFrame:
+    day_col, period_end, mins_per_period = get_day_parameters(trading_date)
+    return get_bid_data_for_periods(
         partitioned_data_path,
         day_col,
         trading_date,
         1,
         period_end,
         mins_per_period,
+        substantive_only=substantive_only,
     )
+
+
+def rebid_counts_from_day_data(
+    df: pd.DataFrame,
+    trading_date: datetime,
+    path_to_mappings: Path,
+    duids_path: Path,
+) -> pd.DataFrame:
+    _, period_end, mins_per_period = get_day_parameters(trading_date)
     counts = {}
     for period_id in range(1, period_end):
         trading_datetime = trading_date + pd.Timedelta(
@@ -175,6 +332,267 @@ def rebid_counts_across_day(
     return counts
 
 
+def get_cached_day_counts(
+    cache: ResultCache,
+    partitioned_data_path: Path,
+    path_to_mappings: Path,
+    duids_path: Path,
+    trading_dates: List[datetime],
+    substantive_only: bool = False,
+) -> Dict[datetime, pd.DataFrame]:
+    """
+    Returns cached day-level rebid counts for trading dates with cache hits
+    """
+    cached_days = {}
+    for trading_date in trading_dates:
+        try:
+            key = get_day_cache_key(
+                partitioned_data_path,
+                path_to_mappings,
+                duids_path,
+                trading_date,
+                substantive_only=substantive_only,
+            )
+        except FileNotFoundError:
+            continue
+        if (counts := cache.get(key)) is not None:
+            cached_days[trading_date] = counts
+    return cached_days
+
+
+def prefetch_day_bid_data(
+    partitioned_data_path: Path,
+    trading_dates: List[datetime],
+    prefetch_days: int = 2,
+    prefetch_memory_gb: float = 8.0,
+    substantive_only: bool = False,
+) -> Iterator[Tuple[datetime, Optional[pd.DataFrame]]]:
+    """
+    Yields (trading date, bid data) in order, reading up to `prefetch_days`
+    days ahead in background threads so that reading overlaps with counting.
+
+    The number of days read ahead is further bounded so that the estimated
+    in-memory size of the days being prefetched (see `PARQUET_EXPANSION_FACTOR`)
+    stays within `prefetch_memory_gb`. At least one day is always read ahead.
+    This bound excludes the day currently being processed by the caller.
+
+    Bid data is None for days with no partitions.
+    """
+    budget = prefetch_memory_gb * 1e9
+    pending: Deque[Tuple[datetime, Optional[Future], float]] = deque()
+    pending_size = 0.0
+    dates = iter(trading_dates)
+    next_date = next(dates, None)
+    with ThreadPoolExecutor(max_workers=prefetch_days) as executor:
+        while next_date is not None or pending:
+            while next_date is not None and len(pending) < prefetch_days:
+                day_col, _, _ = get_day_parameters(next_date)
+                try:
+                    files = get_day_partition_files(
+                        partitioned_data_path, day_col, next_date
+                    )
+                except FileNotFoundError:
+                    pending.append((next_date, None, 0.0))
+                    next_date = next(dates, None)
+                    continue
+                size = sum(
+                    file.stat().st_size * PARQUET_EXPANSION_FACTOR
+                    for file in files
+                )
+                if pending and pending_size + size > budget:
+                    break
+                future = executor.submit(
+                    get_day_bid_data,
+                    partitioned_data_path,
+                    next_date,
+                    substantive_only,
+                )
+                pending.append((next_date, future, size))
+                pending_size += size
+                next_date = next(dates, None)
+            trading_date, future, size = pending.popleft()
+            pending_size -= size
+            if future is None:
+                yield trading_date, None
+            else:
+                yield trading_date, future.result()
+
+
+def get_peak_rss_gb() -> float:
+    """
+    Peak resident set size of this process in GB.
+    `ru_maxrss` is in kilobytes on Linux but in bytes on macOS
+    """
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return peak_rss / 1e9
+    return peak_rss / 1e6
+
+
+def batch_partition_files(
+    files: List[Path], memory_limit_gb: float
+) -> List[List[Path]]:
+    """
+    Greedily groups partition files into batches whose estimated in-memory size
+    fits within half of the memory limit. The other half is left for distinct
+    rebid keys held in memory before they are spilled to disk.
+
+    A file that exceeds the budget on its own is placed in its own batch.
+    """
+    budget = memory_limit_gb * 1e9 / 2
+    batches: List[List[Path]] = []
+    batch: List[Path] = []
+    batch_size = 0.0
+    for file in files:
+        file_size = file.stat().st_size * PARQUET_EXPANSION_FACTOR
+        if batch and batch_size + file_size > budget:
+            batches.append(batch)
+            batch = []
+            batch_size = 0.0
+        batch.append(file)
+        batch_size += file_size
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def scan_rebid_keys(
+    files: List[Path],
+    day_col: str,
+    period_start: int,
+    period_end: int,
+    mins_per_period: int,
+    unique: bool = True,
+) -> pl.LazyFrame:
+    """
+    Lazily selects distinct (dispatch interval, offer time, DUID) keys for bids
+    submitted before the dispatch interval. Equivalent to the filtering in
+    `get_all_rebids_before_dispatch_interval` and the deduplication in
+    `count_rebids_by_tech`, but without materialising the full bid data.
+
+    If `unique` is False, keys are not deduplicated (e.g. for sketches).
+    """
+    offer_col = [
+        col for col in pl.read_parquet_schema(files[0]) if "OFFERDATE" in col
+    ].pop()
+    time_col = day_col + "TIME"
+    interval_offset = pl.duration(
+        minutes=pl.col("PERIODID").cast(pl.Int64) * mins_per_period
+    ) + pl.duration(hours=4)
+    keys = (
+        pl.scan_parquet(files)
+        .filter(
+            pl.col("PERIODID").is_between(
+                period_start, period_end, closed="both"
+            )
+        )
+        .select(
+            (pl.col(day_col) + interval_offset).alias(time_col),
+            pl.col(offer_col),
+            pl.col("DUID"),
+        )
+        .filter((pl.col(time_col) - pl.col(offer_col)) > MIN_REBID_AHEAD_TIME)
+    )
+    if unique:
+        keys = keys.unique()
+    return keys
+
+
+def count_rebid_keys_by_tech(
+    keys: pl.LazyFrame, mapping: pd.DataFrame, time_col: str
+) -> pd.DataFrame:
+    """
+    Counts distinct rebid keys by technology type for each dispatch interval.
+    Returns a DataFrame with dispatch intervals as the index and technology
+    types as columns, as per `rebid_counts_across_day`.
+    """
+    tech_mapping = pl.from_pandas(mapping[["DUID", "Tech"]])
+    counts = (
+        keys.join(tech_mapping.lazy(), on="DUID", how="left")
+        .with_columns(pl.col("Tech").fill_null("Unknown"))
+        .group_by([time_col, "Tech"])
+        .agg(pl.len().alias("REBIDS"))
+        .collect(streaming=True)
+        .to_pandas()
+    )
+    counts = counts.pivot(index=time_col, columns="Tech", values="REBIDS")
+    counts.index.name = None
+    counts.columns.name = None
+    return counts
+
+
+def rebid_counts_across_day_out_of_core(
+    partitioned_data_path: Path,
+    path_to_mappings: Path,
+    duids_path: Path,
+    trading_year: int,
+    trading_month: int,
+    trading_day: int,
+    memory_limit_gb: float = 4.0,
+    spill_path: Optional[Path] = None,
+    cache: Optional[ResultCache] = None,
+) -> pd.DataFrame:
+    """
+    Bounded-memory equivalent of `rebid_counts_across_day`.
+
+    Partition files for the day are processed in batches sized to the memory
+    limit (see `batch_partition_files`). Distinct rebid keys from each batch are
+    held in memory until they exceed half of the memory limit, after which they
+    are spilled to parquet files in `spill_path` (a temporary directory if not
+    provided). Spilled and in-memory keys are deduplicated and counted using the
+    polars streaming engine.
+
+    The memory limit is enforced by batch sizing rather than by the OS, so it
+    relies on `PARQUET_EXPANSION_FACTOR` being a conservative estimate.
+
+    Results are shared with `rebid_counts_across_day` if a `cache` is provided.
+    """
+    trading_date = datetime(trading_year, trading_month, trading_day)
+    if cache is not None:
+        key = get_day_cache_key(
+            partitioned_data_path, path_to_mappings, duids_path, trading_date
+        )
+        if (cached := cache.get(key)) is not None:
+            return cached
+    day_col, period_end, mins_per_period = get_day_parameters(trading_date)
+    time_col = day_col + "TIME"
+    files = get_day_partition_files(
+        partitioned_data_path, day_col, trading_date
+    )
+    spill_budget = memory_limit_gb * 1e9 / 2
+    with tempfile.TemporaryDirectory(dir=spill_path) as spill_dir:
+        in_memory_keys: List[pl.DataFrame] = []
+        in_memory_size = 0
+        spilled: List[Path] = []
+        for batch in batch_partition_files(files, memory_limit_gb):
+            keys = scan_rebid_keys(
+                batch, day_col, 1, period_end - 1, mins_per_period
+            ).collect(streaming=True)
+            in_memory_keys.append(keys)
+            in_memory_size += keys.estimated_size()
+            if in_memory_size > spill_budget:
+                spill_file = Path(spill_dir, f"keys-{len(spilled)}.parquet")
+                pl.concat(in_memory_keys).unique().write_parquet(spill_file)
+                spilled.append(spill_file)
+                in_memory_keys = []
+                in_memory_size = 0
+        all_keys = [pl.scan_parquet(spill_file) for spill_file in spilled]
+        all_keys += [keys.lazy() for keys in in_memory_keys]
+        mapping = get_gen_tech_mapping(path_to_mappings, duids_path)
+        counts = count_rebid_keys_by_tech(
+            pl.concat(all_keys).unique(), mapping, time_col
+        )
+    all_intervals = [
+        trading_date
+        + pd.Timedelta(hours=4, minutes=(mins_per_period * period_id))
+        for period_id in range(1, period_end)
+    ]
+    counts = counts.reindex(all_intervals)
+    if cache is not None:
+        cache.put(key, counts)
+    return counts
+
+
 def rebid_counts_across_month(
     years: List[int],
     month: int,
@@ -182,37 +600,195 @@ def rebid_counts_across_month(
     mappings_path: Path,
     duids_path: Path,
     output_path: Path,
+    out_of_core: bool = False,
+    memory_limit_gb: float = 4.0,
+    prefetch_days: int = 0,
+    prefetch_memory_gb: float = 8.0,
+    cache_path: Optional[Path] = None,
+    cache_max_size_gb: float = 1.0,
+    output_format: str = DEFAULT_PROCESSED_FORMAT,
+    substantive_only: bool = False,
 ) -> None:
+    """
+    Counts are written to output_path in `output_format` (see
+    `write_processed`).
+
+    If `substantive_only` is True, only rebids that change quantities are
+    counted (see `substantive_offers`) and counts are written to
+    `substantive_rebid_counts_*` files. This is not supported in out-of-core
+    mode, as offers are compared across all of a day's partitions.
+
+    If `out_of_core` is True, days are processed using
+    `rebid_counts_across_day_out_of_core` with the given memory limit (GB).
+    Otherwise, if `prefetch_days` > 0, bid data for upcoming days is read in the
+    background while the current day is counted (see `prefetch_day_bid_data`).
+
+    If `cache_path` is provided, day-level counts are cached in a `ResultCache`
+    at that location and only days with changed inputs are recomputed.
+
+    Peak resident memory is logged at the end of the run.
+    """
+    if substantive_only and out_of_core:
+        raise ValueError(
+            "Substantive rebid counts are not supported in out-of-core mode"
+        )
+    cache = None
+    if cache_path is not None:
+        cache = ResultCache(cache_path, max_size_gb=cache_max_size_gb)
     for year in years:
         logging.info(f"Processing {year}")
         month_data: List[pd.DataFrame] = []
-        for day in tqdm(range(1, 31), desc=f"Processing {year}"):
-            try:
-                day_count = rebid_counts_across_day(
+        if prefetch_days and not out_of_core:
+            trading_dates = [
+                datetime(year, month, day) for day in range(1, 31)
+            ]
+            cached_days = {}
+            if cache is not None:
+                cached_days = get_cached_day_counts(
+                    cache,
                     partitioned_data_path,
                     mappings_path,
                     duids_path,
-                    year,
-                    month,
-                    day,
-                )
-            except FileNotFoundError:
-                logging.warning(
-                    f"No data for {day}/{month}/{year}. Continuing"
+                    trading_dates,
+                    substantive_only=substantive_only,
                 )
-                continue
-            month_data.append(day_count)
-        month_df = pd.concat(month_data, axis=0)
-        month_df.to_parquet(
-            output_path
-            / Path(
-                f"rebid_counts_{month}_{year}.parquet",
+                month_data.extend(cached_days.values())
+            day_data = prefetch_day_bid_data(
+                partitioned_data_path,
+                [d for d in trading_dates if d not in cached_days],
+                prefetch_days=prefetch_days,
+                prefetch_memory_gb=prefetch_memory_gb,
+                substantive_only=substantive_only,
             )
+            for trading_date, df in tqdm(
+                day_data,
+                total=len(trading_dates) - len(cached_days),
+                desc=f"Processing {year}",
+            ):
+                if df is None:
+                    logging.warning(
+                        f"No data for {trading_date.day}/{month}/{year}. "
+                        + "Continuing"
+                    )
+                    continue
+                day_count = rebid_counts_from_day_data(
+                    df, trading_date, mappings_path, duids_path
+                )
+                if cache is not None:
+                    key = get_day_cache_key(
+                        partitioned_data_path,
+                        mappings_path,
+                        duids_path,
+                        trading_date,
+                        substantive_only=substantive_only,
+                    )
+                    cache.put(key, day_count)
+                month_data.append(day_count)
+        else:
+            for day in tqdm(range(1, 31), desc=f"Processing {year}"):
+                try:
+                    if out_of_core:
+                        day_count = rebid_counts_across_day_out_of_core(
+                            partitioned_data_path,
+                            mappings_path,
+                            duids_path,
+                            year,
+                            month,
+                            day,
+                            memory_limit_gb=memory_limit_gb,
+                            cache=cache,
+                        )
+                    else:
+                        day_count = rebid_counts_across_day(
+                            partitioned_data_path,
+                            mappings_path,
+                            duids_path,
+                            year,
+                            month,
+                            day,
+                            cache=cache,
+                            substantive_only=substantive_only,
+                        )
+                except FileNotFoundError:
+                    logging.warning(
+                        f"No data for {day}/{month}/{year}. Continuing"
+                    )
+                    continue
+                month_data.append(day_count)
+        month_df = pd.concat(month_data, axis=0).sort_index()
+        prefix = (
+            "substantive_rebid_counts" if substantive_only else "rebid_counts"
+        )
+        write_processed(
+            month_df,
+            output_path / Path(f"{prefix}_{month}_{year}"),
+            output_format=output_format,
         )
+    logging.info(f"Peak resident memory: {get_peak_rss_gb():.2f} GB")
+
+
+def arg_parser():
+    description = "Count rebids by technology type for a month across years"
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument(
+        "-out_of_core",
+        action="store_true",
+        help=("Process partitions in batches bounded by -memory_limit_gb"),
+    )
+    parser.add_argument(
+        "-memory_limit_gb",
+        type=float,
+        default=4.0,
+        help=("Memory ceiling (GB) for out-of-core mode. Default 4"),
+    )
+    parser.add_argument(
+        "-prefetch_days",
+        type=int,
+        default=0,
+        help=("Number of days of bid data to read ahead. Default 0 (off)"),
+    )
+    parser.add_argument(
+        "-prefetch_memory_gb",
+        type=float,
+        default=8.0,
+        help=("Memory budget (GB) for days being read ahead. Default 8"),
+    )
+    parser.add_argument(
+        "-cache_path",
+        type=str,
+        default=None,
+        help=("Directory for cached day-level rebid counts. Default no cache"),
+    )
+    parser.add_argument(
+        "-cache_max_size_gb",
+        type=float,
+        default=1.0,
+        help=("Maximum size (GB) of the rebid count cache. Default 1"),
+    )
+    parser.add_argument(
+        "-output_format",
+        type=str,
+        default=DEFAULT_PROCESSED_FORMAT,
+        choices=list(PROCESSED_FORMATS.keys()),
+        help=(
+            f"Rebid count output format. Default {DEFAULT_PROCESSED_FORMAT}"
+        ),
+    )
+    parser.add_argument(
+        "-substantive_only",
+        action="store_true",
+        help=(
+            "Only count rebids that change MAXAVAIL or band quantities. "
+            + "Not supported with -out_of_core"
+        ),
+    )
+    args = parser.parse_args()
+    return args
 
 
 def main():
     logging.basicConfig(level=logging.INFO)
+    args = arg_parser()
     plt.style.use(Path("plot_scripts", "matplotlibrc.mplstyle"))
     partitioned_path = Path("data", "partitioned")
     mappings_path = Path("data", "mappings")
@@ -229,6 +805,14 @@ def main():
         mappings_path,
         duids_path,
         output_path,
+        out_of_core=args.out_of_core,
+        memory_limit_gb=args.memory_limit_gb,
+        prefetch_days=args.prefetch_days,
+        prefetch_memory_gb=args.prefetch_memory_gb,
+        cache_path=Path(args.cache_path) if args.cache_path else None,
+        cache_max_size_gb=args.cache_max_size_gb,
+        output_format=args.output_format,
+        substantive_only=args.substantive_only,
     )
 
 
@@ -0,0 +1,102 @@
+import json
+import logging
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict
+
+import pandas as pd
+
+# Increment when the parsing of a cached reference table changes so that
+# existing caches are refreshed
+REFERENCE_CACHE_VERSION = 1
+MANIFEST_FILE = "manifest.json"
+# Reference data cache directory, relative to the raw data directory
+REFERENCE_CACHE_DIR = "reference"
+
+
+def _read_manifest(cache_path: Path) -> Dict[str, Dict]:
+    manifest_file = cache_path / Path(MANIFEST_FILE)
+    if not manifest_file.exists():
+        return {}
+    with open(manifest_file, "r") as f:
+        return json.load(f)
+
+
+def _write_manifest(cache_path: Path, manifest: Dict[str, Dict]) -> None:
+    with open(cache_path / Path(MANIFEST_FILE), "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+
+def _stringify_mixed_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Tables read from Excel can have object columns with mixed types (e.g.
+    numbers and "-"), which cannot be written to parquet. Non-null values in
+    these columns are converted to strings.
+    """
+    df = df.copy()
+    for col in df.columns[df.dtypes == object]:
+        if pd.api.types.infer_dtype(df[col], skipna=True) not in (
+            "string",
+            "empty",
+        ):
+            df[col] = df[col].where(df[col].isna(), df[col].astype(str))
+    return df
+
+
+def get_cached_reference_table(
+    table_name: str,
+    version: str,
+    fetch: Callable[[], pd.DataFrame],
+    cache_path: Path,
+    offline: bool = False,
+    refresh: bool = False,
+) -> pd.DataFrame:
+    """
+    Returns a parsed reference table (e.g. DISPATCHABLEUNIT) from a parquet
+    cache, calling `fetch` to fetch and parse the table if the cache is missing
+    or out of date.
+
+    Cached tables are tracked in a manifest in `cache_path` that records the
+    table version (e.g. the MMS archive year and month), the cache version (see
+    `REFERENCE_CACHE_VERSION`) and when the table was fetched. A cached table is
+    used if both versions match, unless `refresh` is True.
+
+    If `offline` is True, a cached table is used regardless of its version and
+    FileNotFoundError is raised if the table has not been cached. If fetching
+    fails, a cached table (of any version) is used with a warning.
+    """
+    if not cache_path.exists():
+        cache_path.mkdir(parents=True)
+    manifest = _read_manifest(cache_path)
+    entry = manifest.get(table_name)
+    table_file = cache_path / Path(f"{table_name}.parquet")
+    if table_file.exists() and not refresh:
+        if offline or (
+            entry is not None
+            and entry["version"] == version
+            and entry["cache_version"] == REFERENCE_CACHE_VERSION
+        ):
+            return pd.read_parquet(table_file)
+    if offline:
+        raise FileNotFoundError(f"{table_name} not cached in {cache_path}")
+    logging.info(f"Fetching {table_name} ({version})")
+    try:
+        df = fetch()
+    except Exception:
+        if not table_file.exists():
+            raise
+        logging.warning(
+            f"Could not fetch {table_name}. Using cached version "
+            + f"{entry['version'] if entry else 'unknown'}",
+            exc_info=True,
+        )
+        return pd.read_parquet(table_file)
+    _stringify_mixed_columns(df).to_parquet(table_file)
+    manifest[table_name] = {
+        "version": version,
+        "cache_version": REFERENCE_CACHE_VERSION,
+        "fetched": datetime.now().isoformat(timespec="seconds"),
+        "rows": len(df),
+    }
+    _write_manifest(cache_path, manifest)
+    return pd.read_parquet(table_file)
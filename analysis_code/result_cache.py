@@ -0,0 +1,104 @@
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import pandas as pd
+
+
+def hash_file(file_path: Path) -> str:
+    sha = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(2**20), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def fingerprint_file(file_path: Path, hash_contents: bool = False) -> str:
+    """
+    Fingerprint a file using its name, size and modification time. If
+    `hash_contents` is True, a hash of the file contents is also included.
+    Hashing contents is robust to files being rewritten with the same size and
+    modification time, but is slow for large partitions.
+    """
+    stat = file_path.stat()
+    fingerprint = f"{file_path.name}:{stat.st_size}:{stat.st_mtime_ns}"
+    if hash_contents:
+        fingerprint += ":" + hash_file(file_path)
+    return fingerprint
+
+
+def make_cache_key(
+    partition_files: List[Path],
+    mapping_files: List[Path],
+    params: Dict[str, Any],
+    hash_partitions: bool = False,
+) -> str:
+    """
+    Content-addressed key for a result computed from partition files, mapping
+    files and parameters. Mapping files are small, so their contents are always
+    hashed. Parameters must be JSON-serialisable (or representable as strings).
+    """
+    key_data = {
+        "partitions": [
+            fingerprint_file(file, hash_contents=hash_partitions)
+            for file in sorted(partition_files)
+        ],
+        "mappings": [hash_file(file) for file in sorted(mapping_files)],
+        "params": params,
+    }
+    key_json = json.dumps(key_data, sort_keys=True, default=str)
+    return hashlib.sha256(key_json.encode()).hexdigest()
+
+
+class ResultCache:
+    """
+    On-disk cache of DataFrames stored as parquet files named by cache key.
+
+    Entries are evicted in least-recently-used order once the total size of the
+    cache exceeds `max_size_gb`. Recency is tracked using file modification
+    times, which are updated on each cache hit.
+    """
+
+    def __init__(self, cache_path: Path, max_size_gb: float = 1.0):
+        self.cache_path = cache_path
+        self.max_size = max_size_gb * 1e9
+        if not self.cache_path.exists():
+            self.cache_path.mkdir(parents=True)
+
+    def _entry_path(self, key: str) -> Path:
+        return self.cache_path / Path(key + ".parquet")
+
+    def get(self, key: str) -> Optional[pd.DataFrame]:
+        entry = self._entry_path(key)
+        try:
+            df = pd.read_parquet(entry)
+        except FileNotFoundError:
+            return None
+        os.utime(entry)
+        return df
+
+    def put(self, key: str, df: pd.DataFrame) -> None:
+        entry = self._entry_path(key)
+        # write to a temporary file first so that readers never see a
+        # partially-written entry
+        temp_entry = entry.with_suffix(f".{os.getpid()}.tmp")
+        df.to_parquet(temp_entry)
+        os.replace(temp_entry, entry)
+        self.evict()
+
+    def evict(self) -> None:
+        entries = []
+        for entry in self.cache_path.glob("*.parquet"):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, entry))
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, entry in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            entry.unlink(missing_ok=True)
+            total_size -= size
@@ -0,0 +1,364 @@
+import json
+import logging
+import os
+import random
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import pandas as pd
+
+"""Time (seconds) after which a lease that has not been renewed expires, so that
+tasks claimed by a crashed worker can be claimed by another. Leases are renewed
+every quarter of this. Lease expiry is judged using the claiming host's clock
+and the file modification times set by the shared filesystem, so this should
+be much larger than any clock skew between hosts.
+"""
+DEFAULT_LEASE_SECS = 60.0
+# task statuses recorded in done markers
+TASK_STATUSES = ["ok", "no_data", "failed"]
+
+
+def _write_json_atomic(path: Path, content: Dict) -> None:
+    temp_file = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+    with open(temp_file, "w") as f:
+        json.dump(content, f, indent=2, sort_keys=True)
+    os.replace(temp_file, path)
+
+
+def _create_json_exclusive(path: Path, content: Dict) -> bool:
+    """
+    Creates a JSON file only if it does not already exist, by hard-linking a
+    temporary file to it. This is atomic on local filesystems and NFS. Returns
+    True if the file was created.
+    """
+    temp_file = path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+    with open(temp_file, "w") as f:
+        json.dump(content, f, indent=2, sort_keys=True)
+    try:
+        os.link(temp_file, path)
+    except OSError:
+        pass
+    try:
+        # a link can be created on NFS even if an error is returned, so
+        # success is checked using the link count
+        return os.stat(temp_file).st_nlink == 2
+    finally:
+        temp_file.unlink()
+
+
+def _read_json(path: Path) -> Optional[Dict]:
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class Lease:
+    """
+    A worker's claim on a task, held as a lease file containing a unique token.
+    While held (as a context manager), the lease is renewed by a background
+    thread that updates the lease file's modification time. If the lease is
+    found to have been taken by another worker (e.g. after this worker stalled
+    for longer than the lease), `lost` is set.
+    """
+
+    def __init__(self, task: Dict, lease_file: Path, token: str, secs: float):
+        self.task = task
+        self.lease_file = lease_file
+        self.token = token
+        self.secs = secs
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._renew, daemon=True)
+
+    def held(self) -> bool:
+        """
+        Whether the lease file still holds this lease's token
+        """
+        content = _read_json(self.lease_file)
+        return content is not None and content["token"] == self.token
+
+    def _renew(self) -> None:
+        while not self._stop.wait(self.secs / 4):
+            try:
+                if not self.held():
+                    raise FileNotFoundError(self.lease_file)
+                os.utime(self.lease_file)
+            except FileNotFoundError:
+                logging.warning(f"Lost lease on {self.task['id']}")
+                self.lost = True
+                return None
+
+    def __enter__(self) -> "Lease":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def release(self) -> None:
+        if self.held():
+            self.lease_file.unlink(missing_ok=True)
+
+
+class WorkQueue:
+    """
+    Work queue on a (shared) filesystem that any number of worker processes or
+    hosts can claim tasks from. A queue directory contains:
+    - `tasks/<id>.json`: task definitions
+    - `leases/<id>.lease`: the worker and token holding each claimed task
+    - `done/<id>.json`: the status of each finished task (see `TASK_STATUSES`)
+    - `results/<id>.parquet`: results of tasks that return a DataFrame
+
+    Leases and done markers are created exclusively (see
+    `_create_json_exclusive`). Expired leases are broken by renaming them, so
+    only one worker can take over a task.
+
+    Tasks should be idempotent, and results are written atomically, so a task
+    that is run twice (e.g. by a worker that stalled past its lease) gives the
+    same outcome.
+    """
+
+    def __init__(
+        self, queue_path: Path, lease_secs: float = DEFAULT_LEASE_SECS
+    ):
+        self.path = queue_path
+        self.lease_secs = lease_secs
+        for directory in ("tasks", "leases", "done", "results"):
+            (self.path / Path(directory)).mkdir(parents=True, exist_ok=True)
+
+    def _task_file(self, task_id: str) -> Path:
+        return self.path / Path("tasks", task_id + ".json")
+
+    def _lease_file(self, task_id: str) -> Path:
+        return self.path / Path("leases", task_id + ".lease")
+
+    def _done_file(self, task_id: str) -> Path:
+        return self.path / Path("done", task_id + ".json")
+
+    def result_file(self, task_id: str) -> Path:
+        return self.path / Path("results", task_id + ".parquet")
+
+    def _ids(self, directory: str, suffix: str) -> List[str]:
+        return sorted(
+            name[: -len(suffix)]
+            for name in os.listdir(self.path / Path(directory))
+            if name.endswith(suffix) and not name.startswith(".")
+        )
+
+    def task_ids(self) -> List[str]:
+        return self._ids("tasks", ".json")
+
+    def done_ids(self) -> List[str]:
+        return self._ids("done", ".json")
+
+    def add_tasks(self, tasks: List[Dict]) -> int:
+        """
+        Adds tasks (dicts with a unique `id`) that are not already in the
+        queue. Returns the number of tasks added.
+        """
+        existing = set(self.task_ids())
+        added = 0
+        for task in tasks:
+            if task["id"] not in existing:
+                _write_json_atomic(self._task_file(task["id"]), task)
+                added += 1
+        return added
+
+    def task(self, task_id: str) -> Dict:
+        content = _read_json(self._task_file(task_id))
+        if content is None:
+            raise FileNotFoundError(f"No task {task_id}")
+        return content
+
+    def done(self, task_id: str) -> Optional[Dict]:
+        return _read_json(self._done_file(task_id))
+
+    def _try_create_lease(self, task_id: str, token: str) -> bool:
+        return _create_json_exclusive(
+            self._lease_file(task_id),
+            {
+                "worker": worker_id(),
+                "token": token,
+                "claimed": datetime.now().isoformat(),
+            },
+        )
+
+    def _break_expired_lease(self, task_id: str, token: str) -> bool:
+        """
+        Removes the lease on a task if it has expired. Returns True if the
+        task is no longer leased.
+        """
+        lease_file = self._lease_file(task_id)
+        try:
+            mtime = lease_file.stat().st_mtime
+        except FileNotFoundError:
+            return True
+        expired = _read_json(lease_file)
+        if expired is None or time.time() - mtime <= self.lease_secs:
+            return False
+        broken = lease_file.with_name(f".{lease_file.name}.{token}.expired")
+        try:
+            os.rename(lease_file, broken)
+        except FileNotFoundError:
+            return False
+        content = _read_json(broken)
+        if content is None or content["token"] != expired["token"]:
+            # another worker broke the expired lease and claimed the task
+            # first, so its lease is restored
+            try:
+                os.link(broken, lease_file)
+            except FileExistsError:
+                pass
+            broken.unlink()
+            return False
+        broken.unlink()
+        logging.warning(
+            f"Lease on {task_id} held by {expired['worker']} expired"
+        )
+        return True
+
+    def claim(self) -> Optional[Lease]:
+        """
+        Claims an unfinished task that is not leased (or whose lease has
+        expired). Tasks are tried in a random order to reduce contention
+        between workers. Returns None if no task can be claimed.
+        """
+        done = set(self.done_ids())
+        pending = [
+            task_id for task_id in self.task_ids() if task_id not in done
+        ]
+        random.shuffle(pending)
+        for task_id in pending:
+            token = uuid.uuid4().hex
+            if not self._break_expired_lease(task_id, token):
+                continue
+            if not self._try_create_lease(task_id, token):
+                continue
+            # the task may have finished between listing and claiming
+            if self.done(task_id) is not None:
+                self._lease_file(task_id).unlink(missing_ok=True)
+                continue
+            return Lease(
+                self.task(task_id),
+                self._lease_file(task_id),
+                token,
+                self.lease_secs,
+            )
+        return None
+
+    def complete(
+        self, lease: Lease, status: str, error: Optional[str] = None
+    ) -> None:
+        """
+        Records a task's status and releases its lease. If the task was
+        already finished by another worker (e.g. after this worker's lease
+        expired), its status is kept, so the status (and token) of the first
+        worker to finish a task is recorded.
+        """
+        _create_json_exclusive(
+            self._done_file(lease.task["id"]),
+            {
+                "status": status,
+                "error": error,
+                "worker": worker_id(),
+                "token": lease.token,
+                "finished": datetime.now().isoformat(),
+            },
+        )
+        lease.release()
+
+    def reset_failed(self) -> int:
+        """
+        Requeues failed tasks. Returns the number of tasks requeued.
+        """
+        reset = 0
+        for task_id in self.done_ids():
+            if (done := self.done(task_id)) and done["status"] == "failed":
+                self._done_file(task_id).unlink(missing_ok=True)
+                reset += 1
+        return reset
+
+    def status(self) -> Dict[str, int]:
+        """
+        Number of tasks that are pending, leased and finished with each status
+        """
+        task_ids = self.task_ids()
+        done = {task_id: self.done(task_id) for task_id in self.done_ids()}
+        leased = set(self._ids("leases", ".lease"))
+        counts = {
+            "pending": len(
+                [t for t in task_ids if t not in done and t not in leased]
+            ),
+            "leased": len(
+                [t for t in task_ids if t not in done and t in leased]
+            ),
+        }
+        for status in TASK_STATUSES:
+            counts[status] = len(
+                [t for t in done.values() if t and t["status"] == status]
+            )
+        return counts
+
+
+def run_worker(
+    queue: WorkQueue,
+    handler: Callable[[Lease], Optional[pd.DataFrame]],
+    poll_secs: float = 5.0,
+) -> int:
+    """
+    Claims and runs tasks until all tasks in the queue are finished, waiting
+    for `poll_secs` when the remaining tasks are leased by other workers (in
+    case their leases expire). Returns the number of tasks run.
+
+    `handler` runs the task of a lease. DataFrames it returns are written to
+    the task's result file. Tasks that raise FileNotFoundError are recorded as
+    having no data, and tasks that raise other exceptions as failed. If the
+    lease was lost while the task ran (i.e. another worker took over the
+    task), its result and status are discarded.
+    """
+    n_run = 0
+    while True:
+        lease = queue.claim()
+        if lease is None:
+            if len(queue.done_ids()) >= len(queue.task_ids()):
+                return n_run
+            time.sleep(poll_secs)
+            continue
+        task_id = lease.task["id"]
+        result, status, error = None, "ok", None
+        with lease:
+            try:
+                result = handler(lease)
+            except FileNotFoundError as e:
+                status, error = "no_data", str(e)
+            except (Exception, SystemExit) as e:
+                logging.exception(f"Task {task_id} failed")
+                status, error = "failed", repr(e)
+            if result is not None:
+                result_file = queue.result_file(task_id)
+                temp_file = result_file.with_name(
+                    f".{result_file.name}.{lease.token}.tmp"
+                )
+                result.to_parquet(temp_file)
+                if lease.lost or not lease.held():
+                    temp_file.unlink()
+                else:
+                    os.replace(temp_file, result_file)
+        if lease.lost or not lease.held():
+            logging.warning(f"Lost lease on {task_id}. Discarding result")
+            continue
+        queue.complete(lease, status, error)
+        n_run += 1
+        logging.info(f"Finished {task_id} ({status})")
@@ -0,0 +1,173 @@
+# Python script (executable via CLI) to benchmark parquet writer profiles
+# on a sample of a large AEMO data CSV (e.g. BIDPEROFFER)
+#
+# Copyright (C) 2023 Abhijith Prakash
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import argparse
+import logging
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, List
+
+import pandas as pd
+import polars as pl
+
+from create_parquet_partitions_by_column import (
+    bidperoffer_dtypes,
+    dt_format,
+    get_columns,
+    get_date_cols,
+    get_writer_kwargs,
+    writer_profiles,
+)
+
+
+def arg_parser():
+    description = (
+        "Benchmark parquet writer profiles (file size, write throughput and "
+        + "polars read latency) on a sample of an AEMO data table CSV"
+    )
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument(
+        "-file", type=str, required=True, help=("File to sample. Must be CSV")
+    )
+    parser.add_argument(
+        "-nrows",
+        type=int,
+        default=10**6,
+        help=("Number of lines to sample. Default 10^6"),
+    )
+    parser.add_argument(
+        "-profiles",
+        type=str,
+        nargs="+",
+        default=list(writer_profiles.keys()),
+        choices=list(writer_profiles.keys()),
+        help=("Writer profiles to benchmark. Default all"),
+    )
+    parser.add_argument(
+        "-repeats",
+        type=int,
+        default=3,
+        help=("Number of repeats for each timing. Best time is reported"),
+    )
+    parser.add_argument(
+        "-output",
+        type=str,
+        help=("Path to save benchmark results (CSV)"),
+    )
+    args = parser.parse_args()
+    return args
+
+
+def read_sample(file_path: Path, nrows: int) -> pd.DataFrame:
+    """
+    Reads the first `nrows` data rows using the same dtypes and date parsing as
+    `chunk_file`, dropping any trailing non-data (i.e. not "D") rows
+    """
+    cols = get_columns(file_path)
+    if "BIDPEROFFER" in file_path.stem:
+        dtypes = bidperoffer_dtypes
+    else:
+        dtypes = None
+    sample = pd.read_csv(
+        file_path,
+        skiprows=2,
+        nrows=nrows,
+        names=cols,
+        dtype=dtypes,
+        parse_dates=get_date_cols(cols),
+        date_format=dt_format,
+    )
+    return sample[sample.iloc[:, 0] == "D"]
+
+
+def best_time(func: Callable[[], object], repeats: int) -> float:
+    times: List[float] = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def benchmark_profile(
+    sample: pd.DataFrame, writer_profile: str, output_dir: Path, repeats: int
+) -> Dict[str, float]:
+    """
+    Measures file size, write throughput and read latency for a writer profile.
+
+    Read latency is measured for a full `scan_parquet` collect and for a query
+    resembling the rebid analysis (filter on PERIODID, select a few columns).
+    """
+    file_path = output_dir / Path(f"{writer_profile}.parquet")
+    writer_kwargs = get_writer_kwargs(writer_profile, sample.columns)
+    write_time = best_time(
+        lambda: sample.to_parquet(
+            file_path, engine="pyarrow", **writer_kwargs
+        ),
+        repeats,
+    )
+    query_cols = [
+        col for col in sample.columns if "DATE" in col and "LAST" not in col
+    ] + ["DUID", "PERIODID"]
+    full_read_time = best_time(
+        lambda: pl.scan_parquet(file_path).collect(), repeats
+    )
+    query_time = best_time(
+        lambda: pl.scan_parquet(file_path)
+        .filter(pl.col("PERIODID").is_between(1, 24, closed="both"))
+        .select(query_cols)
+        .collect(),
+        repeats,
+    )
+    in_memory_mb = sample.memory_usage(deep=True).sum() / 1e6
+    return {
+        "file_size_MB": file_path.stat().st_size / 1e6,
+        "write_s": write_time,
+        "write_MB_per_s": in_memory_mb / write_time,
+        "full_read_s": full_read_time,
+        "query_read_s": query_time,
+    }
+
+
+def main():
+    logging.basicConfig(
+        format="\n%(levelname)s:%(message)s", level=logging.INFO
+    )
+    args = arg_parser()
+    f = Path(args.file)
+    if not f.is_file() or not f.suffix.lower() == ".csv":
+        logging.error("Path provided does not point to a CSV")
+        exit()
+    sample = read_sample(f, args.nrows)
+    logging.info(f"Benchmarking on {len(sample)} rows of {f.name}")
+    results = {}
+    with tempfile.TemporaryDirectory() as output_dir:
+        for writer_profile in args.profiles:
+            logging.info(f"Benchmarking {writer_profile}")
+            results[writer_profile] = benchmark_profile(
+                sample, writer_profile, Path(output_dir), args.repeats
+            )
+    results_df = pd.DataFrame.from_dict(results, orient="index")
+    print(results_df.round(3).to_string())
+    if args.output:
+        results_df.to_csv(args.output, index_label="writer_profile")
+
+
+if __name__ == "__main__":
+    main()
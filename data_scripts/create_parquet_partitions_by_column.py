@@ -1,6 +1,6 @@
 # Python script (executable via CLI) to creae parquet partitions
-# for large AEMO data CSVs. Assumes first line is table header and that
-# only one table type is in the file
+# for large AEMO data CSVs. Unless -multi_table is used, assumes second line is
+# table header and that only one table type is in the file
 #
 # Copyright (C) 2023 Abhijith Prakash
 #
@@ -18,10 +18,12 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import argparse
+import csv
 import logging
 from glob import glob
+from io import StringIO
 from pathlib import Path
-from typing import List
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
 
 import numpy as np
 import pandas as pd
@@ -61,9 +63,102 @@ bidperoffer_dtypes = {
     "PASAAVAILABILITY": np.float64,
 }
 
+biddayoffer_dtypes = {
+    "VERSIONNO": np.float32,
+    "I": str,
+    "BIDS": str,
+    "BIDDAYOFFER": str,
+    "1": np.float32,
+    "DUID": str,
+    "BIDTYPE": str,
+    "DIRECTION": str,
+    "PARTICIPANTID": str,
+    "DAILYENERGYCONSTRAINT": np.float32,
+    "REBIDEXPLANATION": str,
+    "PRICEBAND1": np.float64,
+    "PRICEBAND2": np.float64,
+    "PRICEBAND3": np.float64,
+    "PRICEBAND4": np.float64,
+    "PRICEBAND5": np.float64,
+    "PRICEBAND6": np.float64,
+    "PRICEBAND7": np.float64,
+    "PRICEBAND8": np.float64,
+    "PRICEBAND9": np.float64,
+    "PRICEBAND10": np.float64,
+    "MINIMUMLOAD": np.float32,
+    "T1": np.float32,
+    "T2": np.float32,
+    "T3": np.float32,
+    "T4": np.float32,
+    "NORMALSTATUS": str,
+    "MR_FACTOR": np.float32,
+    "ENTRYTYPE": str,
+    "REBID_CATEGORY": str,
+    "REFERENCE_ID": str,
+}
+
+table_dtypes = {
+    "BIDPEROFFER": bidperoffer_dtypes,
+    "BIDDAYOFFER": biddayoffer_dtypes,
+}
+"""Partition columns used (in order of preference) when splitting multi-table
+files, as per get_partitioned_data.py
+"""
+default_partition_cols = ["TRADINGDATE", "SETTLEMENTDATE"]
+
 dt_format = "%Y/%m/%d %H:%M:%S"
 strf_format = "%Y%m%d%H%M%S"
 
+"""Parquet writer profiles, passed to pyarrow via `DataFrame.to_parquet`.
+`use_dictionary` is either a bool or a list of columns to dictionary-encode
+(columns absent from a file are ignored). Use benchmark_parquet_profiles.py to
+compare profiles on real data before changing the default
+"""
+string_columns = ["I", "BIDS", "BIDOFFERPERIOD", "DUID", "BIDTYPE"]
+writer_profiles: Dict[str, Dict[str, Any]] = {
+    "pyarrow_default": {},
+    "snappy": {
+        "compression": "snappy",
+        "use_dictionary": True,
+        "row_group_size": 250_000,
+        "write_statistics": True,
+    },
+    "lz4": {
+        "compression": "lz4",
+        "use_dictionary": True,
+        "row_group_size": 250_000,
+        "write_statistics": True,
+    },
+    "zstd": {
+        "compression": "zstd",
+        "compression_level": 3,
+        "use_dictionary": True,
+        "row_group_size": 250_000,
+        "write_statistics": True,
+    },
+    "zstd_string_dict": {
+        "compression": "zstd",
+        "compression_level": 3,
+        "use_dictionary": string_columns,
+        "row_group_size": 250_000,
+        "write_statistics": True,
+    },
+    "zstd_high": {
+        "compression": "zstd",
+        "compression_level": 9,
+        "use_dictionary": True,
+        "row_group_size": 250_000,
+        "write_statistics": True,
+    },
+    "gzip": {
+        "compression": "gzip",
+        "use_dictionary": True,
+        "row_group_size": 250_000,
+        "write_statistics": True,
+    },
+}
+default_writer_profile = "pyarrow_default"
+
 
 def arg_parser():
     description = (
@@ -87,7 +182,17 @@ def arg_parser():
     parser.add_argument(
         "-partition_col",
         type=str,
-        help=("Column to partition parquet files on"),
+        help=(
+            "Column to partition parquet files on. Optional with -multi_table"
+        ),
+    )
+    parser.add_argument(
+        "-multi_table",
+        action="store_true",
+        help=(
+            "Split a file containing several tables (C/I/D rows) in one pass. "
+            + "Each table is written to output_dir/<TABLE>/<partition col>"
+        ),
     )
     parser.add_argument(
         "-chunksize",
@@ -95,6 +200,13 @@ def arg_parser():
         default=10**6,
         help=("Size of each DataFrame chunk (# of lines). Default 10^6"),
     )
+    parser.add_argument(
+        "-writer_profile",
+        type=str,
+        default=default_writer_profile,
+        choices=list(writer_profiles.keys()),
+        help=(f"Parquet writer profile. Default {default_writer_profile}"),
+    )
 
     args = parser.parse_args()
     return args
@@ -118,9 +230,56 @@ def get_date_cols(columns: pd.Index) -> List[str]:
     return [col for col in columns if "DATE" in col]
 
 
+def get_writer_kwargs(
+    writer_profile: str, columns: pd.Index
+) -> Dict[str, Any]:
+    """
+    Returns `to_parquet` keyword arguments for a writer profile, restricting
+    dictionary-encoded columns to those present in the data
+    """
+    kwargs = dict(writer_profiles[writer_profile])
+    if isinstance(kwargs.get("use_dictionary"), list):
+        kwargs["use_dictionary"] = [
+            col for col in kwargs["use_dictionary"] if col in columns
+        ]
+    return kwargs
+
+
+def base_table_name(table: str) -> str:
+    """
+    Table name without the "_D" suffix used for tables in NEMWEB files (e.g.
+    BIDPEROFFER_D in Bidmove_Complete files)
+    """
+    return table[:-2] if table.endswith("_D") else table
+
+
+def next_chunk_file(output_dir: Path, str_value: str) -> Path:
+    """
+    Path of the next chunk for a partition value, numbered after any chunks
+    already written to output_dir
+    """
+    base_file_name = Path(output_dir, str_value + "-chunk-")
+    if not (
+        sorted_written_chunks := sorted(
+            glob(str(base_file_name) + "*.parquet")
+        )
+    ):
+        last_chunk_number = 0
+    else:
+        last_chunk_number = int(Path(sorted_written_chunks[-1]).stem[-3:])
+    chunk_number = last_chunk_number + 1
+    return Path(
+        str(base_file_name) + str(chunk_number).rjust(3, "0") + ".parquet"
+    )
+
+
 def write_chunks_by_trading_date(
-    chunk: pd.DataFrame, output_dir: Path, partition_col: str
+    chunk: pd.DataFrame,
+    output_dir: Path,
+    partition_col: str,
+    writer_profile: str = default_writer_profile,
 ) -> None:
+    writer_kwargs = get_writer_kwargs(writer_profile, chunk.columns)
     unique_values = chunk[partition_col].unique().tolist()
     for value in unique_values:
         value_chunk = chunk.loc[chunk[partition_col] == value, :]
@@ -130,25 +289,17 @@ def write_chunks_by_trading_date(
             str_value = str(value)
         str_value = str_value.replace("/", "")
         str_value = str_value.replace("\\", "")
-        base_file_name = Path(output_dir, str_value + "-chunk-")
-        if not (
-            sorted_written_chunks := sorted(
-                glob(str(base_file_name) + "*.parquet")
-            )
-        ):
-            last_chunk_number = 0
-        else:
-            last_chunk_number = int(Path(sorted_written_chunks[-1]).stem[-3:])
-        chunk_number = last_chunk_number + 1
-        filename = Path(
-            str(base_file_name) + str(chunk_number).rjust(3, "0") + ".parquet"
-        )
-        value_chunk.to_parquet(filename, engine="pyarrow")
+        filename = next_chunk_file(output_dir, str_value)
+        value_chunk.to_parquet(filename, engine="pyarrow", **writer_kwargs)
     return None
 
 
 def chunk_file(
-    file_path: Path, output_dir: Path, partition_col: str, chunksize: int
+    file_path: Path,
+    output_dir: Path,
+    partition_col: str,
+    chunksize: int,
+    writer_profile: str = default_writer_profile,
 ) -> None:
     if not file_path.suffix.lower() == ".csv":
         logging.error("File is not a CSV")
@@ -160,11 +311,11 @@ def chunk_file(
     date_cols = get_date_cols(cols)
     size_per_line = estimate_size_of_lines(file_path, cols)
     file_size = file_path.stat().st_size
-    if "BIDPEROFFER" in file_path.stem:
-        logging.info("Recognised BIDPEROFFER CSV")
-        dtypes = bidperoffer_dtypes
-    else:
-        dtypes = None
+    dtypes = None
+    for table, table_dtype in table_dtypes.items():
+        if table in file_path.stem:
+            logging.info(f"Recognised {table} CSV")
+            dtypes = table_dtype
     previous_chunk = None
     with pd.read_csv(
         file_path,
@@ -181,7 +332,10 @@ def chunk_file(
             for chunk in reader:
                 if previous_chunk is not None:
                     write_chunks_by_trading_date(
-                        previous_chunk, output_dir, partition_col
+                        previous_chunk,
+                        output_dir,
+                        partition_col,
+                        writer_profile=writer_profile,
                     )
                 previous_chunk = chunk
                 # See here for comparison of pandas DataFrame size vs CSV size:
@@ -191,9 +345,160 @@ def chunk_file(
                 previous_chunk.iloc[:-1],  # type: ignore
                 output_dir,
                 partition_col=partition_col,
+                writer_profile=writer_profile,
             )
 
 
+def _parse_table_key(fields: List[str]) -> Tuple[str, str]:
+    """
+    Table key (report type, report sub-type), e.g. ("BIDS", "BIDPEROFFER"),
+    from the leading fields of an I or D row
+    """
+    return fields[1], fields[2]
+
+
+def _read_records(f: Iterable[str]) -> Iterator[str]:
+    """
+    Yields records from an open CSV file, joining lines of records that have
+    quoted fields with embedded newlines (e.g. BIDDAYOFFER REBIDEXPLANATION).
+    A record is complete once it contains an even number of quote characters,
+    as escaped quotes within quoted fields are doubled.
+    """
+    record = ""
+    for line in f:
+        record += line
+        if record.count('"') % 2 == 0:
+            yield record
+            record = ""
+    if record:
+        yield record
+
+
+class _TablePartitioner:
+    """
+    Buffers D rows of a single table and writes them to parquet partitions
+    (via `write_chunks_by_trading_date`) every `chunksize` rows. Buffered rows
+    are parsed with the same dtypes and date format as `chunk_file`.
+    """
+
+    def __init__(
+        self,
+        columns: List[str],
+        output_dir: Path,
+        partition_col: str,
+        chunksize: int,
+        dtypes: Optional[Dict[str, Any]],
+        writer_profile: str,
+    ):
+        self.columns = columns
+        self.output_dir = output_dir
+        self.partition_col = partition_col
+        self.chunksize = chunksize
+        self.dtypes = dtypes
+        self.writer_profile = writer_profile
+        self.lines: List[str] = []
+        if not self.output_dir.exists():
+            self.output_dir.mkdir(parents=True)
+
+    def append(self, line: str) -> None:
+        self.lines.append(line)
+        if len(self.lines) >= self.chunksize:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self.lines:
+            return None
+        chunk = pd.read_csv(
+            StringIO("".join(self.lines)),
+            header=None,
+            names=self.columns,
+            dtype=self.dtypes,
+            parse_dates=get_date_cols(pd.Index(self.columns)),
+            date_format=dt_format,
+        )
+        write_chunks_by_trading_date(
+            chunk,
+            self.output_dir,
+            self.partition_col,
+            writer_profile=self.writer_profile,
+        )
+        self.lines = []
+
+
+def split_multi_table_file(
+    file_path: Path,
+    output_dir: Path,
+    chunksize: int,
+    partition_col: Optional[str] = None,
+    writer_profile: str = default_writer_profile,
+) -> Dict[str, Path]:
+    """
+    Splits an AEMO data CSV containing one or more tables into parquet
+    partitions in a single pass.
+
+    Each I (header) row defines the columns for a table, and each subsequent
+    D (data) row for that table is routed to a `_TablePartitioner`. C (comment)
+    rows are ignored. Column names are taken from the full I row so that
+    partitions have the same schema as those written by `chunk_file`.
+
+    If `partition_col` is not provided, the first of `default_partition_cols`
+    in a table's header is used. Tables without a partition column are skipped.
+
+    Returns a mapping of table name to the directory it was partitioned into
+    (output_dir/<TABLE>/<partition col>).
+    """
+    if not file_path.suffix.lower() == ".csv":
+        logging.error("File is not a CSV")
+        exit()
+    partitioners: Dict[Tuple[str, str], Optional[_TablePartitioner]] = {}
+    table_dirs: Dict[str, Path] = {}
+    file_size = file_path.stat().st_size
+    with open(file_path, "r", newline="") as f:
+        with tqdm(total=file_size, desc="Progress based on file size") as pbar:
+            for line in _read_records(f):
+                pbar.update(len(line))
+                if line.startswith("D,"):
+                    key = _parse_table_key(line.split(",", 3))
+                    if (partitioner := partitioners.get(key)) is not None:
+                        partitioner.append(line)
+                elif line.startswith("I,"):
+                    columns = next(csv.reader([line]))
+                    key = _parse_table_key(columns)
+                    table = key[1]
+                    if (partitioner := partitioners.get(key)) is not None:
+                        # flush rows parsed with any previous header
+                        partitioner.flush()
+                    if partition_col is not None:
+                        candidate_cols = [partition_col]
+                    else:
+                        candidate_cols = default_partition_cols
+                    table_partition_col = next(
+                        (col for col in candidate_cols if col in columns),
+                        None,
+                    )
+                    if table_partition_col is None:
+                        logging.warning(
+                            f"No partition col for {table}. Skipping table"
+                        )
+                        partitioners[key] = None
+                        continue
+                    logging.info(f"Recognised {table} table")
+                    table_dir = Path(output_dir, table, table_partition_col)
+                    partitioners[key] = _TablePartitioner(
+                        columns,
+                        table_dir,
+                        table_partition_col,
+                        chunksize,
+                        table_dtypes.get(base_table_name(table)),
+                        writer_profile,
+                    )
+                    table_dirs[table] = table_dir
+    for partitioner in partitioners.values():
+        if partitioner is not None:
+            partitioner.flush()
+    return table_dirs
+
+
 def main():
     logging.basicConfig(
         format="\n%(levelname)s:%(message)s", level=logging.INFO
@@ -209,7 +514,22 @@ def main():
     if not f.is_file():
         logging.error("Path provided does not point to a file")
         exit()
-    chunk_file(f, output_dir, args.partition_col, args.chunksize)
+    if args.multi_table:
+        split_multi_table_file(
+            f,
+            output_dir,
+            args.chunksize,
+            partition_col=args.partition_col,
+            writer_profile=args.writer_profile,
+        )
+    else:
+        chunk_file(
+            f,
+            output_dir,
+            args.partition_col,
+            args.chunksize,
+            writer_profile=args.writer_profile,
+        )
 
 
 if __name__ == "__main__":
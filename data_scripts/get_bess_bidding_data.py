@@ -1,85 +1,263 @@
+import argparse
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta
 from pathlib import Path
+from typing import List, Tuple
 
 import pandas as pd
 from nem_bidding_dashboard import fetch_and_preprocess, query_cached_data
 
+from analysis_code.processed_data import (
+    DEFAULT_PROCESSED_FORMAT,
+    PROCESSED_FORMATS,
+    write_processed,
+)
 
-def populate_raw_cache(raw_cache: Path):
-    for year in (2021, 2023):
+REGIONS = ["QLD", "NSW", "VIC", "SA", "TAS"]
+DISPATCH_TYPE = "Generator"
+TECH_TYPES = ["Battery Discharge"]
+RESOLUTION = "5-min"
+ADJUSTED = "adjusted"
+DISPATCH_DATA_COLUMN = "AVAILABILITY"
+# partition column of the aggregated BESS dataset
+DATE_COL = "DATE"
+
+
+def arg_parser():
+    description = (
+        "Aggregate BESS bid and dispatch data for a set of days into a "
+        + "partitioned dataset"
+    )
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument(
+        "-dates",
+        type=str,
+        nargs="+",
+        default=["2021/06/04", "2023/06/04"],
+        help=(
+            "Dates (YYYY/MM/DD) or inclusive date ranges "
+            + "(YYYY/MM/DD-YYYY/MM/DD). Default 2021/06/04 2023/06/04"
+        ),
+    )
+    parser.add_argument(
+        "-raw_dir",
+        type=str,
+        default=str(Path("data", "raw")),
+        help=("Raw data cache for NEM bidding dashboard"),
+    )
+    parser.add_argument(
+        "-output_dir",
+        type=str,
+        default=str(Path("data", "processed", "agg_bess")),
+        help=("Directory to write the aggregated BESS dataset to"),
+    )
+    parser.add_argument(
+        "-max_workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help=("Number of days to aggregate in parallel. Default CPU count"),
+    )
+    parser.add_argument(
+        "-output_format",
+        type=str,
+        default=DEFAULT_PROCESSED_FORMAT,
+        choices=list(PROCESSED_FORMATS.keys()),
+        help=(f"Dataset file format. Default {DEFAULT_PROCESSED_FORMAT}"),
+    )
+    args = parser.parse_args()
+    return args
+
+
+def parse_dates(date_args: List[str]) -> List[datetime]:
+    """
+    Parses dates (YYYY/MM/DD) and inclusive date ranges (YYYY/MM/DD-YYYY/MM/DD)
+    into a sorted list of unique days
+    """
+    dates = set()
+    for date_arg in date_args:
+        start, _, end = date_arg.partition("-")
+        start_date = datetime.strptime(start, "%Y/%m/%d")
+        end_date = datetime.strptime(end, "%Y/%m/%d") if end else start_date
+        if end_date < start_date:
+            raise ValueError(f"Date range {date_arg} ends before it starts")
+        dates.update(
+            pd.date_range(start_date, end_date, freq="D").to_pydatetime()
+        )
+    return sorted(dates)
+
+
+def contiguous_date_ranges(
+    dates: List[datetime],
+) -> List[Tuple[datetime, datetime]]:
+    """
+    Groups sorted days into (first day, last day) runs of consecutive days
+    """
+    ranges: List[Tuple[datetime, datetime]] = []
+    for date in dates:
+        if ranges and date - ranges[-1][1] == timedelta(days=1):
+            ranges[-1] = (ranges[-1][0], date)
+        else:
+            ranges.append((date, date))
+    return ranges
+
+
+def _day_time_window(
+    first_day: datetime, last_day: datetime
+) -> Tuple[str, str]:
+    start_time = first_day.strftime("%Y/%m/%d 00:00:00")
+    end_time = (last_day + timedelta(days=1)).strftime("%Y/%m/%d 00:05:00")
+    return start_time, end_time
+
+
+def populate_raw_cache(raw_cache: Path, dates: List[datetime]):
+    """
+    Populates the raw cache with bid data for all days. Consecutive days are
+    fetched together so that each raw file is only fetched once.
+    """
+    for first_day, last_day in contiguous_date_ranges(dates):
+        start_time, end_time = _day_time_window(first_day, last_day)
+        logging.info(f"Populating raw cache from {start_time} to {end_time}")
         fetch_and_preprocess.bid_data(
-            start_time=f"{year}/06/04 00:00:00",
-            end_time=f"{year}/06/05 00:05:00",
+            start_time=start_time,
+            end_time=end_time,
             raw_data_cache=raw_cache,
         )
 
 
-def process_data(raw_cache: Path, processed_cache: Path):
+def process_day(
+    raw_cache: Path, date: datetime
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
     """
     Use NEM bidding dashboard to process bidding, dispatch and price data
-    from 2021 and 2023.
+    for a day.
     Code as per code in example below:
     https://nem-bidding-dashboard.readthedocs.io/en/latest/examples.html#getting-the-data-behind-the-web-app-visualisations
     """
-    for year in (2021, 2023):
-        start_time = f"{year}/06/04 00:00:00"
-        end_time = f"{year}/06/05 00:05:00"
-        regions = ["QLD", "NSW", "VIC", "SA", "TAS"]
-        dispatch_type = "Generator"
-        tech_types = ["Battery Discharge"]
-        resolution = "5-min"
-        adjusted = "adjusted"
-        dispatch_data_column = "AVAILABILITY"
-        agg_bids = query_cached_data.aggregate_bids(
-            raw_cache,
-            start_time,
-            end_time,
-            regions,
-            dispatch_type,
-            tech_types,
-            resolution,
-            adjusted,
-        )
-        agg_bids.to_csv(
-            processed_cache / Path(f"agg_bess_bid_data_{year}0604.csv"),
-            index=False,
-        )
+    start_time, end_time = _day_time_window(date, date)
+    agg_bids = query_cached_data.aggregate_bids(
+        raw_cache,
+        start_time,
+        end_time,
+        REGIONS,
+        DISPATCH_TYPE,
+        TECH_TYPES,
+        RESOLUTION,
+        ADJUSTED,
+    )
+    dispatch_data = query_cached_data.aggregated_dispatch_data(
+        raw_cache,
+        DISPATCH_DATA_COLUMN,
+        start_time,
+        end_time,
+        REGIONS,
+        DISPATCH_TYPE,
+        TECH_TYPES,
+        RESOLUTION,
+    )
+    dispatch_data = dispatch_data.rename(
+        columns={
+            "INTERVAL_DATETIME": "SETTLEMENTDATE",
+            "COLUMNVALUES": DISPATCH_DATA_COLUMN,
+        }
+    )
+    region_demand = query_cached_data.region_demand(
+        raw_cache, start_time, end_time, REGIONS
+    )
+    aggregated_vwap = query_cached_data.aggregated_vwap(
+        raw_cache, start_time, end_time, REGIONS
+    )
+    dispatch_data = pd.merge(dispatch_data, region_demand, on="SETTLEMENTDATE")
+    dispatch_data = pd.merge(
+        dispatch_data, aggregated_vwap, on="SETTLEMENTDATE"
+    )
+    return agg_bids, dispatch_data
 
-        dispatch_data = query_cached_data.aggregated_dispatch_data(
-            raw_cache,
-            dispatch_data_column,
-            start_time,
-            end_time,
-            regions,
-            dispatch_type,
-            tech_types,
-            resolution,
-        )
-        dispatch_data = dispatch_data.rename(
-            columns={
-                "INTERVAL_DATETIME": "SETTLEMENTDATE",
-                "COLUMNVALUES": dispatch_data_column,
-            }
-        )
-        region_demand = query_cached_data.region_demand(
-            raw_cache, start_time, end_time, regions
-        )
-        aggregated_vwap = query_cached_data.aggregated_vwap(
-            raw_cache, start_time, end_time, regions
-        )
-        dispatch_data = pd.merge(
-            dispatch_data, region_demand, on="SETTLEMENTDATE"
-        )
-        dispatch_data = pd.merge(
-            dispatch_data, aggregated_vwap, on="SETTLEMENTDATE"
-        )
-        dispatch_data.to_csv(
-            processed_cache / Path(f"agg_bess_dispatch_data_{year}0604.csv"),
-            index=False,
+
+def bess_partition_path(
+    output_dir: Path, dataset: str, date: datetime
+) -> Path:
+    """
+    Path (without a suffix) of a day's partition in the aggregated BESS
+    dataset, where dataset is "bids" or "dispatch". Partitions are hive-style
+    (i.e. DATE=YYYY-MM-DD) so that the dataset can be scanned by polars or
+    pyarrow.
+    """
+    return Path(output_dir, dataset, f"{DATE_COL}={date:%Y-%m-%d}", "part-0")
+
+
+def write_day_partitions(
+    output_dir: Path,
+    date: datetime,
+    agg_bids: pd.DataFrame,
+    dispatch_data: pd.DataFrame,
+    output_format: str = DEFAULT_PROCESSED_FORMAT,
+) -> None:
+    for dataset, df in (("bids", agg_bids), ("dispatch", dispatch_data)):
+        partition = bess_partition_path(output_dir, dataset, date)
+        if not partition.parent.exists():
+            partition.parent.mkdir(parents=True)
+        write_processed(df, partition, output_format, index=False)
+
+
+def aggregate_bess_data(
+    raw_cache: Path,
+    output_dir: Path,
+    dates: List[datetime],
+    max_workers: int = 1,
+    output_format: str = DEFAULT_PROCESSED_FORMAT,
+) -> None:
+    """
+    Populates the raw cache once for all days, then aggregates BESS bids and
+    dispatch data for each day in parallel. Each day is written to its own
+    partition of the aggregated BESS dataset (see `bess_partition_path`) in
+    `output_format`, so days can be added to the dataset without rewriting
+    existing days.
+
+    Days that fail are logged and skipped so that other days are still
+    written, after which a RuntimeError is raised listing the failed days.
+    """
+    populate_raw_cache(raw_cache, dates)
+    failed = []
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(process_day, raw_cache, date): date
+            for date in dates
+        }
+        for future in as_completed(futures):
+            date = futures[future]
+            try:
+                agg_bids, dispatch_data = future.result()
+            except Exception as e:
+                logging.error(f"Failed to aggregate {date:%Y/%m/%d}: {e}")
+                failed.append(date)
+                continue
+            write_day_partitions(
+                output_dir, date, agg_bids, dispatch_data, output_format
+            )
+            logging.info(f"Aggregated BESS data for {date:%Y/%m/%d}")
+    if failed:
+        failed_days = ", ".join(f"{date:%Y/%m/%d}" for date in sorted(failed))
+        raise RuntimeError(
+            f"Failed to aggregate {len(failed)} of {len(dates)} days: "
+            + failed_days
         )
 
 
+def main():
+    logging.basicConfig(
+        format="\n%(levelname)s:%(message)s", level=logging.INFO
+    )
+    args = arg_parser()
+    aggregate_bess_data(
+        Path(args.raw_dir),
+        Path(args.output_dir),
+        parse_dates(args.dates),
+        max_workers=args.max_workers,
+        output_format=args.output_format,
+    )
+
+
 if __name__ == "__main__":
-    raw_data_cache = Path("data", "raw")
-    processed_data_cache = Path("data", "processed")
-    populate_raw_cache(raw_data_cache)
-    process_data(raw_data_cache, processed_data_cache)
+    main()
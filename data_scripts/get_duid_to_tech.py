@@ -1,10 +1,16 @@
 import argparse
 import logging
+from datetime import date
 from pathlib import Path
 
 import pandas as pd
 from nemosis import data_fetch_methods as data_fetch_methods
 
+from analysis_code.reference_data import (
+    REFERENCE_CACHE_DIR,
+    get_cached_reference_table,
+)
+
 
 def fetch_gen_scheduled_loads(raw_loc, table_loc):
     """
@@ -183,6 +189,55 @@ def find_non_genloads_duid_providers(
     return non_genloads_duid_providers
 
 
+def get_cached_reg_exemp_tables(
+    raw_loc, offline=False, refresh=False, version=None
+):
+    """
+    Returns the Generators and Scheduled Loads and Ancillary Services tables
+    from the reference data cache in raw_loc, fetching them if they were not
+    cached today (or if refresh is True). The Registration and Exemption list
+    is not versioned, so tables are cached by the date they were fetched and
+    new or retired DUIDs are picked up by the next day's run. Both tables are
+    also saved as csvs in raw_loc, as per `fetch_gen_scheduled_loads` and
+    `fetch_ancillary_service_providers`.
+
+    Args:
+        raw_loc (str or path): directory to save the raw xlsx and csvs
+        offline (bool, optional): use cached tables without fetching
+        refresh (bool, optional): refetch tables even if cached
+        version (str, optional): version label recorded in the cache manifest.
+            Defaults to today's date
+
+    Returns:
+        Tuple of Pandas DataFrames (Generators and Scheduled Loads,
+        Ancillary Services)
+    """
+    if version is None:
+        version = date.today().isoformat()
+    cache_loc = Path(raw_loc, REFERENCE_CACHE_DIR)
+    gen_loads = get_cached_reference_table(
+        "generators_and_loads",
+        version,
+        lambda: fetch_gen_scheduled_loads(raw_loc, raw_loc),
+        cache_loc,
+        offline=offline,
+        refresh=refresh,
+    )
+    gen_loads.to_csv(Path(raw_loc, "generators_and_loads.csv"), index=False)
+    ancillary_services = get_cached_reference_table(
+        "ancillary_service_providers",
+        version,
+        lambda: fetch_ancillary_service_providers(raw_loc, table_loc=raw_loc),
+        cache_loc,
+        offline=offline,
+        refresh=refresh,
+    )
+    ancillary_services.to_csv(
+        Path(raw_loc, "ancillary_service_providers.csv"), index=False
+    )
+    return gen_loads, ancillary_services
+
+
 def create_parser():
     description = "Fetch participant tables into project data directories"
     parser = argparse.ArgumentParser(description=description)
@@ -198,6 +253,19 @@ def create_parser():
         required=True,
         help="path to save cleaned files",
     )
+    parser.add_argument(
+        "-offline",
+        action="store_true",
+        help=(
+            "use cached Registration and Exemption tables without fetching "
+            + "(tables are otherwise fetched at most once a day)"
+        ),
+    )
+    parser.add_argument(
+        "-refresh",
+        action="store_true",
+        help="refetch Registration and Exemption tables even if cached",
+    )
     args = parser.parse_args()
     return args
 
@@ -210,8 +278,11 @@ def main():
     raw_path = args.raw_path
     proc_path = args.proc_path
     gen_loads_outname = "cleaned_gen_loads.csv"
-    # fetch raw generators and loads and clean, then save to processed path
-    raw_gen_loads = fetch_gen_scheduled_loads(raw_path, raw_path)
+    # fetch (or load cached) raw generators and loads and ancillary services
+    raw_gen_loads, _ = get_cached_reg_exemp_tables(
+        raw_path, offline=args.offline, refresh=args.refresh
+    )
+    # clean generators and loads, then save to processed path
     cleaned_tech = clean_gen_loads_tech(df=raw_gen_loads)
     clean_gen_loads_capacities(
         df=cleaned_tech, table_loc=proc_path, outname=gen_loads_outname
@@ -222,8 +293,7 @@ def main():
             + f"processed in {proc_path}"
         )
     )
-    # fetch fcas providers then find unique providers
-    fetch_ancillary_service_providers(raw_path, table_loc=raw_path)
+    # find unique fcas providers
     find_non_genloads_duid_providers(raw_path, raw_path, table_loc=proc_path)
     logging.info(
         f"Non gen loads in {raw_path}, unique non gen loads in {proc_path}"
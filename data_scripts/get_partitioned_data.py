@@ -1,11 +1,28 @@
 from pathlib import Path
 
-from create_parquet_partitions_by_column import chunk_file, get_columns
+from create_parquet_partitions_by_column import (
+    chunk_file,
+    default_writer_profile,
+    get_columns,
+)
 
-raw_csvs = sorted(Path.glob(Path("data", "raw"), "*_BIDPEROFFER_*.CSV"))
-if not (output_dir := Path("data", "partitioned")).exists():
-    output_dir.mkdir()
-for csv in raw_csvs:
+
+def partition_raw_csv(
+    csv: Path,
+    output_dir: Path,
+    writer_profile: str = default_writer_profile,
+    chunksize: int = 10**6,
+    table: str = "BIDPEROFFER",
+) -> None:
+    """
+    Partitions a raw bid data CSV by trading date (5MS bid format) or
+    settlement date into output_dir/<partition col>, then deletes the CSV.
+
+    Tables other than BIDPEROFFER (e.g. BIDDAYOFFER) are partitioned into
+    output_dir/<TABLE>/<partition col>, as per `split_multi_table_file`.
+    """
+    if table != "BIDPEROFFER":
+        output_dir = output_dir / Path(table)
     cols = get_columns(csv)
     if "TRADINGDATE" in cols:
         partition_col = "TRADINGDATE"
@@ -13,6 +30,21 @@ for csv in raw_csvs:
         partition_col = "SETTLEMENTDATE"
     partition_dir = output_dir / Path(partition_col)
     if not partition_dir.exists():
-        partition_dir.mkdir()
-    chunk_file(csv, partition_dir, partition_col, chunksize=10**6)
+        partition_dir.mkdir(parents=True)
+    chunk_file(
+        csv,
+        partition_dir,
+        partition_col,
+        chunksize=chunksize,
+        writer_profile=writer_profile,
+    )
     csv.unlink()
+
+
+if __name__ == "__main__":
+    if not (output_dir := Path("data", "partitioned")).exists():
+        output_dir.mkdir()
+    for table in ("BIDPEROFFER", "BIDDAYOFFER"):
+        raw_csvs = sorted(Path.glob(Path("data", "raw"), f"*_{table}_*.CSV"))
+        for csv in raw_csvs:
+            partition_raw_csv(csv, output_dir, table=table)
@@ -0,0 +1,557 @@
+# Python script (executable via CLI) that watches a directory for new AEMO
+# bid data files (MMS Data Model or NEMWEB zips or CSVs), partitions each as it
+# arrives into the existing partitions and recomputes rebid counts for only the
+# affected days
+#
+# Copyright (C) 2023 Abhijith Prakash
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import argparse
+import json
+import logging
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from urllib.request import Request, urlopen
+from zipfile import ZipFile
+
+import pandas as pd
+from create_parquet_partitions_by_column import (
+    base_table_name,
+    default_writer_profile,
+    next_chunk_file,
+    split_multi_table_file,
+    writer_profiles,
+)
+
+from analysis_code.processed_data import (
+    DEFAULT_PROCESSED_FORMAT,
+    PROCESSED_FORMATS,
+    find_processed,
+    read_processed,
+    write_processed,
+)
+from analysis_code.rebidding_analysis import (
+    rebid_counts_across_day_out_of_core,
+)
+from analysis_code.result_cache import fingerprint_file
+
+# record of ingested files, kept in the partitioned data directory
+INGEST_MANIFEST_FILE = "ingest_manifest.json"
+INGEST_SUFFIXES = {".zip", ".csv"}
+# rebid counts are only recomputed for days in this table
+REBID_TABLE = "BIDPEROFFER"
+
+
+def arg_parser():
+    description = (
+        "Watch a directory for new bid data files, partition each as it "
+        + "arrives and recompute rebid counts for the affected days"
+    )
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument(
+        "-watch_dir",
+        type=str,
+        required=True,
+        help=("Directory to watch for new zips or CSVs"),
+    )
+    parser.add_argument(
+        "-output_dir",
+        type=str,
+        default=str(Path("data", "partitioned")),
+        help=("Partitioned data directory to append to"),
+    )
+    parser.add_argument(
+        "-processed_dir",
+        type=str,
+        default=str(Path("data", "processed")),
+        help=("Directory with monthly rebid counts to update"),
+    )
+    parser.add_argument(
+        "-poll_secs",
+        type=float,
+        default=1.0,
+        help=("Interval between scans of the watched directory. Default 1"),
+    )
+    parser.add_argument(
+        "-settle_secs",
+        type=float,
+        default=1.0,
+        help=(
+            "Time a file must be unchanged for before it is ingested, so "
+            + "that partially-copied files are skipped. Default 1"
+        ),
+    )
+    parser.add_argument(
+        "-once",
+        action="store_true",
+        help=("Ingest files already in the directory and exit"),
+    )
+    parser.add_argument(
+        "-refresh_url",
+        type=str,
+        help=(
+            "URL to POST to after each file is ingested, e.g. "
+            + "http://127.0.0.1:8050/refresh for the query service"
+        ),
+    )
+    parser.add_argument(
+        "-chunksize",
+        type=int,
+        default=10**6,
+        help=("Size of each DataFrame chunk (# of lines). Default 10^6"),
+    )
+    parser.add_argument(
+        "-writer_profile",
+        type=str,
+        default=default_writer_profile,
+        choices=list(writer_profiles.keys()),
+        help=(f"Parquet writer profile. Default {default_writer_profile}"),
+    )
+    parser.add_argument(
+        "-output_format",
+        type=str,
+        default=DEFAULT_PROCESSED_FORMAT,
+        choices=list(PROCESSED_FORMATS.keys()),
+        help=(
+            "Format of new rebid count files. Existing files keep their "
+            + f"format. Default {DEFAULT_PROCESSED_FORMAT}"
+        ),
+    )
+    args = parser.parse_args()
+    return args
+
+
+def read_ingest_manifest(output_dir: Path) -> Dict[str, Dict]:
+    manifest_file = output_dir / Path(INGEST_MANIFEST_FILE)
+    if not manifest_file.exists():
+        return {}
+    with open(manifest_file, "r") as f:
+        return json.load(f)
+
+
+def write_ingest_manifest(output_dir: Path, manifest: Dict[str, Dict]) -> None:
+    manifest_file = output_dir / Path(INGEST_MANIFEST_FILE)
+    # write to a temporary file first so that the manifest is never partially
+    # written if ingestion is interrupted
+    temp_file = manifest_file.with_suffix(f".{os.getpid()}.tmp")
+    with open(temp_file, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(temp_file, manifest_file)
+
+
+def table_partition_dir(
+    output_dir: Path, table: str, partition_col: str
+) -> Path:
+    """
+    Directory that a table's partitions are appended to, as per
+    `partition_raw_csv`
+    """
+    if table == REBID_TABLE:
+        return output_dir / Path(partition_col)
+    return output_dir / Path(table, partition_col)
+
+
+def extract_csvs(file: Path, extract_dir: Path) -> List[Path]:
+    """
+    CSVs in a zip (including in zips nested within it, as in NEMWEB archives)
+    extracted to extract_dir, or the file itself if it is a CSV
+    """
+    if file.suffix.lower() == ".csv":
+        return [file]
+    csvs = []
+    with ZipFile(file) as z:
+        for member in z.namelist():
+            suffix = Path(member).suffix.lower()
+            if suffix in INGEST_SUFFIXES:
+                extracted = Path(z.extract(member, extract_dir))
+                csvs.extend(extract_csvs(extracted, extract_dir))
+    return csvs
+
+
+def append_partitions(
+    csv: Path,
+    output_dir: Path,
+    staging_dir: Path,
+    chunksize: int = 10**6,
+    writer_profile: str = default_writer_profile,
+) -> Dict[str, List[Path]]:
+    """
+    Partitions a (single or multi-table) CSV into staging_dir and then moves
+    the partitions into output_dir as new chunks of each day (see
+    `table_partition_dir`). As partitions are only moved once complete,
+    readers never see partially-written partitions. If moving fails, the
+    partitions moved so far are removed.
+
+    Returns the partition files appended for each table.
+    """
+    table_dirs = split_multi_table_file(
+        csv, staging_dir, chunksize, writer_profile=writer_profile
+    )
+    appended: Dict[str, List[Path]] = {}
+    try:
+        for table, staged_dir in table_dirs.items():
+            table = base_table_name(table)
+            partition_dir = table_partition_dir(
+                output_dir, table, staged_dir.name
+            )
+            if not partition_dir.exists():
+                partition_dir.mkdir(parents=True)
+            for staged in sorted(staged_dir.glob("*.parquet")):
+                str_value = staged.name.split("-chunk-")[0]
+                partition = next_chunk_file(partition_dir, str_value)
+                os.replace(staged, partition)
+                appended.setdefault(table, []).append(partition)
+    except BaseException:
+        remove_partitions(appended)
+        raise
+    return appended
+
+
+def remove_partitions(partitions: Dict[str, List[Path]]) -> None:
+    for table_partitions in partitions.values():
+        for partition in table_partitions:
+            partition.unlink(missing_ok=True)
+
+
+def entry_partitions(
+    output_dir: Path, entry: Optional[Dict]
+) -> Dict[str, List[Path]]:
+    """
+    Partition files recorded in an ingest manifest entry
+    """
+    if entry is None:
+        return {}
+    return {
+        table: [output_dir / Path(partition) for partition in partitions]
+        for table, partitions in entry.get("partitions", {}).items()
+    }
+
+
+def set_aside_partitions(
+    partitions: Dict[str, List[Path]], aside_dir: Path
+) -> List[Tuple[Path, Path]]:
+    """
+    Moves partitions into aside_dir so that they can be restored (see
+    `restore_partitions`) if the ingest replacing them fails. Returns the
+    (original, moved) path of each partition.
+    """
+    aside_dir.mkdir(parents=True, exist_ok=True)
+    moved = []
+    for table_partitions in partitions.values():
+        for partition in table_partitions:
+            if not partition.exists():
+                continue
+            aside = aside_dir / Path(f"{len(moved)}-{partition.name}")
+            os.replace(partition, aside)
+            moved.append((partition, aside))
+    return moved
+
+
+def restore_partitions(moved: Iterable[Tuple[Path, Path]]) -> None:
+    for partition, aside in moved:
+        os.replace(aside, partition)
+
+
+def affected_days(appended: Dict[str, List[Path]]) -> Set[datetime]:
+    """
+    Trading days with new (or removed) BIDPEROFFER partitions
+    """
+    return {
+        datetime.strptime(partition.name[:8], "%Y%m%d")
+        for partition in appended.get(REBID_TABLE, [])
+    }
+
+
+def trading_day_window(trading_date: datetime) -> Tuple[datetime, datetime]:
+    """
+    The (exclusive) start and (inclusive) end of the dispatch intervals of a
+    trading day, as per the interval times in `scan_rebid_keys`
+    """
+    day_start = trading_date + timedelta(hours=4)
+    return day_start, day_start + timedelta(days=1)
+
+
+def update_rebid_counts(
+    partitioned_data_path: Path,
+    mappings_path: Path,
+    duids_path: Path,
+    processed_path: Path,
+    trading_dates: Set[datetime],
+    output_format: str = DEFAULT_PROCESSED_FORMAT,
+) -> None:
+    """
+    Recomputes rebid counts for the trading days (see
+    `rebid_counts_across_day_out_of_core`) and replaces those days in the
+    monthly rebid counts (`rebid_counts_{month}_{year}`). Days that no longer
+    have any partitions are removed. Other days are not recomputed. Monthly
+    files that already exist keep their format.
+
+    All months are computed before any are written, so that a failure leaves
+    the monthly rebid counts unchanged.
+    """
+    months: Dict[Tuple[int, int], List[datetime]] = {}
+    for trading_date in sorted(trading_dates):
+        key = (trading_date.year, trading_date.month)
+        months.setdefault(key, []).append(trading_date)
+    suffix_formats = {suffix: fmt for fmt, suffix in PROCESSED_FORMATS.items()}
+    updates = []
+    for (year, month), month_dates in months.items():
+        day_counts = []
+        for trading_date in month_dates:
+            try:
+                day_counts.append(
+                    rebid_counts_across_day_out_of_core(
+                        partitioned_data_path,
+                        mappings_path,
+                        duids_path,
+                        trading_date.year,
+                        trading_date.month,
+                        trading_date.day,
+                    )
+                )
+            except FileNotFoundError:
+                logging.info(
+                    f"No partitions for {trading_date:%Y/%m/%d}. Removing "
+                    + "its rebid counts"
+                )
+        month_path = processed_path / Path(f"rebid_counts_{month}_{year}")
+        month_format = output_format
+        month_data = day_counts
+        if (existing := find_processed(month_path)) is not None:
+            month_format = suffix_formats[existing.suffix]
+            existing_df = read_processed(existing)
+            replaced = pd.Series(False, index=existing_df.index)
+            for trading_date in month_dates:
+                start, end = trading_day_window(trading_date)
+                replaced |= (existing_df.index > start) & (
+                    existing_df.index <= end
+                )
+            month_data = [existing_df[~replaced.to_numpy()]] + day_counts
+        if not month_data:
+            continue
+        month_df = pd.concat(month_data, axis=0).sort_index()
+        updates.append((month_df, month_path, month_format))
+    for month_df, month_path, month_format in updates:
+        write_processed(month_df, month_path, output_format=month_format)
+        logging.info(f"Updated rebid counts in {month_path.name}")
+
+
+def ingest_file(
+    file: Path,
+    output_dir: Path,
+    processed_path: Path,
+    mappings_path: Path,
+    duids_path: Path,
+    chunksize: int = 10**6,
+    writer_profile: str = default_writer_profile,
+    output_format: str = DEFAULT_PROCESSED_FORMAT,
+    previous: Optional[Dict] = None,
+) -> Dict:
+    """
+    Partitions a new zip or CSV (see `append_partitions`) and updates rebid
+    counts for the affected days (see `update_rebid_counts`). Returns an
+    ingest manifest entry.
+
+    If the file was ingested before (i.e. it has changed), the partitions in
+    its `previous` manifest entry are replaced and rebid counts are also
+    updated for the days they covered. If ingestion fails, appended
+    partitions are removed and replaced partitions are restored.
+    """
+    start = time.perf_counter()
+    appended: Dict[str, List[Path]] = {}
+    replaced = entry_partitions(output_dir, previous)
+    with tempfile.TemporaryDirectory(dir=output_dir) as work_dir:
+        set_aside = set_aside_partitions(replaced, Path(work_dir, "replaced"))
+        try:
+            for csv in extract_csvs(file, Path(work_dir, "extracted")):
+                for table, partitions in append_partitions(
+                    csv,
+                    output_dir,
+                    Path(work_dir, "staging"),
+                    chunksize=chunksize,
+                    writer_profile=writer_profile,
+                ).items():
+                    appended.setdefault(table, []).extend(partitions)
+            ingested_days = affected_days(appended)
+            days = ingested_days | affected_days(replaced)
+            if days:
+                update_rebid_counts(
+                    output_dir,
+                    mappings_path,
+                    duids_path,
+                    processed_path,
+                    days,
+                    output_format=output_format,
+                )
+        except BaseException:
+            remove_partitions(appended)
+            restore_partitions(set_aside)
+            raise
+    elapsed = time.perf_counter() - start
+    logging.info(
+        f"Ingested {file.name} in {elapsed:.1f}s "
+        + f"({sum(len(p) for p in appended.values())} partitions, "
+        + f"{len(days)} days of rebid counts)"
+    )
+    return {
+        "fingerprint": fingerprint_file(file),
+        "ingested_at": datetime.now().isoformat(),
+        "partitions": {
+            table: [str(p.relative_to(output_dir)) for p in partitions]
+            for table, partitions in appended.items()
+        },
+        "days": [f"{day:%Y-%m-%d}" for day in sorted(ingested_days)],
+    }
+
+
+def ready_files(
+    watch_dir: Path,
+    manifest: Dict[str, Dict],
+    seen: Dict[Path, Tuple[int, int]],
+    settle_secs: float,
+    failed: Optional[Dict[str, str]] = None,
+) -> List[Path]:
+    """
+    Files in watch_dir that have not been ingested (or have changed since they
+    were ingested) and whose size and modification time are unchanged since
+    the previous scan and at least `settle_secs` old. `seen` is updated with
+    the size and modification time of each file.
+
+    Files in `failed` (file name to fingerprint) are skipped until they
+    change, so that a file that fails to ingest is not retried every scan.
+    """
+    ready = []
+    for file in sorted(watch_dir.iterdir()):
+        if file.name.startswith(".") or not file.is_file():
+            continue
+        if file.suffix.lower() not in INGEST_SUFFIXES:
+            continue
+        try:
+            stat = file.stat()
+        except FileNotFoundError:
+            continue
+        fingerprint = fingerprint_file(file)
+        if manifest.get(file.name, {}).get("fingerprint") == fingerprint:
+            continue
+        if failed is not None and failed.get(file.name) == fingerprint:
+            continue
+        current = (stat.st_size, stat.st_mtime_ns)
+        settled = time.time() - stat.st_mtime >= settle_secs
+        if seen.get(file) == current and settled:
+            ready.append(file)
+        seen[file] = current
+    return ready
+
+
+def watch_directory(
+    watch_dir: Path,
+    output_dir: Path,
+    processed_path: Path,
+    mappings_path: Path,
+    duids_path: Path,
+    poll_secs: float = 1.0,
+    settle_secs: float = 1.0,
+    once: bool = False,
+    refresh_url: Optional[str] = None,
+    chunksize: int = 10**6,
+    writer_profile: str = default_writer_profile,
+    output_format: str = DEFAULT_PROCESSED_FORMAT,
+) -> None:
+    """
+    Polls watch_dir for new files (see `ready_files`) and ingests each (see
+    `ingest_file`), recording it in the ingest manifest in output_dir so that
+    it is not ingested again. Changed files replace the partitions from their
+    previous ingest. Files that fail to ingest are not recorded, so they are
+    retried once they change or when the watcher is restarted. Files are
+    ingested one at a time, as chunk numbers are assigned by globbing existing
+    partitions. Other writers (e.g. `stream_bid_data.py`) should not be run on
+    output_dir at the same time.
+
+    If `once` is True, files already in watch_dir are ingested without
+    waiting for them to settle and the function returns.
+    """
+    for directory in (output_dir, processed_path):
+        if not directory.exists():
+            directory.mkdir(parents=True)
+    manifest = read_ingest_manifest(output_dir)
+    seen: Dict[Path, Tuple[int, int]] = {}
+    failed: Dict[str, str] = {}
+    logging.info(f"Watching {watch_dir} for new bid files")
+    while True:
+        if once:
+            # the first scan records files, so the second returns them all
+            ready_files(watch_dir, manifest, seen, 0.0)
+            files = ready_files(watch_dir, manifest, seen, 0.0)
+        else:
+            files = ready_files(watch_dir, manifest, seen, settle_secs, failed)
+        for file in files:
+            previous = manifest.get(file.name)
+            try:
+                manifest[file.name] = ingest_file(
+                    file,
+                    output_dir,
+                    processed_path,
+                    mappings_path,
+                    duids_path,
+                    chunksize=chunksize,
+                    writer_profile=writer_profile,
+                    output_format=output_format,
+                    previous=previous,
+                )
+            except Exception:
+                logging.exception(f"Failed to ingest {file.name}")
+                if file.exists():
+                    failed[file.name] = fingerprint_file(file)
+                continue
+            failed.pop(file.name, None)
+            write_ingest_manifest(output_dir, manifest)
+            if refresh_url is not None:
+                try:
+                    with urlopen(Request(refresh_url, method="POST")):
+                        pass
+                except OSError as e:
+                    logging.warning(f"Could not refresh {refresh_url}: {e}")
+        if once:
+            return None
+        time.sleep(poll_secs)
+
+
+def main():
+    logging.basicConfig(
+        format="\n%(levelname)s:%(message)s", level=logging.INFO
+    )
+    args = arg_parser()
+    watch_directory(
+        Path(args.watch_dir),
+        Path(args.output_dir),
+        Path(args.processed_dir),
+        Path("data", "mappings"),
+        Path("data", "duids"),
+        poll_secs=args.poll_secs,
+        settle_secs=args.settle_secs,
+        once=args.once,
+        refresh_url=args.refresh_url,
+        chunksize=args.chunksize,
+        writer_profile=args.writer_profile,
+        output_format=args.output_format,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -16,28 +16,147 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import logging
 import os
+from concurrent.futures import (
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    as_completed,
+)
 from pathlib import Path
-from typing import List, Optional
+from typing import Dict, List, Optional
 
 import pandas as pd
 import requests
 import simplejson
 from pydantic import BaseModel
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 GEOJSON = "https://data.opennem.org.au/v3/geo/au_facilities.json"
 LOCALDIR = Path("data", "opennem_stations")
 STATION_URL = "https://api.opennem.org.au/station/au/NEM/{}"
+# Local copy of the master geojson and HTTP validators (ETag/Last-Modified)
+# for conditional requests, both stored in LOCALDIR
+MASTER_FILE = "_au_facilities.json"
+VALIDATORS_FILE = "_validators.json"
+TIMEOUT = 30
 
 
-def get_master():
+def create_session(
+    max_connections: int = 8, retries: int = 3, backoff_factor: float = 0.5
+) -> requests.Session:
     """
-    Download master geojson file from openNEM, returning JSON
+    Create a session with a connection pool of size `max_connections` that
+    retries failed GET requests (incl. rate limiting and server errors) with
+    exponential backoff
     """
-    response = requests.get(GEOJSON)
+    retry = Retry(
+        total=retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=["GET"],
+    )
+    adapter = HTTPAdapter(
+        pool_connections=max_connections,
+        pool_maxsize=max_connections,
+        max_retries=retry,
+    )
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def load_validators(local_dir: Path = LOCALDIR) -> Dict[str, Dict[str, str]]:
+    """
+    Load HTTP validators (by URL) from local directory
+    """
+    try:
+        with open(os.path.join(local_dir, VALIDATORS_FILE), "r") as f:
+            return simplejson.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_validators(
+    validators: Dict[str, Dict[str, str]], local_dir: Path = LOCALDIR
+) -> None:
+    with open(os.path.join(local_dir, VALIDATORS_FILE), "w") as f:
+        simplejson.dump(validators, f, indent=2, sort_keys=True)
+
+
+def conditional_get(
+    session: requests.Session,
+    url: str,
+    validators: Optional[Dict[str, str]] = None,
+) -> Optional[requests.Response]:
+    """
+    GET a URL, sending If-None-Match/If-Modified-Since headers if validators
+    from a previous response are provided. Returns None if the resource has
+    not been modified (HTTP 304)
+    """
+    headers = {}
+    if validators:
+        if "etag" in validators:
+            headers["If-None-Match"] = validators["etag"]
+        if "last_modified" in validators:
+            headers["If-Modified-Since"] = validators["last_modified"]
+    response = session.get(url, headers=headers, timeout=TIMEOUT)
+    if response.status_code == 304:
+        return None
+    response.raise_for_status()
+    return response
+
+
+def get_response_validators(response: requests.Response) -> Dict[str, str]:
+    validators = {}
+    if "ETag" in response.headers:
+        validators["etag"] = response.headers["ETag"]
+    if "Last-Modified" in response.headers:
+        validators["last_modified"] = response.headers["Last-Modified"]
+    return validators
+
+
+def get_master(
+    session: Optional[requests.Session] = None,
+    local_dir: Path = LOCALDIR,
+    geojson_url: str = GEOJSON,
+):
+    """
+    Download master geojson file from openNEM, returning JSON.
+    The file is stored in the local directory and only downloaded again if it
+    has been modified
+    """
+    if session is None:
+        session = create_session()
+    master_file = os.path.join(local_dir, MASTER_FILE)
+    validators = load_validators(local_dir)
+    url_validators = validators.get(geojson_url)
+    if not os.path.exists(master_file):
+        url_validators = None
+    response = conditional_get(session, geojson_url, url_validators)
+    if response is None:
+        with open(master_file, "r") as f:
+            return simplejson.load(f)
+    with open(master_file, "wb") as f:
+        f.write(response.content)
+    validators[geojson_url] = get_response_validators(response)
+    save_validators(validators, local_dir)
     return simplejson.loads(response.content)
 
 
+def load_master(local_dir: Path = LOCALDIR):
+    """
+    Load master geojson from local directory, downloading it if it is missing
+    """
+    try:
+        with open(os.path.join(local_dir, MASTER_FILE), "r") as f:
+            return simplejson.load(f)
+    except FileNotFoundError:
+        return get_master(local_dir=local_dir)
+
+
 def get_station(station_code: str = "LIDDELL"):
     """
     Download and store station json from openNEM
@@ -59,12 +178,12 @@ def station_filename(code: str):
     return f"{clean_code}.json"
 
 
-def load_station(station_code: str):
+def load_station(station_code: str, local_dir: Path = LOCALDIR):
     """
     Load station json from local directory
     """
     filename = station_filename(station_code)
-    with open(os.path.join(LOCALDIR, filename), "r") as f:
+    with open(os.path.join(local_dir, filename), "r") as f:
         return simplejson.load(f)
 
 
@@ -77,18 +196,88 @@ def station_generator(master_json):
             yield station["properties"]["station_code"]
 
 
-def download_all_stations():
+def fetch_station(
+    session: requests.Session,
+    station_code: str,
+    validators: Optional[Dict[str, str]],
+    local_dir: Path = LOCALDIR,
+    station_url: str = STATION_URL,
+) -> Optional[Dict[str, str]]:
+    """
+    Download and store station json from openNEM if it is not stored locally
+    or if it has been modified. Returns validators for the stored station json
+    """
+    url = station_url.format(station_code)
+    if not os.path.exists(
+        os.path.join(local_dir, station_filename(station_code))
+    ):
+        validators = None
+    response = conditional_get(session, url, validators)
+    if response is None:
+        return validators
+    logging.info(f"Downloaded {station_code}")
+    json = simplejson.loads(response.content)
+    # stored under the requested code (rather than json["code"]) so that the
+    # existence check above finds it
+    filename = station_filename(station_code)
+    with open(os.path.join(local_dir, filename), "w") as f:
+        simplejson.dump(json, f, indent=2)
+    return get_response_validators(response)
+
+
+def download_all_stations(
+    max_workers: int = 8,
+    revalidate: bool = True,
+    local_dir: Path = LOCALDIR,
+    geojson_url: str = GEOJSON,
+    station_url: str = STATION_URL,
+):
     """
     Downloads all the station json data from the master list.
+
+    Stations are downloaded concurrently using up to `max_workers` threads
+    sharing a pooled session. If `revalidate` is True, stations that have
+    already been downloaded are only downloaded again if they have been
+    modified (using conditional requests). Otherwise, they are skipped.
     """
-    master_json = get_master()
+    session = create_session(max_connections=max_workers)
+    master_json = get_master(session, local_dir, geojson_url)
+    validators = load_validators(local_dir)
+    station_codes = []
     for station_code in station_generator(master_json):
-        if station_code != "SLDCBLK":
+        if station_code == "SLDCBLK":
+            continue
+        if not revalidate:
             try:
-                load_station(station_code)
+                load_station(station_code, local_dir)
+                continue
             except FileNotFoundError:
-                print("downloading ", station_code)
-                get_station(station_code)
+                pass
+        station_codes.append(station_code)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(
+                fetch_station,
+                session,
+                station_code,
+                validators.get(station_url.format(station_code)),
+                local_dir,
+                station_url,
+            ): station_code
+            for station_code in station_codes
+        }
+        for future in as_completed(futures):
+            station_code = futures[future]
+            try:
+                station_validators = future.result()
+            except (requests.RequestException, simplejson.JSONDecodeError):
+                logging.exception(f"Failed to download {station_code}")
+                continue
+            if station_validators:
+                validators[
+                    station_url.format(station_code)
+                ] = station_validators
+    save_validators(validators, local_dir)
 
 
 """
@@ -118,17 +307,17 @@ class Station(BaseModel):
     facilities: List[DispatchUnit]
 
 
-def parse_station_data():
+def parse_station_data(local_dir: Path = LOCALDIR):
     """
     Parses all station data from the master list.
-    Assumes all station json already downloaded.
+    Assumes all station json (and the master list) already downloaded.
     """
-    master_json = get_master()
+    master_json = load_master(local_dir)
     data = []
 
     for station_code in station_generator(master_json):
         if station_code not in ["MWPS", "SLDCBLK"]:
-            station_json = load_station(station_code)
+            station_json = load_station(station_code, local_dir)
             valid_station = Station(**station_json)
             data.append(flatten_station(valid_station))
 
@@ -153,9 +342,95 @@ def flatten_station(valid_station: Station):
     return pd.DataFrame(d)
 
 
+"""
+Columns of the flattened station data, as per `parse_station_data`
+"""
+REQUIRED_UNIT_FIELDS = ["network_region", "code", "fueltech", "status"]
+OPTIONAL_UNIT_FIELDS = [
+    "capacity_registered",
+    "data_first_seen",
+    "data_last_seen",
+]
+STATION_COLUMNS = [
+    "network_region",
+    "code",
+    "fueltech",
+    "capacity_registered",
+    "status",
+    "data_first_seen",
+    "data_last_seen",
+    "lat",
+    "lon",
+    "station_name",
+    "station_code",
+]
+FLOAT_COLUMNS = ["capacity_registered", "lat", "lon"]
+
+
+def flatten_station_files(station_files: List[str]) -> Dict[str, list]:
+    """
+    Flattens station json files into column lists in a single pass.
+    Raises KeyError if a required field (see `Station` and `DispatchUnit`) is
+    missing
+    """
+    columns: Dict[str, list] = {col: [] for col in STATION_COLUMNS}
+    for station_file in station_files:
+        with open(station_file, "r") as f:
+            station = simplejson.load(f)
+        name, code = station["name"], station["code"]
+        lat = station["location"].get("lat")
+        lon = station["location"].get("lng")
+        for du in station["facilities"]:
+            for field in REQUIRED_UNIT_FIELDS:
+                columns[field].append(du[field])
+            for field in OPTIONAL_UNIT_FIELDS:
+                columns[field].append(du.get(field))
+            columns["lat"].append(lat)
+            columns["lon"].append(lon)
+            columns["station_name"].append(name)
+            columns["station_code"].append(code)
+    return columns
+
+
+def parse_station_data_bulk(local_dir: Path = LOCALDIR, max_workers: int = 1):
+    """
+    Bulk equivalent of `parse_station_data` that builds a single typed
+    DataFrame from column lists rather than validating and flattening each
+    station into its own DataFrame.
+
+    If `max_workers` > 1, station files are split into batches that are
+    flattened in parallel processes.
+    """
+    master_json = load_master(local_dir)
+    station_files = [
+        os.path.join(local_dir, station_filename(station_code))
+        for station_code in station_generator(master_json)
+        if station_code not in ["MWPS", "SLDCBLK"]
+    ]
+    if max_workers > 1 and station_files:
+        batch_size = -(-len(station_files) // max_workers)
+        batches = [
+            station_files[i : i + batch_size]
+            for i in range(0, len(station_files), batch_size)
+        ]
+        columns: Dict[str, list] = {col: [] for col in STATION_COLUMNS}
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            for batch_columns in executor.map(flatten_station_files, batches):
+                for col in STATION_COLUMNS:
+                    columns[col].extend(batch_columns[col])
+    else:
+        columns = flatten_station_files(station_files)
+    stations = pd.DataFrame(columns, columns=STATION_COLUMNS)
+    stations[FLOAT_COLUMNS] = stations[FLOAT_COLUMNS].astype(float)
+    return stations
+
+
 if __name__ == "__main__":
+    logging.basicConfig(
+        format="\n%(levelname)s:%(message)s", level=logging.INFO
+    )
     if not LOCALDIR.exists():
         LOCALDIR.mkdir()
     download_all_stations()
-    stations = parse_station_data()
+    stations = parse_station_data_bulk(max_workers=os.cpu_count() or 1)
     stations.to_csv(Path("data", "duids", "opennem_duids.csv"))
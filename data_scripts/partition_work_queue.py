@@ -0,0 +1,286 @@
+# Python script (executable via CLI) that partitions raw AEMO data CSVs using
+# a work queue on a shared filesystem, so that any number of worker processes
+# or hosts can partition files in parallel
+#
+# Copyright (C) 2023 Abhijith Prakash
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import argparse
+import logging
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List
+
+from create_parquet_partitions_by_column import (
+    chunk_file,
+    default_writer_profile,
+    get_columns,
+    next_chunk_file,
+    writer_profiles,
+)
+from ingest_bid_files import table_partition_dir
+
+from analysis_code.work_queue import (
+    DEFAULT_LEASE_SECS,
+    Lease,
+    WorkQueue,
+    run_worker,
+)
+
+# kind of the tasks added by this script
+TASK_KIND = "chunk_file"
+
+
+def arg_parser():
+    description = (
+        "Partition raw AEMO data CSVs using a work queue on a shared "
+        + "filesystem, so that any number of worker processes or hosts can "
+        + "partition files in parallel"
+    )
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument(
+        "-queue_dir",
+        type=str,
+        required=True,
+        help=(
+            "Work queue directory. Must be on a filesystem shared by workers"
+        ),
+    )
+    parser.add_argument(
+        "-raw_dir",
+        type=str,
+        default=str(Path("data", "raw")),
+        help=("Directory with raw CSVs"),
+    )
+    parser.add_argument(
+        "-output_dir",
+        type=str,
+        default=str(Path("data", "partitioned")),
+        help=("Directory to merge parquet partitions into"),
+    )
+    parser.add_argument(
+        "-table",
+        type=str,
+        default="BIDPEROFFER",
+        help=("MMS table to enqueue"),
+    )
+    parser.add_argument(
+        "-enqueue",
+        action="store_true",
+        help=("Add a task for each raw CSV of -table in -raw_dir"),
+    )
+    parser.add_argument(
+        "-reset_failed",
+        action="store_true",
+        help=("Requeue failed tasks"),
+    )
+    parser.add_argument(
+        "-work",
+        action="store_true",
+        help=("Run tasks until the queue is finished"),
+    )
+    parser.add_argument(
+        "-workers",
+        type=int,
+        default=1,
+        help=("Number of worker processes to run with -work. Default 1"),
+    )
+    parser.add_argument(
+        "-merge",
+        action="store_true",
+        help=("Move partitions of finished tasks into -output_dir"),
+    )
+    parser.add_argument(
+        "-lease_secs",
+        type=float,
+        default=DEFAULT_LEASE_SECS,
+        help=(
+            "Time after which the task of a worker that stops renewing its "
+            + f"lease can be claimed by another. Default {DEFAULT_LEASE_SECS}"
+        ),
+    )
+    parser.add_argument(
+        "-chunksize",
+        type=int,
+        default=10**6,
+        help=("Size of each DataFrame chunk (# of lines). Default 10^6"),
+    )
+    parser.add_argument(
+        "-writer_profile",
+        type=str,
+        default=default_writer_profile,
+        choices=list(writer_profiles.keys()),
+        help=(f"Parquet writer profile. Default {default_writer_profile}"),
+    )
+    args = parser.parse_args()
+    return args
+
+
+def partition_tasks(raw_dir: Path, table: str) -> List[Dict]:
+    """
+    A task for each raw CSV of a table in raw_dir. Files are referred to by
+    name, as raw_dir may be mounted at different paths on each host.
+    """
+    return [
+        {
+            "id": f"{TASK_KIND}-{csv.stem}",
+            "kind": TASK_KIND,
+            "file": csv.name,
+            "table": table,
+        }
+        for csv in sorted(raw_dir.glob(f"*_{table}_*"))
+        if csv.suffix.lower() == ".csv"
+    ]
+
+
+def staging_dir(queue: WorkQueue, task_id: str) -> Path:
+    return queue.path / Path("staging", task_id)
+
+
+def partition_file(
+    lease: Lease,
+    queue: WorkQueue,
+    raw_dir: Path,
+    chunksize: int = 10**6,
+    writer_profile: str = default_writer_profile,
+) -> None:
+    """
+    Runs a partitioning task. The CSV is partitioned (see `chunk_file`) into a
+    staging directory for the task and lease, so that workers running the
+    same task never write to the same partitions. Partitions are moved into
+    the output directory by `merge_partitions`.
+    """
+    csv = raw_dir / Path(lease.task["file"])
+    if not csv.exists():
+        raise FileNotFoundError(f"{csv} does not exist")
+    cols = get_columns(csv)
+    if "TRADINGDATE" in cols:
+        partition_col = "TRADINGDATE"
+    elif "SETTLEMENTDATE" in cols:
+        partition_col = "SETTLEMENTDATE"
+    else:
+        raise ValueError(f"No partition col in {csv.name}")
+    partition_dir = Path(
+        staging_dir(queue, lease.task["id"]), lease.token, partition_col
+    )
+    partition_dir.mkdir(parents=True)
+    chunk_file(
+        csv,
+        partition_dir,
+        partition_col,
+        chunksize=chunksize,
+        writer_profile=writer_profile,
+    )
+
+
+def work(
+    queue_path: Path,
+    raw_dir: Path,
+    lease_secs: float = DEFAULT_LEASE_SECS,
+    chunksize: int = 10**6,
+    writer_profile: str = default_writer_profile,
+) -> int:
+    """
+    Runs partitioning tasks until the queue is finished (see `run_worker`).
+    Returns the number of tasks run by this worker.
+    """
+    logging.basicConfig(
+        format="\n%(levelname)s:%(message)s", level=logging.INFO
+    )
+    queue = WorkQueue(queue_path, lease_secs)
+    return run_worker(
+        queue,
+        lambda lease: partition_file(
+            lease, queue, raw_dir, chunksize, writer_profile
+        ),
+    )
+
+
+def merge_partitions(queue: WorkQueue, output_dir: Path) -> int:
+    """
+    Moves the partitions of finished tasks (from the staging directory of the
+    worker that finished each task first) into output_dir as new chunks of
+    each day (see `table_partition_dir`). Tasks are merged in order of their
+    files, one at a time, as chunk numbers are assigned by globbing existing
+    partitions. A task's staging directory is removed once merged, so merging
+    can be rerun (e.g. as more tasks finish or after a crash).
+
+    Returns the number of tasks merged.
+    """
+    merged = 0
+    for task_id in queue.task_ids():
+        task = queue.task(task_id)
+        if task.get("kind") != TASK_KIND:
+            continue
+        done = queue.done(task_id)
+        task_staging = staging_dir(queue, task_id)
+        if done is None or not task_staging.exists():
+            continue
+        if done["status"] == "ok":
+            staged = task_staging / Path(done["token"])
+            for staged_dir in sorted(staged.iterdir()):
+                partition_dir = table_partition_dir(
+                    output_dir, task["table"], staged_dir.name
+                )
+                if not partition_dir.exists():
+                    partition_dir.mkdir(parents=True)
+                for partition in sorted(staged_dir.glob("*.parquet")):
+                    str_value = partition.name.split("-chunk-")[0]
+                    os.replace(
+                        partition, next_chunk_file(partition_dir, str_value)
+                    )
+            merged += 1
+        shutil.rmtree(task_staging)
+    logging.info(f"Merged {merged} tasks")
+    return merged
+
+
+def main():
+    logging.basicConfig(
+        format="\n%(levelname)s:%(message)s", level=logging.INFO
+    )
+    args = arg_parser()
+    queue_path = Path(args.queue_dir)
+    raw_dir = Path(args.raw_dir)
+    queue = WorkQueue(queue_path, args.lease_secs)
+    if args.enqueue:
+        added = queue.add_tasks(partition_tasks(raw_dir, args.table))
+        logging.info(f"Added {added} tasks")
+    if args.reset_failed:
+        logging.info(f"Requeued {queue.reset_failed()} failed tasks")
+    if args.work:
+        with ProcessPoolExecutor(max_workers=args.workers) as executor:
+            futures = [
+                executor.submit(
+                    work,
+                    queue_path,
+                    raw_dir,
+                    args.lease_secs,
+                    args.chunksize,
+                    args.writer_profile,
+                )
+                for _ in range(args.workers)
+            ]
+            n_run = sum(future.result() for future in futures)
+        logging.info(f"Ran {n_run} tasks")
+    if args.merge:
+        merge_partitions(queue, Path(args.output_dir))
+    logging.info(f"Queue status: {queue.status()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+# Python script (executable via CLI) that downloads (or copies from a local
+# mirror) monthly AEMO bid data and partitions it in a single streaming
+# pipeline, deleting each raw file as soon as it has been partitioned
+#
+# Copyright (C) 2023 Abhijith Prakash
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import argparse
+import logging
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from queue import Queue
+from typing import List, Optional, Tuple, Union
+from zipfile import ZipFile
+
+from create_parquet_partitions_by_column import (
+    default_writer_profile,
+    writer_profiles,
+)
+from get_partitioned_data import partition_raw_csv
+from mms_monthly_cli.mms_monthly import get_and_unzip_table_csv
+
+
+def arg_parser():
+    description = (
+        "Download (or copy from a local mirror) and partition monthly AEMO "
+        + "bid data, overlapping downloads with partitioning"
+    )
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument(
+        "-years",
+        type=int,
+        nargs="+",
+        required=True,
+        help=("Years to fetch"),
+    )
+    parser.add_argument(
+        "-months",
+        type=int,
+        nargs="+",
+        required=True,
+        help=("Months to fetch for each year"),
+    )
+    parser.add_argument(
+        "-table", type=str, default="BIDPEROFFER", help=("MMS table to fetch")
+    )
+    parser.add_argument(
+        "-raw_dir",
+        type=str,
+        default=str(Path("data", "raw")),
+        help=("Directory to temporarily store raw CSVs"),
+    )
+    parser.add_argument(
+        "-output_dir",
+        type=str,
+        default=str(Path("data", "partitioned")),
+        help=("Directory to write parquet partitions to"),
+    )
+    parser.add_argument(
+        "-mirror_dir",
+        type=str,
+        help=("Local directory with MMS zips/CSVs to use instead of NEMWeb"),
+    )
+    parser.add_argument(
+        "-max_raw_files",
+        type=int,
+        default=2,
+        help=("Maximum number of raw CSVs on disk at once. Default 2"),
+    )
+    parser.add_argument(
+        "-download_workers",
+        type=int,
+        default=2,
+        help=("Number of concurrent downloads. Default 2"),
+    )
+    parser.add_argument(
+        "-writer_profile",
+        type=str,
+        default=default_writer_profile,
+        choices=list(writer_profiles.keys()),
+        help=(f"Parquet writer profile. Default {default_writer_profile}"),
+    )
+    args = parser.parse_args()
+    return args
+
+
+def raw_csv_name(year: int, month: int, table: str) -> str:
+    return f"PUBLIC_DVD_{table}_{year}{month:02d}010000"
+
+
+def fetch_raw_csv(
+    year: int,
+    month: int,
+    table: str,
+    raw_dir: Path,
+    mirror_dir: Optional[Path] = None,
+) -> Path:
+    """
+    Fetches a monthly table CSV into raw_dir, either from NEMWeb (via
+    `get_and_unzip_table_csv`) or from a local mirror directory containing
+    the zipped or unzipped CSV
+    """
+    name = raw_csv_name(year, month, table)
+    if mirror_dir is None:
+        get_and_unzip_table_csv(year, month, "DATA", table, raw_dir)
+    elif (zipped := Path(mirror_dir, name + ".zip")).exists():
+        with ZipFile(zipped) as z:
+            z.extractall(raw_dir)
+    else:
+        mirrored = [
+            f for f in Path(mirror_dir).glob(name + ".*") if f.suffix != ".zip"
+        ]
+        if not mirrored:
+            raise FileNotFoundError(f"{name} not in {mirror_dir}")
+        shutil.copy(mirrored.pop(), raw_dir)
+    csvs = [f for f in raw_dir.glob(name + ".*") if f.suffix.lower() == ".csv"]
+    if not csvs:
+        raise FileNotFoundError(f"{name} CSV not extracted to {raw_dir}")
+    return csvs.pop()
+
+
+def stream_bid_data(
+    year_months: List[Tuple[int, int]],
+    raw_dir: Path,
+    output_dir: Path,
+    table: str = "BIDPEROFFER",
+    mirror_dir: Optional[Path] = None,
+    max_raw_files: int = 2,
+    download_workers: int = 2,
+    writer_profile: str = default_writer_profile,
+) -> None:
+    """
+    Producer-consumer pipeline that partitions raw CSVs while others are being
+    downloaded.
+
+    Download threads fetch raw CSVs and put them on a queue, from which they are
+    partitioned (in order of arrival) and deleted. A semaphore limits the number
+    of raw CSVs on disk (downloading, queued or being partitioned) to
+    `max_raw_files`. Partitioning is done by a single consumer as chunk numbers
+    are assigned by globbing existing partitions (see
+    `write_chunks_by_trading_date`).
+
+    If partitioning is interrupted (e.g. by SystemExit or KeyboardInterrupt),
+    producers waiting for a slot stop and queued downloads are cancelled.
+
+    The raw data disk high-water mark and total wall time are logged at the end.
+    """
+    for directory in (raw_dir, output_dir):
+        if not directory.exists():
+            directory.mkdir(parents=True)
+    raw_slots = threading.BoundedSemaphore(max_raw_files)
+    fetched: Queue[Tuple[Tuple[int, int], Union[Path, Exception]]] = Queue()
+    on_disk = {"bytes": 0, "high_water_mark": 0}
+    disk_lock = threading.Lock()
+
+    # set if the consumer stops early so that waiting producers exit
+    stop = threading.Event()
+
+    def produce(year: int, month: int) -> None:
+        while not raw_slots.acquire(timeout=1.0):
+            if stop.is_set():
+                return None
+        if stop.is_set():
+            raw_slots.release()
+            return None
+        csv = None
+        try:
+            csv = fetch_raw_csv(year, month, table, raw_dir, mirror_dir)
+            if stop.is_set():
+                csv.unlink(missing_ok=True)
+                raw_slots.release()
+                return None
+            size = csv.stat().st_size
+            with disk_lock:
+                on_disk["bytes"] += size
+                on_disk["high_water_mark"] = max(
+                    on_disk["high_water_mark"], on_disk["bytes"]
+                )
+        except BaseException as e:
+            # the consumer waits for a result for every month
+            if csv is not None:
+                csv.unlink(missing_ok=True)
+            raw_slots.release()
+            fetched.put(((year, month), e))
+            if not isinstance(e, Exception):
+                raise
+            return None
+        fetched.put(((year, month), csv))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=download_workers) as executor:
+        for year, month in year_months:
+            executor.submit(produce, year, month)
+        try:
+            for _ in range(len(year_months)):
+                (year, month), result = fetched.get()
+                if isinstance(result, BaseException):
+                    logging.error(
+                        f"Failed to fetch {table} {month}/{year}: {result}"
+                    )
+                    continue
+                size = result.stat().st_size
+                logging.info(f"Partitioning {result.name}")
+                try:
+                    partition_raw_csv(
+                        result,
+                        output_dir,
+                        writer_profile=writer_profile,
+                        table=table,
+                    )
+                except Exception:
+                    logging.exception(f"Failed to partition {result.name}")
+                finally:
+                    result.unlink(missing_ok=True)
+                    with disk_lock:
+                        on_disk["bytes"] -= size
+                    raw_slots.release()
+        except BaseException:
+            # e.g. SystemExit from partitioning a bad CSV or KeyboardInterrupt
+            stop.set()
+            executor.shutdown(cancel_futures=True)
+            raise
+    logging.info(
+        f"Processed {len(year_months)} files in "
+        + f"{time.perf_counter() - start:.1f}s. Raw data disk high-water mark: "
+        + f"{on_disk['high_water_mark'] / 1e9:.2f} GB"
+    )
+
+
+def main():
+    logging.basicConfig(
+        format="\n%(levelname)s:%(message)s", level=logging.INFO
+    )
+    args = arg_parser()
+    year_months = [
+        (year, month) for year in args.years for month in args.months
+    ]
+    stream_bid_data(
+        year_months,
+        Path(args.raw_dir),
+        Path(args.output_dir),
+        table=args.table,
+        mirror_dir=Path(args.mirror_dir) if args.mirror_dir else None,
+        max_raw_files=args.max_raw_files,
+        download_workers=args.download_workers,
+        writer_profile=args.writer_profile,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,43 +1,123 @@
+import argparse
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, List
+from typing import Callable, Dict, List, Tuple
 
 import matplotlib.pyplot as plt
 import pandas as pd
 from mms_monthly_cli.mms_monthly import get_table_names_and_sizes
 
+from analysis_code.processed_data import (
+    PROCESSED_FORMATS,
+    find_processed,
+    read_processed,
+    write_processed,
+)
 
-def assemble_zipfile_size_data(start_year: int, end_year: int) -> None:
+"""Persistent cache of MMS monthly archive table zip file sizes (bytes),
+keyed by YYYY-MM
+"""
+TABLE_SIZE_CACHE = Path("data", "processed", "mms_monthly_table_sizes.json")
+
+
+def load_table_size_cache(cache_path: Path) -> Dict[str, Dict[str, int]]:
+    if not cache_path.exists():
+        return {}
+    with open(cache_path, "r") as f:
+        return json.load(f)
+
+
+def save_table_size_cache(
+    table_sizes: Dict[str, Dict[str, int]], cache_path: Path
+) -> None:
+    if not cache_path.parent.exists():
+        cache_path.parent.mkdir(parents=True)
+    with open(cache_path, "w") as f:
+        json.dump(table_sizes, f, indent=2, sort_keys=True)
+
+
+def scrape_table_sizes(
+    year_months: List[Tuple[int, int]],
+    cache_path: Path = TABLE_SIZE_CACHE,
+    max_workers: int = 8,
+    get_sizes: Callable[[int, int, str], Dict] = get_table_names_and_sizes,
+) -> Dict[Tuple[int, int], Dict[str, int]]:
+    """
+    Returns table zip file sizes for each (year, month) in the DATA directory
+    of the MMS monthly archive.
+
+    Sizes are read from a persistent cache, and only months missing from the
+    cache are scraped (concurrently, using up to `max_workers` threads). The
+    cache is saved as each month is scraped so that progress is kept if
+    scraping fails part way.
+    """
+    table_sizes = load_table_size_cache(cache_path)
+    missing = [
+        (year, month)
+        for year, month in year_months
+        if f"{year}-{month:02d}" not in table_sizes
+    ]
+    if missing:
+        logging.info(f"Scraping {len(missing)} months")
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                executor.submit(get_sizes, year, month, "DATA"): (year, month)
+                for year, month in missing
+            }
+            for future in as_completed(futures):
+                year, month = futures[future]
+                table_sizes[f"{year}-{month:02d}"] = future.result()
+                save_table_size_cache(table_sizes, cache_path)
+    return {
+        (year, month): table_sizes[f"{year}-{month:02d}"]
+        for year, month in year_months
+    }
+
+
+def assemble_zipfile_size_data(
+    start_year: int,
+    end_year: int,
+    cache_path: Path = TABLE_SIZE_CACHE,
+    max_workers: int = 8,
+    output_format: str = "csv",
+) -> Path:
     data: Dict[str, List] = {}
     data["year"] = []
     data["month"] = []
     data["BIDPEROFFER_size_GB"] = []
-    for year in range(start_year, end_year):
-        for month in range(1, 13):
-            print(f"Scraping {year} {month}")
-            all_table_sizes = get_table_names_and_sizes(year, month, "DATA")
-            bidperoffer = [
-                tbname for tbname in all_table_sizes if "BIDPEROFFER" in tbname
-            ]
-            size = 0.0
-            for fn in bidperoffer:
-                size += all_table_sizes[fn]
-            data["year"].append(year)
-            data["month"].append(month)
-            size /= 10**9
-            data["BIDPEROFFER_size_GB"].append(size)
+    year_months = [
+        (year, month)
+        for year in range(start_year, end_year)
+        for month in range(1, 13)
+    ]
+    table_sizes = scrape_table_sizes(
+        year_months, cache_path=cache_path, max_workers=max_workers
+    )
+    for (year, month), all_table_sizes in table_sizes.items():
+        bidperoffer = [
+            tbname for tbname in all_table_sizes if "BIDPEROFFER" in tbname
+        ]
+        size = 0.0
+        for fn in bidperoffer:
+            size += all_table_sizes[fn]
+        data["year"].append(year)
+        data["month"].append(month)
+        size /= 10**9
+        data["BIDPEROFFER_size_GB"].append(size)
     df = pd.DataFrame(data)
     if not (data_out_path := Path("data", "processed")).exists():
         data_out_path.mkdir()
     out_path = data_out_path / Path(
-        f"bidperoffer_monthly_zip_size_{start_year}_{end_year-1}.csv"
+        f"bidperoffer_monthly_zip_size_{start_year}_{end_year-1}"
     )
-    df.to_csv(str(out_path), index=False)
-    return None
+    return write_processed(df, out_path, output_format, index=False)
 
 
 def plot_zipfile_size_over_time(data_path: Path, start_year, end_year):
-    df = pd.read_csv(data_path)
+    df = read_processed(data_path, index=False)
     df["Date"] = pd.to_datetime(
         df["month"].astype(str) + "/" + df["year"].astype(str), format="%m/%Y"
     )
@@ -83,23 +163,39 @@ def plot_zipfile_size_over_time(data_path: Path, start_year, end_year):
         bbox_to_anchor=(0.5, -0.1),
         frameon=False,
     )
-    fig.savefig(
-        Path(
-            "plots", f"monthly_bidding_data_size_{start_year}_{end_year}.pdf"
-        ),
-        dpi=600,
-    )
+    return fig, ax
 
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(
+        description="Plot monthly BIDPEROFFER zip file sizes"
+    )
+    parser.add_argument(
+        "-output_format",
+        type=str,
+        default="csv",
+        choices=list(PROCESSED_FORMATS.keys()),
+        help=("Zip file size data output format. Default csv"),
+    )
+    args = parser.parse_args()
     start_year = 2012
     end_year = 2023
-    if not (
-        out_path := Path(
+    out_path = find_processed(
+        Path(
             "data",
             "processed",
-            f"bidperoffer_monthly_zip_size_{start_year}_{end_year-1}.csv",
+            f"bidperoffer_monthly_zip_size_{start_year}_{end_year-1}",
+        )
+    )
+    if out_path is None:
+        out_path = assemble_zipfile_size_data(
+            start_year, end_year, output_format=args.output_format
         )
-    ).exists():
-        assemble_zipfile_size_data(start_year, end_year)
-    plot_zipfile_size_over_time(out_path, start_year, end_year)
+    fig, ax = plot_zipfile_size_over_time(out_path, start_year, end_year)
+    fig.savefig(
+        Path(
+            "plots", f"monthly_bidding_data_size_{start_year}_{end_year}.pdf"
+        ),
+        dpi=600,
+    )
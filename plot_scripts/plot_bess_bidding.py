@@ -1,7 +1,9 @@
 # %%
+from datetime import datetime
 from pathlib import Path
-from typing import List
+from typing import Dict, List, Tuple
 
+import numpy as np
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
@@ -9,8 +11,12 @@ import plotly.io as pio
 from nem_bidding_dashboard.defaults import bid_order
 from plotly.subplots import make_subplots
 
+from analysis_code.processed_data import find_processed, read_processed
+
 pio.kaleido.scope.mathjax = None
 data_path = Path("data", "processed")
+# aggregated BESS dataset directory, relative to data_path
+BESS_DATASET = "agg_bess"
 
 plotly_template = dict(
     layout=go.Layout(
@@ -35,139 +41,188 @@ divergent_colors = [
 ]
 
 
-def consolidate_bid_buckets(bid_order: List[str]):
-    bid_order.remove("[0, 50)")
-    bid_order.remove("[50, 100)")
-    bid_order.insert(2, "[0, 100)")
-    bid_order.remove("[100, 200)")
-    bid_order.remove("[200, 300)")
-    bid_order.insert(3, "[100, 300)")
-    bid_order.remove("[1000, 5000)")
-    bid_order.remove("[5000, 10000)")
-    bid_order.insert(6, "[1000, 10000)")
-    return bid_order
-
-
-def consolidate_bid_buckets_in_data(bid_df: pd.DataFrame):
-    bid_df.BIN_NAME.replace("[0, 50)", "[0, 100)", inplace=True)
-    bid_df.BIN_NAME.replace("[50, 100)", "[0, 100)", inplace=True)
-    bid_df.BIN_NAME.replace("[100, 200)", "[100, 300)", inplace=True)
-    bid_df.BIN_NAME.replace("[200, 300)", "[100, 300)", inplace=True)
-    bid_df.BIN_NAME.replace("[1000, 5000)", "[1000, 10000)", inplace=True)
-    bid_df.BIN_NAME.replace("[5000, 10000)", "[1000, 10000)", inplace=True)
-    return bid_df
+# price bands that are consolidated into wider bands for plotting
+BID_BUCKET_CONSOLIDATION = {
+    "[0, 50)": "[0, 100)",
+    "[50, 100)": "[0, 100)",
+    "[100, 200)": "[100, 300)",
+    "[200, 300)": "[100, 300)",
+    "[1000, 5000)": "[1000, 10000)",
+    "[5000, 10000)": "[1000, 10000)",
+}
+
+
+def consolidate_bid_buckets(bid_order: List[str]) -> List[str]:
+    """
+    Consolidated bid bands in price order. `bid_order` is not modified.
+    """
+    consolidated: List[str] = []
+    for bucket in bid_order:
+        band = BID_BUCKET_CONSOLIDATION.get(bucket, bucket)
+        if band not in consolidated:
+            consolidated.append(band)
+    return consolidated
+
+
+def pivot_bid_bands(
+    bid_df: pd.DataFrame, bid_order: List[str]
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Pivots aggregated bids into a dense (interval x consolidated band) array
+    of bid volumes, with bands in the order of `consolidate_bid_buckets`.
+
+    Bid buckets are mapped to consolidated band columns in a single vectorised
+    lookup and volumes are summed into the array. Buckets not in `bid_order`
+    are dropped.
+
+    Returns the (sorted) intervals and the bid volume array.
+    """
+    consolidated_bid_order = consolidate_bid_buckets(bid_order)
+    band_columns = {
+        bucket: consolidated_bid_order.index(
+            BID_BUCKET_CONSOLIDATION.get(bucket, bucket)
+        )
+        for bucket in bid_order
+    }
+    columns = bid_df.BIN_NAME.map(band_columns)
+    in_order = columns.notna().to_numpy()
+    rows, intervals = pd.factorize(
+        bid_df.INTERVAL_DATETIME[in_order], sort=True
+    )
+    volumes = np.zeros((len(intervals), len(consolidated_bid_order)))
+    np.add.at(
+        volumes,
+        (rows, columns[in_order].to_numpy(dtype=int)),
+        bid_df.BIDVOLUME[in_order].to_numpy(dtype=float),
+    )
+    return np.asarray(intervals), volumes
 
 
-# %%
-bid_df_2021 = pd.read_csv(Path(data_path, "agg_bess_bid_data_20210604.csv"))
-dispatch_df_2021 = pd.read_csv(
-    Path(data_path, "agg_bess_dispatch_data_20210604.csv")
-)
-bid_df_2023 = pd.read_csv(Path(data_path, "agg_bess_bid_data_20230604.csv"))
-dispatch_df_2023 = pd.read_csv(
-    Path(data_path, "agg_bess_dispatch_data_20230604.csv")
-)
-consolidated_bid_order = consolidate_bid_buckets(bid_order)
-bin_df_2021 = consolidate_bid_buckets_in_data(bid_df_2021)
-bin_df_2023 = consolidate_bid_buckets_in_data(bid_df_2023)
-
-fig = make_subplots(
-    rows=2,
-    specs=[[dict(secondary_y=True)], [dict(secondary_y=True)]],
-    subplot_titles=["June 4, 2021", "June 4, 2023"],
-)
+def bess_partition_paths(data_path: Path, date: datetime) -> Tuple[Path, Path]:
+    """
+    Bid and dispatch partitions for a day in the aggregated BESS dataset
+    """
+    partition = f"DATE={date:%Y-%m-%d}"
+    return (
+        Path(data_path, BESS_DATASET, "bids", partition),
+        Path(data_path, BESS_DATASET, "dispatch", partition),
+    )
 
-for bid_band, color in zip(consolidated_bid_order, divergent_colors):
-    bid_band_df_2021 = bid_df_2021.loc[bid_df_2021.BIN_NAME == bid_band, :]
 
-    # If the bin is missing in 2021 data, add a zero-height bar to include in legend
-    if bid_band_df_2021.empty:
-        fig.add_trace(
-            go.Bar(
-                x=[None],
-                y=[0],
-                marker=dict(color=color),
-                name=bid_band,
+def load_bess_data(
+    data_path: Path, date: datetime
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Loads aggregated BESS bid and dispatch data for a day. Data is read from
+    the day's partitions of the aggregated BESS dataset (see
+    data_scripts/get_bess_bidding_data.py) if they exist, or otherwise from
+    per-day CSVs.
+    """
+    bids_partition, dispatch_partition = bess_partition_paths(data_path, date)
+    bids_file = find_processed(bids_partition / Path("part-0"))
+    dispatch_file = find_processed(dispatch_partition / Path("part-0"))
+    if bids_file is not None and dispatch_file is not None:
+        bid_df = read_processed(bids_file, index=False)
+        dispatch_df = read_processed(dispatch_file, index=False)
+    else:
+        day = date.strftime("%Y%m%d")
+        bid_df = pd.read_csv(Path(data_path, f"agg_bess_bid_data_{day}.csv"))
+        dispatch_df = pd.read_csv(
+            Path(data_path, f"agg_bess_dispatch_data_{day}.csv")
+        )
+    return bid_df, dispatch_df
+
+
+def plot_bess_bidding(
+    bess_data: Dict[datetime, Tuple[pd.DataFrame, pd.DataFrame]],
+) -> go.Figure:
+    """
+    Plots aggregate BESS offer volumes by price band (and the NEM-wide
+    volume-weighted price) for each day in `bess_data` (see `load_bess_data`),
+    with one subplot per day
+    """
+    consolidated_bid_order = consolidate_bid_buckets(bid_order)
+    dates = sorted(bess_data)
+    fig = make_subplots(
+        rows=len(dates),
+        specs=[[dict(secondary_y=True)] for _ in dates],
+        subplot_titles=[f"{d:%B} {d.day}, {d.year}" for d in dates],
+    )
+    for row, date in enumerate(dates, start=1):
+        intervals, volumes = pivot_bid_bands(bess_data[date][0], bid_order)
+        if row == 1:
+            legend_kwargs = dict(
                 legendgroup="price",
                 legendgrouptitle=dict(text="Offer price (AUD/MW/hr)"),
-            ),
-            row=1,
-            col=1,
+            )
+        else:
+            legend_kwargs = dict(legendgroup="price", showlegend=False)
+        fig.add_traces(
+            [
+                go.Bar(
+                    x=intervals,
+                    y=volumes[:, i],
+                    marker=dict(color=color),
+                    name=bid_band,
+                    **legend_kwargs,
+                )
+                for i, (bid_band, color) in enumerate(
+                    zip(consolidated_bid_order, divergent_colors)
+                )
+            ],
+            rows=row,
+            cols=1,
         )
-    else:
+    for row, date in enumerate(dates, start=1):
+        _, dispatch_df = bess_data[date]
+        if row == 1:
+            price_kwargs = dict(
+                name="Average price (AUD/MW/hr)",
+                legendgroup="vwap",
+                legendgrouptitle=dict(text="NEM-wide (volume-weighted)"),
+            )
+        else:
+            # Prevents repetition in subsequent subplots
+            price_kwargs = dict(name="Average price", showlegend=False)
         fig.add_trace(
-            go.Bar(
-                x=bid_band_df_2021.INTERVAL_DATETIME,
-                y=bid_band_df_2021.BIDVOLUME,
-                marker=dict(color=color),
-                name=bid_band,
-                legendgroup="price",
-                legendgrouptitle=dict(text="Offer price (AUD/MW/hr)"),
+            go.Scatter(
+                x=dispatch_df.SETTLEMENTDATE,
+                y=dispatch_df.PRICE,
+                marker=dict(color="black"),
+                line=dict(width=1),
+                **price_kwargs,
             ),
-            row=1,
+            secondary_y=True,
+            row=row,
             col=1,
         )
 
-for bid_band, color in zip(consolidated_bid_order, divergent_colors):
-    bid_band_df = bid_df_2023.loc[bid_df_2023.BIN_NAME == bid_band, :]
-    fig.add_trace(
-        go.Bar(
-            x=bid_band_df.INTERVAL_DATETIME,
-            y=bid_band_df.BIDVOLUME,
-            marker=dict(color=color),
-            name=bid_band,
-            legendgroup="price",
-            showlegend=False,
+    fig.update_xaxes(showgrid=False)
+    fig.update_yaxes(showgrid=False)
+    fig.update_layout(
+        height=225 * max(len(dates), 2),
+        width=700,
+        barmode="stack",
+        bargap=0,
+        template=plotly_template,
+        title="NEM-wide Aggregate Volume of BESS Offers by Price",
+        legend=dict(
+            xanchor="right",
+            x=1.6,
         ),
-        row=2,
-        col=1,
     )
 
-fig.add_trace(
-    go.Scatter(
-        name="Average price (AUD/MW/hr)",
-        x=dispatch_df_2021.SETTLEMENTDATE,
-        y=dispatch_df_2021.PRICE,
-        marker=dict(color="black"),
-        line=dict(width=1),
-        legendgroup="vwap",
-        legendgrouptitle=dict(text="NEM-wide (volume-weighted)"),
-    ),
-    secondary_y=True,
-    row=1,
-    col=1,
-)
-
-fig.add_trace(
-    go.Scatter(
-        name="Average price",
-        x=dispatch_df_2023.SETTLEMENTDATE,
-        y=dispatch_df_2023.PRICE,
-        marker=dict(color="black"),
-        line=dict(width=1),
-        showlegend=False,  # Prevents repetition in the second subplot
-    ),
-    secondary_y=True,
-    row=2,
-    col=1,
-)
+    for row in range(1, len(dates) + 1):
+        fig.update_yaxes(title_text="Volume (MW)", row=row, secondary_y=False)
+        fig.update_yaxes(
+            title_text="Price (AUD/MW/hr)", row=row, secondary_y=True
+        )
+    return fig
 
-fig.update_xaxes(showgrid=False)
-fig.update_yaxes(showgrid=False)
-fig.update_layout(
-    height=450,
-    width=700,
-    barmode="stack",
-    bargap=0,
-    template=plotly_template,
-    title="NEM-wide Aggregate Volume of BESS Offers by Price",
-    legend=dict(
-        xanchor="right",
-        x=1.6,
-    ),
-)
 
-for row in (1, 2):
-    fig.update_yaxes(title_text="Volume (MW)", row=row, secondary_y=False)
-    fig.update_yaxes(title_text="Price (AUD/MW/hr)", row=row, secondary_y=True)
-fig.write_image(Path("plots", "aggregate_bess_bidding_0406_2021_2023.pdf"))
+if __name__ == "__main__":
+    dates = [datetime(2021, 6, 4), datetime(2023, 6, 4)]
+    fig = plot_bess_bidding(
+        {date: load_bess_data(data_path, date) for date in dates}
+    )
+    fig.write_image(Path("plots", "aggregate_bess_bidding_0406_2021_2023.pdf"))
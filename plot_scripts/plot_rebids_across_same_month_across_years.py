@@ -1,78 +1,108 @@
+import argparse
+import calendar
+import re
 from datetime import datetime, timedelta
 from pathlib import Path
-from typing import Dict, List
+from typing import Dict, Optional, Tuple
 
 import matplotlib.pyplot as plt
 import pandas as pd
 
 from analysis_code.duid_registration import (
-    filter_by_date_and_tech,
     get_duid_cap_tech_status_mapping,
+    operating_duid_counts,
 )
+from analysis_code.processed_data import (
+    PROCESSED_FORMATS,
+    find_processed,
+    read_processed,
+)
+
+REBID_COUNTS_FILE_PATTERN = re.compile(r"rebid_counts_(\d{1,2})_(\d{4})")
+
+
+def arg_parser():
+    description = (
+        "Plot the share of rebids by technology type for months across years"
+    )
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument(
+        "-months",
+        type=str,
+        nargs="+",
+        default=["June"],
+        choices=list(calendar.month_name)[1:],
+        help=("Months to plot (full month names). Default June"),
+    )
+    parser.add_argument(
+        "-all_months",
+        action="store_true",
+        help=("Plot all months with rebid counts in data/processed"),
+    )
+    args = parser.parse_args()
+    return args
+
+
+def load_rebid_counts(
+    output_path: Path,
+) -> Dict[Tuple[int, int], pd.DataFrame]:
+    """
+    Loads all rebid count files in output_path, keyed by (month, year) as
+    per their file names (counts for a month include the early hours of the
+    first day of the following month)
+    """
+    rebid_counts = {}
+    for file in output_path.glob("rebid_counts_*"):
+        if file.suffix not in PROCESSED_FORMATS.values():
+            continue
+        if match := REBID_COUNTS_FILE_PATTERN.fullmatch(file.stem):
+            month, year = int(match.group(1)), int(match.group(2))
+            if (month, year) not in rebid_counts:
+                # finds the file in the preferred format (e.g. feather)
+                rebid_counts[(month, year)] = read_processed(
+                    find_processed(file)
+                )
+    return rebid_counts
 
 
 def _make_100percent_stacked_bar_chart(
     percent_df: pd.DataFrame,
     month: int,
     color_map: Dict[str, str],
-    path_to_mappings: Path,
-    path_to_duids: Path,
-    path_to_raw: Path,
+    duid_tech_map: pd.DataFrame,
 ):
-    duid_tech_map = get_duid_cap_tech_status_mapping(
-        path_to_mappings, path_to_duids, path_to_raw
-    )
     fig, ax = plt.subplots(1, 1, figsize=(10, 6))
-    last_value = None
     interval = timedelta(days=365)
-    percent_df = percent_df.sort_values(2020, ascending=False)
-    for col in percent_df:
-        year = datetime.strptime(str(col), "%Y")
-        offset = 0.0
-        year_series = percent_df[col]
-        for index, value in year_series.items():
-            if last_value is not None:
-                ax.bar(
-                    year,
-                    value,
-                    bottom=offset,
-                    label=index,
-                    color=color_map[index],
-                    width=interval,
-                )
-                offset += value
-            else:
-                ax.bar(
-                    year,
-                    value,
-                    label=index,
-                    color=color_map[index],
-                    width=interval,
-                )
-                offset = value
-            if value > 3:
-                duids = filter_by_date_and_tech(
-                    duid_tech_map, year.year, month, index
-                )
-                # because batteries have a gen and load DUID
-                if index == "Battery":
-                    duid_counts = len(duids) / 2
-                # four smelters in data, but Point Henry has been closed since 2014
-                elif index == "Smelter":
-                    duid_counts = 1
-                else:
-                    duid_counts = len(duids)
-
-                ax.text(
-                    year,
-                    (offset - value / 2),
-                    f"{int(value)}% ({int(duid_counts)})",
-                    c="white",
-                    ha="center",
-                    va="center",
-                    fontsize=9,
-                )
-            last_value = value
+    sort_year = 2020 if 2020 in percent_df else percent_df.columns[-1]
+    percent_df = percent_df.sort_values(sort_year, ascending=False)
+    years = [datetime.strptime(str(col), "%Y") for col in percent_df]
+    # bars for each tech are stacked on the cumulative share of preceding techs
+    bottoms = percent_df.cumsum(axis=0) - percent_df
+    for tech in percent_df.index:
+        ax.bar(
+            years,
+            percent_df.loc[tech],
+            bottom=bottoms.loc[tech],
+            label=tech,
+            color=color_map[tech],
+            width=interval,
+        )
+    duid_counts = operating_duid_counts(
+        duid_tech_map, [(year.year, month) for year in years]
+    )
+    label_positions = (bottoms + percent_df / 2).stack()
+    for (tech, col), value in percent_df.stack().items():
+        if value <= 3:
+            continue
+        ax.text(
+            datetime.strptime(str(col), "%Y"),
+            label_positions[(tech, col)],
+            f"{int(value)}% ({int(duid_counts.loc[(col, month), tech])})",
+            c="white",
+            ha="center",
+            va="center",
+            fontsize=9,
+        )
     return fig, ax
 
 
@@ -82,26 +112,41 @@ def plot_rebid_counts_same_month_across_years(
     path_to_duids: Path,
     path_to_raws: Path,
     month_str: str,
+    rebid_counts: Optional[Dict[Tuple[int, int], pd.DataFrame]] = None,
+    duid_tech_map: Optional[pd.DataFrame] = None,
 ):
+    """
+    Plots the share of rebids by technology type for a month across years.
+
+    Rebid counts (see `load_rebid_counts`) and the DUID mapping (see
+    `get_duid_cap_tech_status_mapping`) can be provided to reuse them across
+    plots. Otherwise, they are loaded from output_path and the provided paths.
+    """
     month = datetime.strptime(month_str, "%B").month
-    data: List[pd.DataFrame] = []
-    for file in output_path.glob(f"rebid_counts_{month}*.parquet"):
-        df_month = pd.read_parquet(file)
-        data.append(df_month)
-    df = pd.concat(data, axis=0)
-    df["Year"] = df.index.year
-    by_year = df.groupby("Year").sum()
+    if rebid_counts is None:
+        rebid_counts = load_rebid_counts(output_path)
+    if duid_tech_map is None:
+        duid_tech_map = get_duid_cap_tech_status_mapping(
+            path_to_mappings, path_to_duids, path_to_raws
+        )
+    data = {
+        year: df_month
+        for (file_month, year), df_month in rebid_counts.items()
+        if file_month == month
+    }
+    if not data:
+        raise FileNotFoundError(f"No rebid counts for {month_str}")
+    by_year = pd.DataFrame(
+        {year: df_month.sum() for year, df_month in data.items()}
+    ).T.sort_index()
+    by_year = by_year.fillna(0)
+    by_year.index.name = "Year"
     percent_by_year = (by_year.div(by_year.sum(axis=1), axis=0) * 100).T
     tech_colors = pd.read_json(
         path_to_mappings / Path("color_techtype_mapping.json"), typ="series"
     )
     fig, ax = _make_100percent_stacked_bar_chart(
-        percent_by_year,
-        month,
-        tech_colors,
-        path_to_mappings,
-        path_to_duids,
-        path_to_raws,
+        percent_by_year, month, tech_colors, duid_tech_map
     )
     year_totals = by_year.sum(axis=1)
     for index, item in year_totals.items():
@@ -113,10 +158,8 @@ def plot_rebid_counts_same_month_across_years(
             fontsize=12,
         )
     (handles, labels) = ax.get_legend_handles_labels()
-    patches = handles[0 : int(len(handles) / len(data))]
-    labels = labels[0 : int(len(labels) / len(data))]
     ax.legend(
-        reversed(patches),
+        reversed(handles),
         reversed(labels),
         bbox_to_anchor=(1.12, 0.25),
         loc="lower center",
@@ -125,11 +168,14 @@ def plot_rebid_counts_same_month_across_years(
         ncol=1,
     )
     ax.set_ylabel("Percentage (%)")
+    years = list(by_year.index)
     ax.set_title(
-        ("Rebids by Technology Type " + f"in {month_str} — 2013-2021"),
+        (
+            "Rebids by Technology Type "
+            + f"in {month_str} — {years[0]}-{years[-1]}"
+        ),
         pad=25,
     )
-    years = [y for y in range(2013, 2022, 1)]
     ax.xaxis.set_ticks(
         [datetime.strptime(str(y), "%Y") for y in years],
         [str(y) for y in years],
@@ -138,21 +184,43 @@ def plot_rebid_counts_same_month_across_years(
 
 
 if __name__ == "__main__":
+    args = arg_parser()
     plt.style.use(Path("plot_scripts", "matplotlibrc.mplstyle"))
-    month_str = "June"
-    fig, ax = plot_rebid_counts_same_month_across_years(
-        Path(
-            "data",
-            "processed",
-        ),
-        Path("data", "mappings"),
-        Path("data", "duids"),
-        Path("data", "raw"),
-        month_str,
+    output_path = Path("data", "processed")
+    path_to_mappings = Path("data", "mappings")
+    path_to_duids = Path("data", "duids")
+    path_to_raws = Path("data", "raw")
+    # load rebid counts and the DUID mapping once for all months
+    rebid_counts = load_rebid_counts(output_path)
+    duid_tech_map = get_duid_cap_tech_status_mapping(
+        path_to_mappings, path_to_duids, path_to_raws
     )
-    fig.savefig(
-        Path(
-            "plots",
-            (f"rebids_{month_str.lower()}_" + "share_by_tech_2013_2021.pdf"),
+    if args.all_months:
+        month_strs = [
+            calendar.month_name[month]
+            for month in sorted({month for month, _ in rebid_counts})
+        ]
+    else:
+        month_strs = args.months
+    for month_str in month_strs:
+        fig, ax = plot_rebid_counts_same_month_across_years(
+            output_path,
+            path_to_mappings,
+            path_to_duids,
+            path_to_raws,
+            month_str,
+            rebid_counts=rebid_counts,
+            duid_tech_map=duid_tech_map,
         )
-    )
+        month = datetime.strptime(month_str, "%B").month
+        years = sorted(year for m, year in rebid_counts if m == month)
+        fig.savefig(
+            Path(
+                "plots",
+                (
+                    f"rebids_{month_str.lower()}_"
+                    + f"share_by_tech_{years[0]}_{years[-1]}.pdf"
+                ),
+            )
+        )
+        plt.close(fig)
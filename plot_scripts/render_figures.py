@@ -0,0 +1,288 @@
+import argparse
+import json
+import logging
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+import matplotlib.pyplot as plt
+import plotly.graph_objects as go
+import plotly.io as pio
+from bid_zip_size import plot_zipfile_size_over_time
+from plot_bess_bidding import (
+    bess_partition_paths,
+    load_bess_data,
+    plot_bess_bidding,
+)
+from plot_rebids_across_same_month_across_years import (
+    load_rebid_counts,
+    plot_rebid_counts_same_month_across_years,
+)
+
+from analysis_code.duid_registration import get_duid_cap_tech_status_mapping
+from analysis_code.pipeline import PROJECT_DIR, PipelineState, Stage
+from analysis_code.processed_data import find_processed
+
+FIGURE_STATE_FILE = Path("data", ".figure_state.json")
+PLOT_STYLE = Path("plot_scripts", "matplotlibrc.mplstyle")
+DATA_PATH = Path("data", "processed")
+MAPPINGS_PATH = Path("data", "mappings")
+DUIDS_PATH = Path("data", "duids")
+RAW_PATH = Path("data", "raw")
+
+"""Figures in plots/, as figure specs. Rebid share figures are specified by a
+month (full name) and years, BESS bidding figures by dates (YYYY-MM-DD) and
+bid zip size figures by a start and (exclusive) end year. An output path can
+be provided using "output".
+"""
+DEFAULT_FIGURE_SPECS: List[Dict[str, Any]] = [
+    {
+        "figure": "rebid_share",
+        "month": "June",
+        "years": list(range(2013, 2022)),
+    },
+    {"figure": "bid_zip_size", "start_year": 2012, "end_year": 2023},
+    {"figure": "bess_bidding", "dates": ["2021-06-04", "2023-06-04"]},
+]
+
+# inputs loaded once in the main process and shared with render processes
+_shared: Dict[str, Any] = {}
+
+
+def arg_parser():
+    description = (
+        "Render a batch of figures in parallel, skipping figures whose "
+        + "inputs have not changed since they were last rendered"
+    )
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument(
+        "-specs",
+        type=str,
+        help=("JSON file with a list of figure specs. Default plots/ figures"),
+    )
+    parser.add_argument(
+        "-max_workers",
+        type=int,
+        default=2,
+        help=("Number of render processes. Default 2"),
+    )
+    parser.add_argument(
+        "-force",
+        action="store_true",
+        help=("Render figures even if their inputs have not changed"),
+    )
+    args = parser.parse_args()
+    return args
+
+
+def _spec_dates(spec: Dict[str, Any]) -> List[datetime]:
+    return sorted(datetime.strptime(d, "%Y-%m-%d") for d in spec["dates"])
+
+
+def figure_output(spec: Dict[str, Any]) -> Path:
+    if "output" in spec:
+        return Path(spec["output"])
+    if spec["figure"] == "rebid_share":
+        years = sorted(spec["years"])
+        name = (
+            f"rebids_{spec['month'].lower()}_share_by_tech_"
+            + f"{years[0]}_{years[-1]}.pdf"
+        )
+    elif spec["figure"] == "bid_zip_size":
+        name = (
+            "monthly_bidding_data_size_"
+            + f"{spec['start_year']}_{spec['end_year']}.pdf"
+        )
+    elif spec["figure"] == "bess_bidding":
+        dates = _spec_dates(spec)
+        if len({d.strftime("%d%m") for d in dates}) == 1:
+            days = dates[0].strftime("%d%m") + "_"
+            days += "_".join(str(d.year) for d in dates)
+        else:
+            days = "_".join(d.strftime("%Y%m%d") for d in dates)
+        name = f"aggregate_bess_bidding_{days}.pdf"
+    else:
+        raise ValueError(f"Unknown figure {spec['figure']}")
+    return Path("plots", name)
+
+
+def _zip_size_data(spec: Dict[str, Any]) -> Path:
+    return DATA_PATH / Path(
+        "bidperoffer_monthly_zip_size_"
+        + f"{spec['start_year']}_{spec['end_year'] - 1}"
+    )
+
+
+def figure_inputs(spec: Dict[str, Any]) -> Tuple[str, ...]:
+    """
+    Files (relative to the project directory) that a figure is rendered from
+    """
+    if spec["figure"] == "rebid_share":
+        month = datetime.strptime(spec["month"], "%B").month
+        return (
+            "plot_scripts/plot_rebids_across_same_month_across_years.py",
+            str(PLOT_STYLE),
+            *[
+                str(DATA_PATH / Path(f"rebid_counts_{month}_{year}.*"))
+                for year in spec["years"]
+            ],
+            str(MAPPINGS_PATH),
+            str(DUIDS_PATH / Path("*.csv")),
+        )
+    elif spec["figure"] == "bid_zip_size":
+        return (
+            "plot_scripts/bid_zip_size.py",
+            str(PLOT_STYLE),
+            str(_zip_size_data(spec).with_suffix(".*")),
+        )
+    elif spec["figure"] == "bess_bidding":
+        inputs = ["plot_scripts/plot_bess_bidding.py"]
+        for date in _spec_dates(spec):
+            day = date.strftime("%Y%m%d")
+            inputs += [
+                str(DATA_PATH / Path(f"agg_bess_{data}_data_{day}.csv"))
+                for data in ("bid", "dispatch")
+            ]
+            inputs += [
+                str(partition)
+                for partition in bess_partition_paths(DATA_PATH, date)
+            ]
+        return tuple(inputs)
+    else:
+        raise ValueError(f"Unknown figure {spec['figure']}")
+
+
+def figure_stage(spec: Dict[str, Any]) -> Stage:
+    """
+    Represents a figure as a pipeline stage so that input and output hashes
+    can be tracked by `PipelineState`
+    """
+    return Stage(
+        str(figure_output(spec)),
+        ("render_figures", json.dumps(spec, sort_keys=True)),
+        figure_inputs(spec),
+        (str(figure_output(spec)),),
+    )
+
+
+def _init_worker(shared: Dict[str, Any], warm_kaleido: bool) -> None:
+    _shared.update(shared)
+    plt.style.use(PLOT_STYLE)
+    if warm_kaleido:
+        # starts the kaleido subprocess so that it is reused for each figure
+        pio.to_image(go.Figure(), format="pdf")
+
+
+def render_figure(spec: Dict[str, Any]) -> Path:
+    output = figure_output(spec)
+    if not output.parent.exists():
+        output.parent.mkdir(parents=True)
+    if spec["figure"] == "rebid_share":
+        rebid_counts = {
+            (month, year): df
+            for (month, year), df in _shared["rebid_counts"].items()
+            if year in spec["years"]
+        }
+        fig, _ = plot_rebid_counts_same_month_across_years(
+            DATA_PATH,
+            MAPPINGS_PATH,
+            DUIDS_PATH,
+            RAW_PATH,
+            spec["month"],
+            rebid_counts=rebid_counts,
+            duid_tech_map=_shared["duid_tech_map"],
+        )
+        fig.savefig(output)
+        plt.close(fig)
+    elif spec["figure"] == "bid_zip_size":
+        data_path = find_processed(_zip_size_data(spec))
+        if data_path is None:
+            raise FileNotFoundError(f"No zip size data for {spec}")
+        fig, _ = plot_zipfile_size_over_time(
+            data_path, spec["start_year"], spec["end_year"]
+        )
+        fig.savefig(output, dpi=600)
+        plt.close(fig)
+    elif spec["figure"] == "bess_bidding":
+        bess_data = {
+            date: load_bess_data(DATA_PATH, date) for date in _spec_dates(spec)
+        }
+        plot_bess_bidding(bess_data).write_image(output)
+    else:
+        raise ValueError(f"Unknown figure {spec['figure']}")
+    return output
+
+
+def render_figures(
+    specs: List[Dict[str, Any]], max_workers: int = 2, force: bool = False
+) -> Dict[str, str]:
+    """
+    Renders figures in a process pool, skipping figures whose inputs (and
+    outputs) have not changed since they were last rendered.
+
+    Inputs shared across figures (rebid counts and the DUID mapping) are loaded
+    once and passed to each render process, and kaleido is started once per
+    process if any plotly figures are to be rendered.
+
+    Returns the status of each figure ("rendered", "up to date" or "failed").
+    """
+    state = PipelineState(PROJECT_DIR / FIGURE_STATE_FILE)
+    status: Dict[str, str] = {}
+    stale = []
+    for spec in specs:
+        stage = figure_stage(spec)
+        reason = "forced" if force else state.out_of_date_reason(stage)
+        if reason is None:
+            status[stage.name] = "up to date"
+        else:
+            logging.info(f"Rendering {stage.name} ({reason})")
+            stale.append((spec, stage))
+    if not stale:
+        return status
+    shared: Dict[str, Any] = {}
+    if any(spec["figure"] == "rebid_share" for spec, _ in stale):
+        shared["rebid_counts"] = load_rebid_counts(DATA_PATH)
+        shared["duid_tech_map"] = get_duid_cap_tech_status_mapping(
+            MAPPINGS_PATH, DUIDS_PATH, RAW_PATH
+        )
+    warm_kaleido = any(spec["figure"] == "bess_bidding" for spec, _ in stale)
+    with ProcessPoolExecutor(
+        max_workers=min(max_workers, len(stale)),
+        initializer=_init_worker,
+        initargs=(shared, warm_kaleido),
+    ) as executor:
+        futures = {
+            executor.submit(render_figure, spec): stage
+            for spec, stage in stale
+        }
+        for future in as_completed(futures):
+            stage = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                logging.error(f"Failed to render {stage.name}: {e}")
+                status[stage.name] = "failed"
+                continue
+            state.record(stage)
+            status[stage.name] = "rendered"
+    return status
+
+
+def main():
+    logging.basicConfig(
+        format="\n%(levelname)s:%(message)s", level=logging.INFO
+    )
+    args = arg_parser()
+    if args.specs:
+        with open(args.specs, "r") as f:
+            specs = json.load(f)
+    else:
+        specs = DEFAULT_FIGURE_SPECS
+    status = render_figures(specs, args.max_workers, args.force)
+    for name, figure_status in status.items():
+        logging.info(f"{name}: {figure_status}")
+
+
+if __name__ == "__main__":
+    main()
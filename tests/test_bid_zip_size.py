@@ -0,0 +1,66 @@
+import json
+import sys
+import threading
+from pathlib import Path
+
+PROJECT_DIR = Path(__file__).parents[1]
+sys.path.insert(0, str(PROJECT_DIR / Path("plot_scripts")))
+
+import bid_zip_size  # noqa: E402
+
+
+class FakeListing:
+    """
+    Stand-in for `get_table_names_and_sizes` that records the months requested
+    """
+
+    def __init__(self):
+        self.requested = []
+        self._lock = threading.Lock()
+
+    def __call__(self, year: int, month: int, directory: str):
+        with self._lock:
+            self.requested.append((year, month, directory))
+        size = 1000 * year + month
+        return {
+            f"PUBLIC_DVD_BIDPEROFFER_{year}{month:02d}010000.zip": size,
+            f"PUBLIC_DVD_DISPATCHLOAD_{year}{month:02d}010000.zip": 1,
+        }
+
+
+def year_months(start_year: int, end_year: int):
+    return [
+        (year, month)
+        for year in range(start_year, end_year + 1)
+        for month in range(1, 13)
+    ]
+
+
+def test_only_months_missing_from_cache_are_scraped(tmp_path: Path):
+    cache_path = tmp_path / Path("table_sizes.json")
+    listing = FakeListing()
+    first = bid_zip_size.scrape_table_sizes(
+        year_months(2019, 2019), cache_path=cache_path, get_sizes=listing
+    )
+    assert sorted(listing.requested) == [
+        (2019, month, "DATA") for month in range(1, 13)
+    ]
+    assert len(json.loads(cache_path.read_text())) == 12
+
+    listing.requested = []
+    extended = bid_zip_size.scrape_table_sizes(
+        year_months(2019, 2020), cache_path=cache_path, get_sizes=listing
+    )
+    assert sorted(listing.requested) == [
+        (2020, month, "DATA") for month in range(1, 13)
+    ]
+    assert len(extended) == 24
+    for key, sizes in first.items():
+        assert extended[key] == sizes
+    assert extended[(2020, 6)] == listing(2020, 6, "DATA")
+
+    listing.requested = []
+    bid_zip_size.scrape_table_sizes(
+        year_months(2019, 2020), cache_path=cache_path, get_sizes=listing
+    )
+    assert listing.requested == []
@@ -0,0 +1,178 @@
+import json
+import os
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+PROJECT_DIR = Path(__file__).parents[1]
+# data scripts import their siblings, so are run from (or with) their directory
+sys.path.insert(0, str(PROJECT_DIR / Path("data_scripts")))
+
+import ingest_bid_files  # noqa: E402
+
+from analysis_code.processed_data import (  # noqa: E402
+    PROCESSED_FORMATS,
+    find_processed,
+    read_processed,
+)
+from analysis_code.rebidding_analysis import (  # noqa: E402
+    rebid_counts_across_day_out_of_core,
+)
+
+MAPPINGS_PATH = PROJECT_DIR / Path("data", "mappings")
+DUIDS_PATH = PROJECT_DIR / Path("data", "duids")
+DUIDS = ["BALBG1", "HPRG1", "LIDDELL1", "BAYSW1", "MACARTH1"]
+DT_FORMAT = "%Y/%m/%d %H:%M:%S"
+
+
+def bidperoffer_rows(day: str, n: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    trading_date = pd.Timestamp(day)
+    offer_times = trading_date - pd.Timedelta(hours=12)
+    offer_times += pd.to_timedelta(rng.integers(0, 2500, n), unit="min")
+    return pd.DataFrame(
+        {
+            "DUID": rng.choice(DUIDS, n),
+            "BIDTYPE": "ENERGY",
+            "TRADINGDATE": trading_date.strftime(DT_FORMAT),
+            "OFFERDATETIME": offer_times.strftime(DT_FORMAT),
+            "DIRECTION": "GEN",
+            "PERIODID": rng.integers(1, 289, n),
+            "MAXAVAIL": rng.integers(0, 100, n),
+            **{
+                f"BANDAVAIL{band}": rng.integers(0, 10, n)
+                for band in range(1, 11)
+            },
+        }
+    )
+
+
+def write_bid_file(path: Path, df: pd.DataFrame) -> None:
+    """
+    Writes BIDPEROFFER rows as an AEMO data CSV
+    """
+    header = "I,BIDS,BIDPEROFFER,1," + ",".join(df.columns)
+    rows = [
+        "D,BIDS,BIDPEROFFER,1," + ",".join(map(str, row))
+        for row in df.itertuples(index=False)
+    ]
+    lines = ["C,NEMP.WORLD,BIDPEROFFER", header, *rows, "C,END OF REPORT"]
+    path.write_text("\n".join(lines) + "\n")
+
+
+def ingest(watch_dir: Path, tmp_path: Path, **kwargs) -> None:
+    ingest_bid_files.watch_directory(
+        watch_dir,
+        tmp_path / Path("partitioned"),
+        tmp_path / Path("processed"),
+        MAPPINGS_PATH,
+        DUIDS_PATH,
+        once=True,
+        **kwargs,
+    )
+
+
+def read_manifest(tmp_path: Path) -> dict:
+    manifest_file = tmp_path / Path(
+        "partitioned", ingest_bid_files.INGEST_MANIFEST_FILE
+    )
+    if not manifest_file.exists():
+        return {}
+    return json.loads(manifest_file.read_text())
+
+
+def partition_files(tmp_path: Path):
+    return sorted((tmp_path / Path("partitioned")).rglob("*.parquet"))
+
+
+def touch(path: Path) -> None:
+    """
+    Changes a file's modification time (and so its fingerprint), e.g. to
+    retry ingesting it. Earlier times are used so that the file is settled.
+    """
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns - 10 * 10**9))
+
+
+@pytest.fixture
+def watch_dir(tmp_path: Path) -> Path:
+    watch_dir = tmp_path / Path("watch")
+    watch_dir.mkdir()
+    return watch_dir
+
+
+def test_failed_ingest_is_rolled_back_and_retried(
+    watch_dir: Path, tmp_path: Path, monkeypatch
+):
+    bid_file = watch_dir / Path("PUBLIC_DVD_BIDPEROFFER_202106010000.CSV")
+    write_bid_file(bid_file, bidperoffer_rows("2021-06-01", 500))
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("rebid counts failed")
+
+    with monkeypatch.context() as m:
+        m.setattr(ingest_bid_files, "update_rebid_counts", fail)
+        ingest(watch_dir, tmp_path)
+    assert partition_files(tmp_path) == []
+    assert bid_file.name not in read_manifest(tmp_path)
+    # the file is ingested once retried, without duplicate partitions
+    touch(bid_file)
+    ingest(watch_dir, tmp_path)
+    manifest = read_manifest(tmp_path)
+    assert len(partition_files(tmp_path)) == 1
+    assert manifest[bid_file.name]["days"] == ["2021-06-01"]
+
+
+def test_changed_file_replaces_previous_partitions(
+    watch_dir: Path, tmp_path: Path
+):
+    bid_file = watch_dir / Path("PUBLIC_DVD_BIDPEROFFER_202106010000.CSV")
+    write_bid_file(bid_file, bidperoffer_rows("2021-06-01", 500))
+    ingest(watch_dir, tmp_path)
+    # republished with a different day
+    write_bid_file(bid_file, bidperoffer_rows("2021-06-02", 500, seed=1))
+    touch(bid_file)
+    ingest(watch_dir, tmp_path)
+    assert [p.name[:8] for p in partition_files(tmp_path)] == ["20210602"]
+    counts = pd.read_parquet(
+        find_processed(tmp_path / Path("processed", "rebid_counts_6_2021"))
+    )
+    assert counts.index.min() > pd.Timestamp("2021-06-02 04:00")
+    assert read_manifest(tmp_path)[bid_file.name]["days"] == ["2021-06-02"]
+
+
+@pytest.mark.parametrize("output_format", ["parquet", "feather", "csv"])
+def test_ingest_twice_updates_rebid_counts(
+    watch_dir: Path, tmp_path: Path, output_format: str
+):
+    for day in ("2021-06-01", "2021-06-02"):
+        bid_file = watch_dir / Path(
+            f"PUBLIC_DVD_BIDPEROFFER_{day.replace('-', '')}0000.CSV"
+        )
+        write_bid_file(bid_file, bidperoffer_rows(day, 500))
+        ingest(watch_dir, tmp_path, output_format=output_format)
+    counts_file = find_processed(
+        tmp_path / Path("processed", "rebid_counts_6_2021")
+    )
+    assert counts_file.suffix == PROCESSED_FORMATS[output_format]
+    counts = read_processed(counts_file)
+    expected = pd.concat(
+        [
+            rebid_counts_across_day_out_of_core(
+                tmp_path / Path("partitioned"),
+                MAPPINGS_PATH,
+                DUIDS_PATH,
+                2021,
+                6,
+                day,
+            )
+            for day in (1, 2)
+        ]
+    )
+    assert isinstance(counts.index, pd.DatetimeIndex)
+    pd.testing.assert_frame_equal(
+        counts, expected, check_freq=False, check_dtype=False
+    )
@@ -0,0 +1,135 @@
+import json
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+
+PROJECT_DIR = Path(__file__).parents[1]
+# data scripts import their siblings, so are run from (or with) their directory
+sys.path.insert(0, str(PROJECT_DIR / Path("data_scripts")))
+
+import opennem_facilities  # noqa: E402
+
+STATION_CODES = ["BAYSWATER", "HORNSDALE", "LIDDELL"]
+
+
+def station_json(code: str) -> dict:
+    return {
+        "code": code,
+        "name": code.title(),
+        "location": {"lat": -33.0, "lng": 151.0},
+        "facilities": [
+            {
+                "network_region": "NSW1",
+                "code": code[:6] + "1",
+                "fueltech": "coal_black",
+                "capacity_registered": 660.0,
+                "status": "operating",
+            }
+        ],
+    }
+
+
+MASTER_JSON = {
+    "features": [
+        {"properties": {"network": "NEM", "station_code": code}}
+        for code in STATION_CODES
+    ]
+}
+RESOURCES = {"/geo.json": MASTER_JSON}
+RESOURCES.update(
+    {f"/station/{code}": station_json(code) for code in STATION_CODES}
+)
+
+
+class StationHandler(BaseHTTPRequestHandler):
+    """
+    Serves the master geojson and station JSON with an ETag for each
+    resource, and records each request's path and If-None-Match header
+    """
+
+    requests = []
+
+    def do_GET(self):
+        etag = f'"{self.path}-v1"'
+        if_none_match = self.headers.get("If-None-Match")
+        self.requests.append((self.path, if_none_match))
+        if self.path not in RESOURCES:
+            self.send_response(404)
+            self.end_headers()
+            return None
+        if if_none_match == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return None
+        body = json.dumps(RESOURCES[self.path]).encode()
+        self.send_response(200)
+        self.send_header("ETag", etag)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server_url():
+    StationHandler.requests = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StationHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def station_requests():
+    return {
+        path: if_none_match
+        for path, if_none_match in StationHandler.requests
+        if path.startswith("/station/")
+    }
+
+
+def test_stations_are_revalidated_with_conditional_requests(
+    server_url: str, tmp_path: Path
+):
+    def download():
+        opennem_facilities.download_all_stations(
+            max_workers=2,
+            local_dir=tmp_path,
+            geojson_url=server_url + "/geo.json",
+            station_url=server_url + "/station/{}",
+        )
+
+    download()
+    first_run = station_requests()
+    assert sorted(first_run) == [f"/station/{c}" for c in STATION_CODES]
+    assert all(if_none_match is None for if_none_match in first_run.values())
+    for code in STATION_CODES:
+        assert opennem_facilities.load_station(code, tmp_path) == (
+            station_json(code)
+        )
+    modified_times = {
+        f.name: f.stat().st_mtime_ns for f in tmp_path.glob("*.json")
+    }
+
+    StationHandler.requests = []
+    download()
+    second_run = station_requests()
+    assert second_run == {
+        f"/station/{code}": f'"/station/{code}-v1"' for code in STATION_CODES
+    }
+    # unmodified stations (and the master geojson) are not rewritten
+    for name, mtime in modified_times.items():
+        if name != opennem_facilities.VALIDATORS_FILE:
+            assert (tmp_path / Path(name)).stat().st_mtime_ns == mtime
+    for code in STATION_CODES:
+        assert opennem_facilities.load_station(code, tmp_path) == (
+            station_json(code)
+        )
@@ -0,0 +1,31 @@
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from analysis_code.processed_data import (
+    PROCESSED_FORMATS,
+    find_processed,
+    read_processed,
+    write_processed,
+)
+
+
+@pytest.mark.parametrize("old_format", list(PROCESSED_FORMATS))
+@pytest.mark.parametrize("new_format", list(PROCESSED_FORMATS))
+def test_rewrite_in_another_format_replaces_output(
+    tmp_path: Path, old_format: str, new_format: str
+):
+    path = tmp_path / Path("rebid_counts_6_2021")
+    index = pd.date_range("2021-06-01 04:05", periods=3, freq="5min")
+    write_processed(pd.DataFrame({"REBIDS": [1, 2, 3]}, index=index), path)
+    write_processed(
+        pd.DataFrame({"REBIDS": [1, 2, 3]}, index=index), path, old_format
+    )
+    new_df = pd.DataFrame({"REBIDS": [4, 5, 6]}, index=index)
+    out_file = write_processed(new_df, path, new_format)
+    assert find_processed(path) == out_file
+    assert sorted(tmp_path.iterdir()) == [out_file]
+    pd.testing.assert_frame_equal(
+        read_processed(out_file), new_df, check_freq=False
+    )
@@ -0,0 +1,70 @@
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from analysis_code.rebid_sketches import (
+    build_sketches,
+    estimate_cardinality,
+    exact_rebid_counts,
+    hll_relative_error,
+    scan_sketches,
+)
+from analysis_code.rebidding_analysis import get_gen_tech_mapping
+
+PROJECT_DIR = Path(__file__).parents[1]
+MAPPINGS_PATH = PROJECT_DIR / Path("data", "mappings")
+DUIDS_PATH = PROJECT_DIR / Path("data", "duids")
+DUIDS = ["BALBG1", "HPRG1", "LIDDELL1", "BAYSW1", "MACARTH1"]
+TRADING_DATES = [datetime(2021, 6, day) for day in (1, 2, 3)]
+PRECISION = 8
+
+
+def write_day_partition(
+    partitioned_path: Path, trading_date: datetime, n: int, seed: int
+) -> None:
+    """
+    Writes a BIDPEROFFER partition of `n` bids (with some duplicate keys)
+    """
+    rng = np.random.default_rng(seed)
+    day = pd.Timestamp(trading_date)
+    offer_times = day - pd.Timedelta(hours=12)
+    offer_times += pd.to_timedelta(rng.integers(0, 2500, n), unit="min")
+    partition = partitioned_path / Path(
+        "TRADINGDATE", f"{trading_date:%Y%m%d}-chunk-0.parquet"
+    )
+    partition.parent.mkdir(parents=True, exist_ok=True)
+    pd.DataFrame(
+        {
+            "TRADINGDATE": day,
+            "OFFERDATETIME": offer_times,
+            "DUID": rng.choice(DUIDS, n),
+            "PERIODID": rng.integers(1, 289, n),
+        }
+    ).to_parquet(partition, index=False)
+
+
+@pytest.mark.parametrize("by", [["YEAR", "Tech"], ["DATE"]])
+def test_estimates_are_within_relative_error(tmp_path: Path, by):
+    partitioned_path = tmp_path / Path("partitioned")
+    for seed, trading_date in enumerate(TRADING_DATES):
+        write_day_partition(partitioned_path, trading_date, 20000, seed)
+    mapping = get_gen_tech_mapping(MAPPINGS_PATH, DUIDS_PATH)
+    build_sketches(
+        partitioned_path, tmp_path, TRADING_DATES, mapping, PRECISION
+    )
+    estimates = estimate_cardinality(
+        scan_sketches(tmp_path, TRADING_DATES, by, PRECISION), by, PRECISION
+    ).collect()
+    exact = exact_rebid_counts(
+        partitioned_path, TRADING_DATES, mapping, by
+    ).collect()
+    compared = estimates.join(exact, on=by, suffix="_EXACT")
+    assert compared.height == exact.height
+    # counts are large enough for the HyperLogLog (not linear counting) range
+    assert compared["REBIDS_EXACT"].min() > 2.5 * 2**PRECISION
+    relative_error = (compared["REBIDS"] / compared["REBIDS_EXACT"] - 1).abs()
+    # within three standard errors (the data, and so estimates, are fixed)
+    assert relative_error.max() < 3 * hll_relative_error(PRECISION)
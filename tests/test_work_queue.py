@@ -0,0 +1,117 @@
+import json
+import multiprocessing as mp
+import os
+import signal
+import time
+from pathlib import Path
+
+import pandas as pd
+
+from analysis_code.rebid_work_queue import (
+    merge_rebid_counts,
+    rebid_count_tasks,
+)
+from analysis_code.work_queue import WorkQueue, run_worker
+
+N_TASKS = 12
+LEASE_SECS = 1.0
+POLL_SECS = 0.2
+
+
+def task_result(lease) -> pd.DataFrame:
+    time.sleep(0.05)
+    return pd.DataFrame({"TASK": [lease.task["n"]]})
+
+
+def stalled_task(lease) -> None:
+    time.sleep(60)
+
+
+def work(queue_path: Path, slow: bool = False) -> int:
+    handler = stalled_task if slow else task_result
+    return run_worker(
+        WorkQueue(queue_path, LEASE_SECS), handler, poll_secs=POLL_SECS
+    )
+
+
+def wait_for_lease(queue_path: Path, pid: int, timeout: float = 10.0):
+    """
+    ID of the task leased by process `pid`, once it has claimed one
+    """
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        for lease_file in (queue_path / Path("leases")).glob("*.lease"):
+            try:
+                lease = json.loads(lease_file.read_text())
+            except (FileNotFoundError, json.JSONDecodeError):
+                continue
+            if lease["worker"].endswith(f":{pid}"):
+                return lease_file.stem, lease["worker"]
+        time.sleep(0.05)
+    raise TimeoutError(f"Process {pid} did not claim a task")
+
+
+def test_tasks_finish_once_after_a_worker_is_killed(tmp_path: Path):
+    queue_path = tmp_path / Path("queue")
+    queue = WorkQueue(queue_path, LEASE_SECS)
+    tasks = [{"id": f"task-{n:02d}", "n": n} for n in range(N_TASKS)]
+    assert queue.add_tasks(tasks) == N_TASKS
+
+    # a worker killed mid-task keeps its lease until it expires
+    killed = mp.Process(target=work, args=(queue_path, True))
+    killed.start()
+    killed_task, killed_worker = wait_for_lease(queue_path, killed.pid)
+    os.kill(killed.pid, signal.SIGKILL)
+    killed.join()
+    assert (queue_path / Path("leases", f"{killed_task}.lease")).exists()
+    assert queue.status()["leased"] == 1
+
+    with mp.Pool(3) as pool:
+        n_run = pool.starmap(work, [(queue_path,)] * 3)
+    # every task is finished exactly once, and not by the killed worker
+    assert sum(n_run) == N_TASKS
+    assert sorted(queue.done_ids()) == [task["id"] for task in tasks]
+    for task in tasks:
+        done = queue.done(task["id"])
+        assert done["status"] == "ok"
+        assert done["worker"] != killed_worker
+        result = pd.read_parquet(queue.result_file(task["id"]))
+        assert result["TASK"].tolist() == [task["n"]]
+    assert list((queue_path / Path("leases")).iterdir()) == []
+    assert queue.status() == {
+        "pending": 0,
+        "leased": 0,
+        "ok": N_TASKS,
+        "no_data": 0,
+        "failed": 0,
+    }
+
+
+def day_counts(lease) -> pd.DataFrame:
+    interval = pd.Timestamp(2021, 6, lease.task["day"], 5)
+    return pd.DataFrame({"REBIDS": [1]}, index=[interval])
+
+
+def test_months_with_failed_days_are_not_merged(tmp_path: Path):
+    queue = WorkQueue(tmp_path / Path("queue"), LEASE_SECS)
+    queue.add_tasks(rebid_count_tasks([2021], [6]))
+
+    def fail_third(lease) -> pd.DataFrame:
+        if lease.task["day"] == 3:
+            raise RuntimeError("failed to count rebids")
+        return day_counts(lease)
+
+    run_worker(queue, fail_third, poll_secs=POLL_SECS)
+    assert merge_rebid_counts(queue, tmp_path) == []
+    assert list(tmp_path.glob("rebid_counts_*")) == []
+
+    merged = merge_rebid_counts(queue, tmp_path, allow_partial=True)
+    assert merged == [("rebid_counts", 2021, 6)]
+    counts = pd.read_parquet(tmp_path / Path("rebid_counts_6_2021.parquet"))
+    assert len(counts) == 29
+    # once requeued and successful, the whole month is merged
+    assert queue.reset_failed() == 1
+    run_worker(queue, day_counts, poll_secs=POLL_SECS)
+    assert merge_rebid_counts(queue, tmp_path) == merged
+    counts = pd.read_parquet(tmp_path / Path("rebid_counts_6_2021.parquet"))
+    assert len(counts) == 30